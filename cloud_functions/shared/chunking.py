@@ -0,0 +1,200 @@
+"""
+Text chunker shared by the webhook and trans functions.
+
+The Cloud Build config of each function copies this module into the function's source directory
+before deploying it, and both `main` modules import the chunker from there.
+"""
+import re
+from typing import Dict, Iterator, Union
+
+# Boundary types of `iter_chunks`, each falling back to the ones after it when a window has none
+CHUNK_BOUNDARIES = ["sentence", "newline", "whitespace"]
+
+# Boundaries of `iter_chunks` that reproduce a historical chunker exactly
+COMPAT_BOUNDARIES = ["compat_split_input", "compat_udf"]
+
+SENTENCE_END_REGEX = re.compile(r"[.!?](?=\s)")
+WHITESPACE_REGEX = re.compile(r"\s")
+
+# Characters removed by JavaScript's String.prototype.trim: white space and line terminators
+JS_TRIM_CHARACTERS = "\t\n\v\f\r \u00a0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000\ufeff"
+
+def find_chunk_end(text: str, start: int, end: int, boundary: str, min_size: int = 1) -> int:
+    """
+    Find where a chunk starting at `start` should end, at the last boundary before `end`.
+
+    Args:
+        text (str): The text being chunked.
+        start (int): The start index of the chunk.
+        end (int): The largest allowed end index of the chunk.
+        boundary (str): The preferred boundary type, one of CHUNK_BOUNDARIES.
+        min_size (int): Boundaries leaving a chunk of `min_size` characters or fewer are ignored.
+
+    Returns:
+        int: The end index (exclusive) of the chunk, `end` if the window holds no boundary.
+    """
+    for boundary_type in CHUNK_BOUNDARIES[CHUNK_BOUNDARIES.index(boundary):]:
+        if boundary_type == "sentence":
+            # Look one character past the window so a sentence end right at its edge is recognised
+            index = -1
+            for match in SENTENCE_END_REGEX.finditer(text, start, min(end + 1, len(text))):
+                if match.start() < end:
+                    index = match.start()
+        elif boundary_type == "newline":
+            index = text.rfind("\n", start, end)
+        else:
+            index = -1
+            for match in WHITESPACE_REGEX.finditer(text, start, end):
+                index = match.start()
+        if index + 1 - start > min_size:
+            return index + 1
+    return end
+
+def chunk_length(text: str, boundary: str) -> int:
+    """
+    Measure a text the way the chunker does.
+
+    Args:
+        text (str): The text.
+        boundary (str): The chunk boundary type, see `iter_chunks`.
+
+    Returns:
+        int: The number of UTF-16 code units for "compat_udf", like a JavaScript string length,
+            else the number of characters.
+    """
+    if boundary == "compat_udf":
+        return len(text.encode("utf-16-le", "surrogatepass")) // 2
+    return len(text)
+
+def iter_split_input_chunks(text: str, max_chunk_size: int) -> Iterator[Dict[str, Union[str, int]]]:
+    """
+    Split a text exactly like the historical `split_input` of the webhook.
+
+    A chunk ends after the last period before index `max_chunk_size` of the remaining text, or
+    after `max_chunk_size + 1` characters when there is none, and is stripped of whitespace.
+    Empty chunks are kept.
+
+    Args:
+        text (str): The text to be split into chunks.
+        max_chunk_size (int): The maximum size of each chunk.
+
+    Yields:
+        Dict[str, Union[str, int]]: Chunks as dictionaries with keys 'chunk_content' (str) and 'chunk_size' (int).
+    """
+    if len(text) <= max_chunk_size:
+        yield {"chunk_content": text, "chunk_size": len(text)}
+        return
+
+    start = 0
+    while start < len(text):
+        # Find the last period (.) within the maximum chunk size, else cut one past it
+        last_period_index = text.rfind('.', start, start + max_chunk_size)
+        if last_period_index <= start:
+            last_period_index = start + max_chunk_size
+        end = last_period_index + 1
+
+        # Trim leading and trailing whitespace
+        chunk = text[start:end].strip()
+        yield {"chunk_content": chunk, "chunk_size": len(chunk)}
+
+        start = end
+
+def iter_udf_chunks(text: str, max_chunk_size: int) -> Iterator[Dict[str, Union[str, int]]]:
+    """
+    Split a text exactly like the JavaScript UDF of `trans_job_posts` in the trans function.
+
+    Lengths and indices count UTF-16 code units. A chunk ends after the last period at or before
+    index `max_chunk_size` of the remaining text, or after `max_chunk_size + 1` code units when
+    there is none, and is trimmed like JavaScript's `trim`. Empty chunks are kept.
+
+    Args:
+        text (str): The text to be split into chunks.
+        max_chunk_size (int): The maximum size of each chunk.
+
+    Yields:
+        Dict[str, Union[str, int]]: Chunks as dictionaries with keys 'chunk_content' (str) and 'chunk_size' (int).
+    """
+    # Texts outside the Basic Multilingual Plane are walked one UTF-16 code unit per character
+    units = text
+    if chunk_length(text, "compat_udf") != len(text):
+        encoded = text.encode("utf-16-le", "surrogatepass")
+        units = "".join(chr(int.from_bytes(encoded[i:i + 2], "little")) for i in range(0, len(encoded), 2))
+
+    if len(units) <= max_chunk_size:
+        yield {"chunk_content": text, "chunk_size": len(units)}
+        return
+
+    start = 0
+    while start < len(units):
+        # lastIndexOf('.', maxChunkSize) also matches at index maxChunkSize
+        last_period_index = units.rfind('.', start, start + max_chunk_size + 1) - start
+        if last_period_index <= 0:
+            last_period_index = max_chunk_size
+        end = start + last_period_index + 1
+
+        chunk = units[start:end].strip(JS_TRIM_CHARACTERS)
+        size = len(chunk)
+        if units is not text:
+            # Join surrogate pairs again, a pair split between chunks cannot be stored and is replaced
+            chunk = chunk.encode("utf-16-le", "surrogatepass").decode("utf-16-le", "replace")
+        yield {"chunk_content": chunk, "chunk_size": size}
+
+        start = end
+
+def iter_chunks(text: str, max_chunk_size: int, boundary: str, overlap: int = 0) -> Iterator[Dict[str, Union[str, int]]]:
+    """
+    Lazily split a text into chunks of at most `max_chunk_size` characters, in linear time.
+
+    The text is never copied beyond the chunks themselves: the chunker walks an index through
+    it. With `boundary` set to one of CHUNK_BOUNDARIES, every chunk ends at the last boundary of
+    that type within the size limit, falling back to finer boundaries and then to a hard cut,
+    consecutive chunks share up to `overlap` characters, starting at a word, and empty chunks
+    are skipped. The COMPAT_BOUNDARIES ignore the overlap and reproduce a historical chunker
+    exactly: "compat_split_input" the webhook's `split_input` (see `iter_split_input_chunks`) and
+    "compat_udf" the JavaScript UDF of the trans function (see `iter_udf_chunks`).
+
+    Args:
+        text (str): The text to be split into chunks.
+        max_chunk_size (int): The maximum size of each chunk.
+        boundary (str): One of CHUNK_BOUNDARIES or COMPAT_BOUNDARIES.
+        overlap (int): Number of characters repeated from the end of one chunk at the start of
+            the next, smaller than `max_chunk_size`.
+
+    Yields:
+        Dict[str, Union[str, int]]: Chunks as dictionaries with keys 'chunk_content' (str) and 'chunk_size' (int).
+    """
+    if boundary not in CHUNK_BOUNDARIES and boundary not in COMPAT_BOUNDARIES:
+        raise ValueError(f"Unknown chunk boundary: {boundary}")
+    if overlap < 0 or overlap >= max_chunk_size:
+        raise ValueError("The chunk overlap must be between 0 and max_chunk_size - 1")
+
+    if boundary == "compat_split_input":
+        yield from iter_split_input_chunks(text, max_chunk_size)
+        return
+    if boundary == "compat_udf":
+        yield from iter_udf_chunks(text, max_chunk_size)
+        return
+
+    if len(text) <= max_chunk_size:
+        yield {"chunk_content": text, "chunk_size": len(text)}
+        return
+
+    start = 0
+    while start < len(text):
+        end = min(start + max_chunk_size, len(text))
+        if end < len(text):
+            # A chunk must hold more than the overlap, so that the walk keeps moving forward
+            end = find_chunk_end(text, start, end, boundary, min_size=max(overlap, 1))
+        next_start = end
+        if overlap and end < len(text):
+            # Start the next chunk at the first word beginning within the overlap, if any
+            match = WHITESPACE_REGEX.search(text, end - overlap, end)
+            if match:
+                next_start = match.end()
+
+        # Trim leading and trailing whitespace
+        chunk = text[start:end].strip()
+        if chunk:
+            yield {"chunk_content": chunk, "chunk_size": len(chunk)}
+
+        start = next_start
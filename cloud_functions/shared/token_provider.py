@@ -0,0 +1,90 @@
+"""
+Google Cloud access token provider shared by the webhook and trans functions.
+
+The Cloud Build config of each function copies this module into the function's source directory
+before deploying it, and both `main` modules import the provider from there.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import List
+
+import google.auth
+import google.auth.transport.requests
+from google.oauth2.credentials import Credentials
+
+class TokenProvider:
+    """
+    Cache Google Cloud credentials and their access token, refreshing them before they expire.
+
+    Credentials are resolved once with `google.auth.default`. A token that is missing or about to
+    expire is refreshed synchronously, while a token inside the refresh margin is refreshed on a
+    background thread so that requests keep using the still-valid token. All methods are safe to
+    call from concurrent requests.
+    """
+
+    def __init__(self, scopes: List[str], refresh_margin: int = 300) -> None:
+        self.scopes = scopes
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._credentials = None
+        self._refreshing = False
+
+    def get_credentials(self) -> Credentials:
+        """
+        Get the cached credentials, refreshing them first if their token is about to expire.
+
+        Returns:
+            Credentials: The Google API credentials.
+        """
+        with self._lock:
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=self.scopes)
+        self._ensure_fresh()
+        return self._credentials
+
+    def get_token(self) -> str:
+        """
+        Get a valid access token.
+
+        Returns:
+            str: The access token.
+        """
+        return self.get_credentials().token
+
+    def _needs_refresh(self, margin: timedelta) -> bool:
+        credentials = self._credentials
+        if not credentials.token:
+            return True
+        # google-auth stores the expiry as a naive UTC datetime
+        return credentials.expiry is not None and credentials.expiry <= datetime.utcnow() + margin
+
+    def _refresh(self) -> None:
+        request = google.auth.transport.requests.Request()
+        self._credentials.refresh(request)
+
+    def _ensure_fresh(self) -> None:
+        if self._needs_refresh(timedelta(seconds=30)):
+            # Expired or missing, every caller waits for a single refresh
+            with self._refresh_lock:
+                if self._needs_refresh(timedelta(seconds=30)):
+                    self._refresh()
+        elif self._needs_refresh(self.refresh_margin):
+            self._start_background_refresh()
+
+    def _start_background_refresh(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh_in_background() -> None:
+            try:
+                with self._refresh_lock:
+                    self._refresh()
+            except Exception as e:
+                print('Error in refreshing credentials: ' + str(e))
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh_in_background, daemon=True).start()
@@ -1,43 +1,43 @@
 import functions_framework
 import os
+import io
+import json
+import re
+import time
+import random
+import sqlite3
 import requests
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from flask import Request
 from flask import jsonify
-from typing import Dict
+from typing import Any, Callable, Dict, List, Iterator, Union, Optional, Tuple
+from datetime import datetime
 from google.cloud import bigquery
+from google.cloud import storage
 import google.auth
 import google.auth.transport.requests
 from google.cloud import aiplatform
+from google.api_core.exceptions import NotFound
+# Vendored from cloud_functions/shared by cloudbuild.yaml
+from chunking import CHUNK_BOUNDARIES, COMPAT_BOUNDARIES, chunk_length, find_chunk_end, iter_chunks
+from token_provider import TokenProvider
 
-def create_index(project_number: str) -> None:
+AIPLATFORM_API = "https://us-central1-aiplatform.googleapis.com/v1"
+DEPLOYED_INDEX_ID = "job_posting_deployed_index_2024"
+
+def post_operation(url: str, request_body: Dict[str, Any]) -> Optional[str]:
     """
-    Create an index for job postings.
+    Send a Vertex AI request that starts a long-running operation.
 
     Args:
-        project_number (str): Google Cloud project number.
+        url (str): The method URL.
+        request_body (Dict[str, Any]): The JSON request body.
 
     Returns:
-        None
+        Optional[str]: The resource name of the operation, or None if the request failed.
     """
-    endpoint = f"https://us-central1-aiplatform.googleapis.com/v1/projects/{project_number}/locations/us-central1/indexes"
-    request_body = {
-        "display_name": "job_posting_index_2024",
-        "metadata": {
-            "contentsDeltaUri": "gs://" + os.environ["DATASET_BUCKET"],
-            "config": {
-                "dimensions": 768,
-                "approximateNeighborsCount": 10,
-                "shardSize": "SHARD_SIZE_SMALL",
-                "algorithm_config": {
-                    "treeAhConfig": {
-                        "leafNodeEmbeddingCount": 1000,
-                        "leafNodesToSearchPercent": 10
-                    }
-                }
-            }
-        }
-    }
-    access_token = get_default_token()  # Assuming get_default_token is defined elsewhere
+    access_token = get_default_token()
     auth = "Bearer " + access_token
 
     # Create the headers with the Authorization header
@@ -47,13 +47,116 @@ def create_index(project_number: str) -> None:
     }
 
     # Send the POST request with JSON data
-    response = requests.post(endpoint, headers=headers, json=request_body)
+    response = requests.post(url, headers=headers, json=request_body)
 
     if response.status_code == 200:
         print('POST request was successful')
         print('Response content:', response.text)
+        return response.json().get("name")
     else:
         print(f'POST request failed with status code {response.status_code}')
+        return None
+
+def create_index(project_number: str, index_config: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Create an index for job postings.
+
+    The default config can be overridden with the one recommended by `offline/tune_index.py`,
+    passed as `index_config` or as JSON in the INDEX_CONFIG environment variable. Keys other
+    than `algorithm_config` replace the defaults, and the keys of its `treeAhConfig` replace
+    the default tree-AH parameters.
+
+    Args:
+        project_number (str): Google Cloud project number.
+        index_config (Optional[Dict[str, Any]]): Overrides of the index config.
+
+    Returns:
+        Optional[str]: The resource name of the index creation operation, or None if the request failed.
+    """
+    endpoint = f"{AIPLATFORM_API}/projects/{project_number}/locations/us-central1/indexes"
+    config = {
+        "dimensions": 768,
+        "approximateNeighborsCount": 10,
+        "shardSize": "SHARD_SIZE_SMALL",
+        "algorithm_config": {
+            "treeAhConfig": {
+                "leafNodeEmbeddingCount": 1000,
+                "leafNodesToSearchPercent": 10
+            }
+        }
+    }
+
+    # Apply the tuned overrides
+    if index_config is None:
+        index_config = json.loads(os.environ.get("INDEX_CONFIG", "{}"))
+    config.update({key: value for key, value in index_config.items() if key != "algorithm_config"})
+    config["algorithm_config"]["treeAhConfig"].update(index_config.get("algorithm_config", {}).get("treeAhConfig", {}))
+
+    request_body = {
+        "display_name": "job_posting_index_2024",
+        "metadata": {
+            "contentsDeltaUri": "gs://" + os.environ["DATASET_BUCKET"],
+            "config": config
+        }
+    }
+    return post_operation(endpoint, request_body)
+
+def create_index_endpoint(project_number: str) -> Optional[str]:
+    """
+    Start creating a public Matching Engine Index Endpoint without waiting for it.
+
+    Args:
+        project_number (str): Google Cloud project number.
+
+    Returns:
+        Optional[str]: The resource name of the endpoint creation operation, or None if the request failed.
+    """
+    endpoint = f"{AIPLATFORM_API}/projects/{project_number}/locations/us-central1/indexEndpoints"
+    request_body = {
+        "displayName": "job_posting_index_endpoint_2024",
+        "publicEndpointEnabled": True
+    }
+    return post_operation(endpoint, request_body)
+
+def get_deployed_index_id(run_id: str) -> str:
+    """
+    Build the ID under which a pipeline run deploys its index.
+
+    Every run deploys under its own ID, so that a refresh can deploy to an Index Endpoint that
+    still serves the index of a previous run.
+
+    Args:
+        run_id (str): Identifies the pipeline run.
+
+    Returns:
+        str: DEPLOYED_INDEX_ID suffixed with the run ID, limited to letters, numbers and underscores.
+    """
+    return (DEPLOYED_INDEX_ID + "_" + re.sub(r"[^A-Za-z0-9_]", "_", run_id))[:128]
+
+def submit_deploy_index(index_endpoint: str, index_name: str, deployed_index_id: str = DEPLOYED_INDEX_ID) -> Optional[str]:
+    """
+    Start deploying an index to an Index Endpoint without waiting for it.
+
+    Args:
+        index_endpoint (str): Resource name of the Index Endpoint.
+        index_name (str): Resource name of the index to deploy.
+        deployed_index_id (str): The ID of the deployed index, unique within the Index Endpoint.
+
+    Returns:
+        Optional[str]: The resource name of the deployment operation, or None if the request failed.
+    """
+    request_body = {
+        "deployedIndex": {
+            "id": deployed_index_id,
+            "index": index_name,
+            "dedicatedResources": {
+                "machineSpec": {"machineType": "e2-standard-2"},
+                "minReplicaCount": 1,
+                "maxReplicaCount": 1
+            }
+        }
+    }
+    return post_operation(f"{AIPLATFORM_API}/{index_endpoint}:deployIndex", request_body)
 
 def deploy_index(project_number: str, index_id: str) -> None:
     """
@@ -77,7 +180,6 @@ def deploy_index(project_number: str, index_id: str) -> None:
     my_index = aiplatform.MatchingEngineIndex(index_name=index_path)
 
     # Deploy the Index to the Index Endpoint
-    DEPLOYED_INDEX_ID = "job_posting_deployed_index_2024"
     my_index_endpoint.deploy_index(
         index=my_index,
         deployed_index_id=DEPLOYED_INDEX_ID,
@@ -86,29 +188,20 @@ def deploy_index(project_number: str, index_id: str) -> None:
         max_replica_count=1
     )
 
+# Token provider shared by all requests served by this instance
+cloud_platform_tokens = TokenProvider(["https://www.googleapis.com/auth/cloud-platform"])
+
 def get_default_token() -> str:
     """
     Get the default access token using Google Cloud Platform credentials.
 
+    The token is cached and refreshed shortly before it expires, so most calls do not contact
+    the metadata server.
+
     Returns:
         str: Access token obtained from credentials.
     """
-    # Define the required OAuth scopes
-    CREDENTIAL_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
-
-    # Obtain default credentials with specified scopes
-    credentials, project_id = google.auth.default(scopes=CREDENTIAL_SCOPES)
-
-    # Create a request object for token refresh
-    request = google.auth.transport.requests.Request()
-
-    # Refresh the credentials to obtain a new access token
-    credentials.refresh(request)
-
-    # Access token obtained from refreshed credentials
-    access_token = credentials.token
-
-    return credentials.token
+    return cloud_platform_tokens.get_token()
 
 def export_to_gcs() -> None:
     """
@@ -151,13 +244,154 @@ def export_to_gcs() -> None:
     # Wait for the export job to complete
     extract_job.result()
 
-def get_weighted_embeddings() -> bool:
+def export_job_snapshot() -> bool:
     """
-    Calculate weighted embeddings for each job and store the results in a BigQuery table.
+    Export the job metadata used by the webhook to a SQLite snapshot in Google Cloud Storage.
+
+    The snapshot holds one row per job, keyed by job_id, with the columns shown in match results
+    and exported job documents. It is written next to the embeddings export so the webhook can
+    serve job lookups locally instead of querying BigQuery on every request.
+
+    Returns:
+        bool: True if the operation is successful, False otherwise.
+    """
+    # Create a BigQuery client
+    client = bigquery.Client()
+
+    # Get environment variables
+    source_table = os.environ["SOURCE_TABLE"]
+    dataset_bucket = os.environ["DATASET_BUCKET"]
 
-    This function defines a JavaScript UDF (User-Defined Function) to perform the weighted averaging
-    of chunk embeddings and then executes a BigQuery query to create a table with the calculated
-    weighted embeddings.
+    # Construct the BigQuery query selecting the job metadata
+    query = f'''
+    SELECT
+        job_id,
+        title,
+        formatted_work_type,
+        description,
+        max_salary,
+        min_salary,
+        pay_period,
+        views,
+        applies,
+        location,
+        job_posting_url
+    FROM
+        `{source_table}`
+    '''
+
+    try:
+        rows = client.query(query).result()  # Waits for job to complete.
+
+        # Write the rows to a fresh SQLite database keyed by job_id
+        local_path = "/tmp/jobs-2024.sqlite"
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        connection = sqlite3.connect(local_path)
+        connection.execute('''
+        CREATE TABLE jobs (
+            job_id TEXT PRIMARY KEY,
+            title TEXT,
+            formatted_work_type TEXT,
+            description TEXT,
+            max_salary REAL,
+            min_salary REAL,
+            pay_period TEXT,
+            views REAL,
+            applies REAL,
+            location TEXT,
+            job_posting_url TEXT
+        ) WITHOUT ROWID
+        ''')
+        connection.executemany(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (tuple(row.values()) for row in rows)
+        )
+        connection.commit()
+        connection.close()
+
+        # Upload the snapshot outside the bucket root, which holds the index input files
+        storage_client = storage.Client()
+        blob = storage_client.bucket(dataset_bucket).blob("snapshots/jobs-2024.sqlite")
+        blob.upload_from_filename(local_path)
+
+        return True
+    except Exception as e:
+        if hasattr(e, 'message'):
+            print('Unable to export job snapshot: ' + e.message)
+        else:
+            print('Unable to export job snapshot: ' + str(e))
+        return False
+
+def export_embeddings() -> bool:
+    """
+    Export the weighted embeddings in the formats selected by EXPORT_FORMAT, then the job snapshot.
+
+    EXPORT_FORMAT selects the NDJSON export read by the index ("json"), the binary shards ("npy")
+    or both.
+
+    Returns:
+        bool: True if every export is successful, False otherwise.
+    """
+    export_format = os.environ.get("EXPORT_FORMAT", "json")
+    try:
+        if export_format in ("json", "both"):
+            export_to_gcs()
+    except Exception as e:
+        if hasattr(e, 'message'):
+            print('Unable to export embeddings: ' + e.message)
+        else:
+            print('Unable to export embeddings: ' + str(e))
+        return False
+
+    if export_format in ("npy", "both"):
+        exported = export_embedding_shards(
+            shard_rows=int(os.environ.get("EXPORT_SHARD_ROWS", "4096")),
+            normalize=os.environ.get("EXPORT_NORMALIZE", "false") == "true",
+            writers=int(os.environ.get("EXPORT_WRITERS", "4"))
+        )
+        if not exported:
+            return False
+    return export_job_snapshot()
+
+def write_shard(destination: str, file_name: str, data: bytes, storage_client: Optional[storage.Client] = None) -> None:
+    """
+    Write one export file to a local directory or a Cloud Storage prefix.
+
+    Args:
+        destination (str): The local directory or "gs://bucket/prefix".
+        file_name (str): The name of the file within the destination.
+        data (bytes): The content of the file.
+        storage_client (Optional[storage.Client]): The client used for "gs://" destinations.
+    """
+    if destination.startswith("gs://"):
+        bucket_name, _, prefix = destination[len("gs://"):].partition("/")
+        blob_name = f"{prefix.rstrip('/')}/{file_name}" if prefix else file_name
+        storage_client.bucket(bucket_name).blob(blob_name).upload_from_string(data, content_type="application/octet-stream")
+    else:
+        os.makedirs(destination, exist_ok=True)
+        with open(os.path.join(destination, file_name), "wb") as file:
+            file.write(data)
+
+def export_embedding_shards(destination: Optional[str] = None, shard_rows: int = 4096, normalize: bool = False, writers: int = 4) -> bool:
+    """
+    Export the weighted embeddings as sharded float32 .npy files plus a JSON manifest.
+
+    Rows are streamed from the weighted embeddings table in ID order; every `shard_rows` rows
+    become one (rows x dimensions) float32 shard, optionally L2-normalised, which is serialised
+    and written by a pool of `writers` threads while the next shard is read. At most twice
+    `writers` shards are pending at a time, reading waits for a writer when the pool is behind, so
+    slow writes do not queue the whole table in memory. `manifest.json`,
+    listing every shard with its job IDs in row order, is written last, so a reader never sees
+    a partial export. Shards can be memory-mapped with `np.load(..., mmap_mode="r")`, see
+    `load_embedding_shards`.
+
+    Args:
+        destination (Optional[str]): A local directory or "gs://bucket/prefix", by default
+            "shards/embeddings-2024" in DATASET_BUCKET, outside the index input files.
+        shard_rows (int): Number of vectors per shard.
+        normalize (bool): Whether to L2-normalise the vectors.
+        writers (int): Number of parallel shard writers.
 
     Returns:
         bool: True if the operation is successful, False otherwise.
@@ -165,8 +399,95 @@ def get_weighted_embeddings() -> bool:
     # Create a BigQuery client
     client = bigquery.Client()
 
-    # Define the JavaScript UDF for weighted embeddings calculation
-    js_udf = '''
+    destination = destination or f"gs://{os.environ['DATASET_BUCKET']}/shards/embeddings-2024"
+    storage_client = storage.Client() if destination.startswith("gs://") else None
+
+    query = "SELECT id, embedding FROM `ml-spez-ccai.processed.weighted_embeddings-2024` ORDER BY id"
+
+    def write(index: int, ids: List[str], vectors: List[List[float]]) -> Dict[str, object]:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if normalize:
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        buffer = io.BytesIO()
+        np.save(buffer, matrix)
+        file_name = f"shard-{index:05d}.npy"
+        write_shard(destination, file_name, buffer.getvalue(), storage_client)
+        return {"file": file_name, "rows": len(ids), "ids": ids}
+
+    try:
+        pending = set()
+        shards: List[Dict[str, object]] = []
+        ids: List[str] = []
+        vectors: List[List[float]] = []
+        dimensions = 0
+
+        def collect(futures: set) -> None:
+            # Raise the first write error, like the results of the pool would
+            for future in futures:
+                shards.append(future.result())
+
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            submitted = 0
+            for row in client.query(query).result(page_size=shard_rows):
+                ids.append(str(row["id"]))
+                vectors.append(row["embedding"])
+                dimensions = dimensions or len(row["embedding"])
+                if len(ids) == shard_rows:
+                    # Bound the shards held in memory by pending writes
+                    if len(pending) >= writers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    pending.add(executor.submit(write, submitted, ids, vectors))
+                    submitted += 1
+                    ids, vectors = [], []
+            if ids:
+                pending.add(executor.submit(write, submitted, ids, vectors))
+            collect(pending)
+
+        # Shards complete out of order, the manifest lists them in row order
+        shards.sort(key=lambda shard: shard["file"])
+
+        manifest = {
+            "format": "npy",
+            "dtype": "float32",
+            "dimensions": dimensions,
+            "normalized": normalize,
+            "count": sum(shard["rows"] for shard in shards),
+            "shards": shards
+        }
+        write_shard(destination, "manifest.json", json.dumps(manifest).encode("utf8"), storage_client)
+        return True
+    except Exception as e:
+        if hasattr(e, 'message'):
+            print('Unable to export embedding shards: ' + e.message)
+        else:
+            print('Unable to export embedding shards: ' + str(e))
+        return False
+
+def load_embedding_shards(directory: str) -> Tuple[List[str], List[np.ndarray]]:
+    """
+    Memory-map a local copy of the sharded embeddings export without copying or parsing the vectors.
+
+    Args:
+        directory (str): The directory holding `manifest.json` and the shards.
+
+    Returns:
+        Tuple[List[str], List[np.ndarray]]: The job IDs in row order, and one read-only
+            memory-mapped float32 matrix per shard.
+    """
+    with open(os.path.join(directory, "manifest.json"), "r") as file:
+        manifest = json.load(file)
+
+    ids = []
+    matrices = []
+    for shard in manifest["shards"]:
+        ids.extend(shard["ids"])
+        matrices.append(np.load(os.path.join(directory, shard["file"]), mmap_mode="r"))
+
+    return ids, matrices
+
+# JavaScript UDF combining the chunk embeddings of one job, used by the "udf" weighting engine
+WEIGHTED_EMBEDDINGS_UDF = '''
     if (is_split_array.includes(false)){
         return chunk_embeddings[0];
     }
@@ -182,28 +503,186 @@ def get_weighted_embeddings() -> bool:
     return result;
     '''
 
-    # Construct the BigQuery query to create a table with weighted embeddings
-    query = f'''
+def get_weighted_embeddings_query(engine: str = "sql", source_table: str = "ml-spez-ccai.processed.embeddings-2024",
+                                  destination_table: str = "ml-spez-ccai.processed.weighted_embeddings-2024") -> str:
+    """
+    Build the query writing the weighted embedding of every job to a table.
+
+    The "sql" engine unnests every chunk embedding with its dimension offset and takes the
+    chunk-size-weighted SUM per job and dimension natively. The "udf" engine aggregates the
+    chunk embeddings of each job into arrays passed to a JavaScript UDF. Both give the same
+    vectors: a job that was not split has a single chunk, whose weighted average is itself.
+
+    Args:
+        engine (str): "sql" or "udf".
+        source_table (str): The table of chunk embeddings written by batch prediction.
+        destination_table (str): The table receiving one `id`, `embedding` row per job.
+
+    Returns:
+        str: The query.
+    """
+    if engine == "udf":
+        return f'''
     CREATE TEMP FUNCTION
     weighted_embeddings(chunk_embeddings ARRAY<JSON>, chunk_lens ARRAY<INT64>, is_split_array ARRAY<BOOL>)
     RETURNS ARRAY<FLOAT64>
-    LANGUAGE js AS \'''{js_udf}\''';
+    LANGUAGE js AS \'''{WEIGHTED_EMBEDDINGS_UDF}\''';
 
     CREATE OR REPLACE TABLE
-    `ml-spez-ccai.processed.weighted_embeddings-2024` AS
+    `{destination_table}` AS
     SELECT
         job_id AS id,
         weighted_embeddings(ARRAY_AGG(predictions[0].embeddings.values), ARRAY_AGG(chunk_size), ARRAY_AGG(is_split)) AS embedding
     FROM
-        `ml-spez-ccai.processed.embeddings-2024`
+        `{source_table}`
     WHERE
         content != "" AND predictions IS NOT null
     GROUP BY
         job_id;
     '''
 
+    return f'''
+    CREATE OR REPLACE TABLE
+    `{destination_table}` AS
+    WITH chunk_values AS (
+        SELECT
+            job_id,
+            chunk_size,
+            dimension,
+            CAST(value AS FLOAT64) AS value
+        FROM
+            `{source_table}`,
+            UNNEST(JSON_VALUE_ARRAY(predictions[0].embeddings.values)) AS value WITH OFFSET AS dimension
+        WHERE
+            content != "" AND predictions IS NOT null
+    ),
+    dimension_values AS (
+        SELECT
+            job_id,
+            dimension,
+            SUM(value * chunk_size) / SUM(chunk_size) AS value
+        FROM
+            chunk_values
+        GROUP BY
+            job_id, dimension
+    )
+    SELECT
+        job_id AS id,
+        ARRAY_AGG(value ORDER BY dimension) AS embedding
+    FROM
+        dimension_values
+    GROUP BY
+        job_id;
+    '''
+
+def get_grouped_weighted_embeddings(group_ids: List[str], chunk_embeddings: np.ndarray, chunk_lens: List[float]) -> Dict[str, np.ndarray]:
+    """
+    Calculate the weighted average embedding of every group of chunks in one pass.
+
+    This is the vectorised Python equivalent of the weighted embeddings query, shared with the
+    webhook's function of the same name.
+
+    Args:
+        group_ids (List[str]): The group (job) ID of every chunk row.
+        chunk_embeddings (np.ndarray): A (chunks x dimensions) array of chunk embeddings.
+        chunk_lens (List[float]): The length of every chunk, used as its weight.
+
+    Returns:
+        Dict[str, np.ndarray]: A dictionary mapping group IDs to float32 weighted average embeddings.
+    """
+    embeddings = np.ascontiguousarray(chunk_embeddings, dtype=np.float32)
+    weights = np.asarray(chunk_lens, dtype=np.float64)
+
+    # Map every chunk to a dense group index
+    unique_ids, group_index = np.unique(np.asarray(group_ids), return_inverse=True)
+
+    # Sort the chunks by group so every group is a contiguous run of rows
+    order = np.argsort(group_index, kind="stable")
+    sorted_index = group_index[order]
+    starts = np.flatnonzero(np.r_[True, sorted_index[1:] != sorted_index[:-1]])
+
+    # Sum the weighted chunks and the weights of every run
+    weighted_sums = np.add.reduceat(embeddings[order] * weights[order, None], starts, axis=0)
+    weights_sums = np.bincount(group_index, weights=weights, minlength=len(unique_ids))
+
+    results = (weighted_sums / weights_sums[:, None]).astype(np.float32)
+
+    return {group_id: results[i] for i, group_id in enumerate(unique_ids.tolist())}
+
+def get_python_weighted_embeddings(source_table: str = "ml-spez-ccai.processed.embeddings-2024",
+                                   destination_table: str = "ml-spez-ccai.processed.weighted_embeddings-2024",
+                                   batch_rows: int = 5000) -> bool:
+    """
+    Calculate weighted embeddings for each job in Python and store the results in a BigQuery table.
+
+    The chunk embeddings are read once, combined with `get_grouped_weighted_embeddings` and loaded
+    into the destination table in batches of `batch_rows` jobs.
+
+    Args:
+        source_table (str): The table of chunk embeddings written by batch prediction.
+        destination_table (str): The table receiving one `id`, `embedding` row per job.
+        batch_rows (int): Number of jobs per load job.
+
+    Returns:
+        bool: True if the operation is successful, False otherwise.
+    """
+    # Create a BigQuery client
+    client = bigquery.Client()
+
+    query = f'''
+    SELECT
+        job_id,
+        chunk_size,
+        JSON_VALUE_ARRAY(predictions[0].embeddings.values) AS embedding
+    FROM
+        `{source_table}`
+    WHERE
+        content != "" AND predictions IS NOT null
+    '''
+
+    try:
+        job_ids, chunk_lens, chunk_embeddings = [], [], []
+        for row in client.query(query).result(page_size=10000):
+            job_ids.append(row["job_id"])
+            chunk_lens.append(row["chunk_size"])
+            chunk_embeddings.append(np.asarray(row["embedding"], dtype=np.float32))
+
+        weighted = get_grouped_weighted_embeddings(job_ids, np.vstack(chunk_embeddings), chunk_lens)
+
+        rows = [{"id": job_id, "embedding": embedding.tolist()} for job_id, embedding in weighted.items()]
+        schema = [bigquery.SchemaField("id", "STRING"), bigquery.SchemaField("embedding", "FLOAT64", mode="REPEATED")]
+        for i in range(0, len(rows), batch_rows):
+            write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE if i == 0 else bigquery.WriteDisposition.WRITE_APPEND
+            job_config = bigquery.LoadJobConfig(schema=schema, write_disposition=write_disposition)
+            client.load_table_from_json(rows[i:i + batch_rows], destination_table, job_config=job_config).result()
+        return True
+    except Exception as e:
+        if hasattr(e, 'message'):
+            print('Unable to get BigQuery results: ' + e.message)
+        else:
+            print('Unable to get BigQuery results: ' + str(e))
+        return False
+
+def get_weighted_embeddings() -> bool:
+    """
+    Calculate weighted embeddings for each job and store the results in a BigQuery table.
+
+    The WEIGHTING_ENGINE environment variable selects how: "sql" (default) aggregates natively
+    in BigQuery, "udf" uses the original JavaScript UDF and "python" combines the chunk
+    embeddings in this function with numpy.
+
+    Returns:
+        bool: True if the operation is successful, False otherwise.
+    """
+    engine = os.environ.get("WEIGHTING_ENGINE", "sql")
+    if engine == "python":
+        return get_python_weighted_embeddings()
+
+    # Create a BigQuery client
+    client = bigquery.Client()
+
     # Execute the BigQuery query
-    query_job = client.query(query)
+    query_job = client.query(get_weighted_embeddings_query(engine))
 
     try:
         results = query_job.result()  # Waits for job to complete.
@@ -309,7 +788,72 @@ def trans_job_posts() -> bool:
             print('Unable to get BigQuery results: ' + str(e))
         return False
 
-def batch_embeddings() -> None:
+def chunk_job_posts(batch_rows: int = 50000) -> bool:
+    """
+    Transform job posts by chunking the description text in Python and store the results in a BigQuery table.
+
+    This is the offline counterpart of `trans_job_posts`: descriptions are streamed from the
+    source table, split with `iter_chunks` (CHUNK_BOUNDARY and CHUNK_OVERLAP select the
+    boundary type and overlap, "compat_udf" reproducing the UDF exactly) and loaded into
+    the destination table in batches of `batch_rows` chunks, with the same schema as the UDF output.
+
+    Args:
+        batch_rows (int): Number of chunks per load job.
+
+    Returns:
+        bool: True if the operation is successful, False otherwise.
+    """
+    # Create a BigQuery client
+    client = bigquery.Client()
+
+    # Get environment variables
+    source_table = os.environ["SOURCE_TABLE"]
+    destination_table = os.environ["DESTINATION_TABLE"]
+    chunk_size = int(os.environ["CHUNK_SIZE"])
+    boundary = os.environ.get("CHUNK_BOUNDARY", "compat_udf")
+    overlap = int(os.environ.get("CHUNK_OVERLAP", "0"))
+
+    schema = [
+        bigquery.SchemaField("job_id", "STRING"),
+        bigquery.SchemaField("content", "STRING"),
+        bigquery.SchemaField("chunk_size", "INT64"),
+        bigquery.SchemaField("is_split", "BOOL")
+    ]
+
+    def load(rows: List[Dict[str, object]], write_disposition: str) -> None:
+        job_config = bigquery.LoadJobConfig(schema=schema, write_disposition=write_disposition)
+        client.load_table_from_json(rows, destination_table, job_config=job_config).result()
+
+    try:
+        query = f"SELECT job_id, description FROM `{source_table}` WHERE description IS NOT NULL"
+        rows = []
+        write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
+        for row in client.query(query).result(page_size=10000):
+            is_split = chunk_length(row["description"], boundary) > chunk_size
+            for chunk in iter_chunks(row["description"], chunk_size, boundary, overlap):
+                rows.append({
+                    "job_id": row["job_id"],
+                    "content": chunk["chunk_content"],
+                    "chunk_size": chunk["chunk_size"],
+                    "is_split": is_split
+                })
+            if len(rows) >= batch_rows:
+                load(rows, write_disposition)
+                rows = []
+                write_disposition = bigquery.WriteDisposition.WRITE_APPEND
+
+        # Load the last batch, or create the table empty if there were no rows at all
+        if rows or write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE:
+            load(rows, write_disposition)
+        return True
+    except Exception as e:
+        if hasattr(e, 'message'):
+            print('Unable to chunk job posts: ' + e.message)
+        else:
+            print('Unable to chunk job posts: ' + str(e))
+        return False
+
+def batch_embeddings(input_uri: str = "bq://ml-spez-ccai.processed.chonks-2024", output_uri: str = "bq://ml-spez-ccai.processed.embeddings-2024") -> Optional[str]:
     """
     Perform batch embeddings by submitting a batch prediction job to AI Platform Prediction.
 
@@ -318,8 +862,12 @@ def batch_embeddings() -> None:
 
     Note: The function assumes the existence of the `get_default_token()` function.
 
+    Args:
+        input_uri (str): The BigQuery table holding the chunks to embed.
+        output_uri (str): The BigQuery table receiving the embeddings.
+
     Returns:
-        None
+        Optional[str]: The resource name of the batch prediction job, or None if the request failed.
     """
     # Get the access token
     access_token = get_default_token()
@@ -342,13 +890,13 @@ def batch_embeddings() -> None:
         "inputConfig": {
             "instancesFormat": "bigquery",
             "bigquerySource": {
-                "inputUri": "bq://ml-spez-ccai.processed.chonks-2024"
+                "inputUri": input_uri
             }
         },
         "outputConfig": {
             "predictionsFormat": "bigquery",
             "bigqueryDestination": {
-                "outputUri": "bq://ml-spez-ccai.processed.embeddings-2024"
+                "outputUri": output_uri
             }
         }
     }
@@ -359,9 +907,494 @@ def batch_embeddings() -> None:
     if response.status_code == 200:
         print('POST request was successful')
         print('Response content:', response.text)
+        return response.json().get("name")
     else:
         print(response)
         print(f'POST request failed with status code {response.status_code}')
+        return None
+
+def prepare_embedding_delta() -> Optional[int]:
+    """
+    Select the chunks that need embedding into the delta chunks table.
+
+    Each chunk is fingerprinted by the SHA-256 of its content. Chunks whose (job_id, fingerprint)
+    already have a prediction in EMBEDDINGS_TABLE are skipped, so only new or changed chunks, and
+    chunks whose previous prediction failed, are written to `<DESTINATION_TABLE>-delta`. When the
+    embeddings table does not exist yet, every chunk is selected.
+
+    Returns:
+        Optional[int]: The number of chunks to embed, or None if an error occurs.
+    """
+    # Create a BigQuery client
+    client = bigquery.Client()
+
+    # Get environment variables
+    chunks_table = os.environ["DESTINATION_TABLE"]
+    embeddings_table = os.environ.get("EMBEDDINGS_TABLE", "ml-spez-ccai.processed.embeddings-2024")
+    delta_table = f"{chunks_table}-delta"
+
+    try:
+        client.get_table(embeddings_table)
+        query = f'''
+        CREATE OR REPLACE TABLE `{delta_table}` AS
+        SELECT
+            chunks.*
+        FROM
+            `{chunks_table}` AS chunks
+        LEFT JOIN (
+            SELECT DISTINCT job_id, SHA256(content) AS fingerprint
+            FROM `{embeddings_table}`
+            WHERE predictions IS NOT NULL
+        ) AS embedded
+        ON
+            chunks.job_id = embedded.job_id AND SHA256(chunks.content) = embedded.fingerprint
+        WHERE
+            embedded.job_id IS NULL;
+        '''
+    except NotFound:
+        query = f"CREATE OR REPLACE TABLE `{delta_table}` AS SELECT * FROM `{chunks_table}`;"
+
+    try:
+        client.query(query).result()  # Waits for job to complete.
+        delta_rows = client.get_table(delta_table).num_rows
+        print(f"{delta_rows} new or changed chunks to embed in {delta_table}")
+        return delta_rows
+    except Exception as e:
+        if hasattr(e, 'message'):
+            print('Unable to get BigQuery results: ' + e.message)
+        else:
+            print('Unable to get BigQuery results: ' + str(e))
+        return None
+
+def get_delta_output_table() -> str:
+    """
+    Name a new table for the predictions of an incremental batch prediction job.
+
+    Returns:
+        str: `<EMBEDDINGS_TABLE>-delta-<timestamp>`.
+    """
+    embeddings_table = os.environ.get("EMBEDDINGS_TABLE", "ml-spez-ccai.processed.embeddings-2024")
+    return f"{embeddings_table}-delta-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+def incremental_embeddings() -> Optional[str]:
+    """
+    Submit a batch prediction job for the new or changed chunks only.
+
+    The predictions are written to a new `<EMBEDDINGS_TABLE>-delta-<timestamp>` table, to be
+    merged into the embeddings table with `merge_embeddings` once the job has completed.
+
+    Returns:
+        Optional[str]: The delta embeddings table, or None if there was nothing to embed or an error occurred.
+    """
+    delta_rows = prepare_embedding_delta()
+    if not delta_rows:
+        if delta_rows == 0:
+            print("Embeddings are up to date, no batch prediction submitted")
+        return None
+
+    delta_output_table = get_delta_output_table()
+    job_name = batch_embeddings(
+        input_uri=f"bq://{os.environ['DESTINATION_TABLE']}-delta",
+        output_uri=f"bq://{delta_output_table}"
+    )
+    if job_name is None:
+        return None
+
+    print(f"Merge {delta_output_table} with mode merge_embeddings once {job_name} has completed")
+    return delta_output_table
+
+def merge_embeddings(delta_output_table: str) -> bool:
+    """
+    Merge the predictions of an incremental batch prediction job into the embeddings table.
+
+    Rows of the embeddings table whose chunk no longer exists in the chunks table (removed or
+    changed postings), or whose failed prediction has been redone, are deleted, and the new
+    predictions are appended. The delta table is dropped afterwards.
+
+    Args:
+        delta_output_table (str): The table written by the incremental batch prediction job.
+
+    Returns:
+        bool: True if the operation is successful, False otherwise.
+    """
+    # Create a BigQuery client
+    client = bigquery.Client()
+
+    # Get environment variables
+    chunks_table = os.environ["DESTINATION_TABLE"]
+    embeddings_table = os.environ.get("EMBEDDINGS_TABLE", "ml-spez-ccai.processed.embeddings-2024")
+
+    try:
+        try:
+            client.get_table(embeddings_table)
+        except NotFound:
+            # First run, the delta holds every chunk
+            client.copy_table(delta_output_table, embeddings_table).result()
+            client.delete_table(delta_output_table)
+            return True
+
+        columns = ", ".join(f"`{field.name}`" for field in client.get_table(delta_output_table).schema)
+        query = f'''
+        DELETE FROM `{embeddings_table}` AS embeddings
+        WHERE
+            NOT EXISTS (
+                SELECT 1 FROM `{chunks_table}` AS chunks
+                WHERE chunks.job_id = embeddings.job_id AND SHA256(chunks.content) = SHA256(embeddings.content)
+            )
+            OR (
+                embeddings.predictions IS NULL AND EXISTS (
+                    SELECT 1 FROM `{delta_output_table}` AS delta
+                    WHERE delta.job_id = embeddings.job_id AND delta.content = embeddings.content
+                )
+            );
+
+        INSERT INTO `{embeddings_table}` ({columns})
+        SELECT {columns} FROM `{delta_output_table}`;
+        '''
+        client.query(query).result()  # Waits for job to complete.
+        client.delete_table(delta_output_table)
+        return True
+    except Exception as e:
+        if hasattr(e, 'message'):
+            print('Unable to get BigQuery results: ' + e.message)
+        else:
+            print('Unable to get BigQuery results: ' + str(e))
+        return False
+
+BATCH_PREDICTION_SUCCEEDED = ("JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED")
+BATCH_PREDICTION_TERMINAL = BATCH_PREDICTION_SUCCEEDED + ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED")
+
+def get_aiplatform_resource(name: str) -> Dict[str, Any]:
+    """
+    Get the current state of a Vertex AI resource, such as a batch prediction job or an operation.
+
+    Args:
+        name (str): The resource name.
+
+    Returns:
+        Dict[str, Any]: The resource.
+    """
+    headers = {'Authorization': "Bearer " + get_default_token()}
+    response = requests.get(f"{AIPLATFORM_API}/{name}", headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+class StagePending(Exception):
+    """
+    Raised when a long-running operation has not completed before the orchestrator's deadline.
+    """
+
+class PipelineCheckpoint:
+    """
+    Record the status, result and wall time of each pipeline stage in a JSON file.
+
+    The file is read once and rewritten after every change, so that a later run resumes from the
+    last finished stage.
+
+    Args:
+        uri (str): "gs://bucket/path.json" or a local path.
+    """
+    def __init__(self, uri: str):
+        self.uri = uri
+        # One client for every read and write of the checkpoint
+        self.storage_client = storage.Client() if uri.startswith("gs://") else None
+        self.state = self.load()
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Read the checkpoint, or start an empty one if it does not exist yet.
+
+        Returns:
+            Dict[str, Any]: The checkpoint, with a "stages" mapping.
+        """
+        if self.uri.startswith("gs://"):
+            bucket_name, blob_name = self.uri[5:].split("/", 1)
+            blob = self.storage_client.bucket(bucket_name).blob(blob_name)
+            if blob.exists():
+                return json.loads(blob.download_as_text())
+        elif os.path.exists(self.uri):
+            with open(self.uri) as f:
+                return json.load(f)
+        return {"created": datetime.now().isoformat(), "stages": {}}
+
+    def save(self) -> None:
+        """
+        Write the checkpoint.
+        """
+        data = json.dumps(self.state, indent=2, default=str)
+        if self.uri.startswith("gs://"):
+            bucket_name, blob_name = self.uri[5:].split("/", 1)
+            self.storage_client.bucket(bucket_name).blob(blob_name).upload_from_string(data, content_type="application/json")
+        else:
+            with open(self.uri, "w") as f:
+                f.write(data)
+
+    def get(self, stage: str) -> Dict[str, Any]:
+        """
+        Get the record of a stage.
+
+        Args:
+            stage (str): The stage name.
+
+        Returns:
+            Dict[str, Any]: The record, empty if the stage has not started.
+        """
+        return self.state["stages"].get(stage, {})
+
+    def update(self, stage: str, **fields: Any) -> None:
+        """
+        Update the record of a stage and write the checkpoint.
+
+        Args:
+            stage (str): The stage name.
+            **fields: The fields to set.
+        """
+        self.state["stages"].setdefault(stage, {}).update(fields)
+        self.save()
+
+class StageOrchestrator:
+    """
+    Run dependent pipeline stages in order, resuming from a checkpoint.
+
+    Stages already done in the checkpoint are skipped and their results reused. A stage that waits
+    on a long-running operation records the operation name before polling it, with exponential
+    backoff and jitter, so that a run which reaches `time_budget` stops with the stage pending and
+    the next run resumes polling the same operation instead of starting a new one.
+
+    Args:
+        checkpoint (PipelineCheckpoint): The checkpoint of this pipeline run.
+        time_budget (float): Seconds this run may spend before leaving pending stages to the next run,
+            which must stay below the function timeout (540 seconds in cloudbuild.yaml).
+        poll_initial (float): Seconds before the first poll of an operation.
+        poll_max (float): Maximum seconds between polls.
+    """
+    def __init__(self, checkpoint: PipelineCheckpoint, time_budget: float = 480, poll_initial: float = 30, poll_max: float = 300):
+        self.checkpoint = checkpoint
+        self.deadline = time.monotonic() + time_budget
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+
+    def wait(self, name: str, is_done: Callable[[Dict[str, Any]], bool]) -> Dict[str, Any]:
+        """
+        Poll a Vertex AI resource until it is done.
+
+        Args:
+            name (str): The resource name of the operation or job.
+            is_done (Callable[[Dict[str, Any]], bool]): Whether the resource has reached a final state.
+
+        Returns:
+            Dict[str, Any]: The resource in its final state.
+
+        Raises:
+            StagePending: If the deadline would pass before the next poll.
+        """
+        delay = self.poll_initial
+        while True:
+            # Back off exponentially, with jitter so that concurrent pollers spread out
+            sleep = min(delay * random.uniform(0.8, 1.2), self.poll_max)
+            if time.monotonic() + sleep > self.deadline:
+                raise StagePending(name)
+            time.sleep(sleep)
+            resource = get_aiplatform_resource(name)
+            if is_done(resource):
+                return resource
+            delay = min(delay * 2, self.poll_max)
+
+    def run_operation(self, stage: str, submit: Callable[[], Optional[str]], is_done: Callable[[Dict[str, Any]], bool],
+                      succeeded: Callable[[Dict[str, Any]], bool]) -> Optional[Dict[str, Any]]:
+        """
+        Start a long-running operation, or resume the one recorded for the stage, and wait for it.
+
+        A failed operation is forgotten, so that rerunning the stage submits it again.
+
+        Args:
+            stage (str): The stage name.
+            submit (Callable[[], Optional[str]]): Starts the operation and returns its resource name.
+            is_done (Callable[[Dict[str, Any]], bool]): Whether the resource has reached a final state.
+            succeeded (Callable[[Dict[str, Any]], bool]): Whether the final state is a success.
+
+        Returns:
+            Optional[Dict[str, Any]]: The resource in its final state, or None if the operation failed.
+        """
+        name = self.checkpoint.get(stage).get("operation")
+        if not name:
+            name = submit()
+            if name is None:
+                return None
+            self.checkpoint.update(stage, operation=name)
+
+        resource = self.wait(name, is_done)
+        if not succeeded(resource):
+            print(f"{name} failed: {json.dumps(resource.get('error', resource.get('state')))}")
+            self.checkpoint.update(stage, operation=None)
+            return None
+        return resource
+
+    def run(self, stages: List[Tuple[str, Callable[[Dict[str, Any]], Any]]]) -> str:
+        """
+        Run the stages in order until one fails or is left pending.
+
+        Each stage is called with the results of the previous stages, keyed by stage name. A result
+        of None or False fails the stage, any other result is recorded in the checkpoint.
+
+        Args:
+            stages (List[Tuple[str, Callable[[Dict[str, Any]], Any]]]): The stage names and functions.
+
+        Returns:
+            str: "DONE", "PENDING" or "FAILED".
+        """
+        results = {}
+        status = "DONE"
+        for stage, func in stages:
+            record = self.checkpoint.get(stage)
+            if record.get("status") == "done":
+                results[stage] = record.get("result")
+                continue
+
+            # Leave the stage to the next run rather than start it after the deadline
+            if time.monotonic() >= self.deadline:
+                status = "PENDING"
+                break
+
+            # Wall time accumulates over the runs that worked on the stage
+            self.checkpoint.update(stage, status="running", started=record.get("started") or datetime.now().isoformat())
+            start = time.monotonic()
+            try:
+                result = func(results)
+            except StagePending as e:
+                print(f"Stage {stage} is waiting for {e}")
+                result, status = None, "PENDING"
+            except Exception as e:
+                if hasattr(e, 'message'):
+                    print(f'Stage {stage} failed: ' + e.message)
+                else:
+                    print(f'Stage {stage} failed: ' + str(e))
+                result = None
+            wall_s = record.get("wall_s", 0) + time.monotonic() - start
+
+            if status == "PENDING":
+                self.checkpoint.update(stage, status="pending", wall_s=wall_s)
+                break
+            if result is None or result is False:
+                self.checkpoint.update(stage, status="failed", wall_s=wall_s)
+                status = "FAILED"
+                break
+            self.checkpoint.update(stage, status="done", result=result, wall_s=wall_s, finished=datetime.now().isoformat())
+            results[stage] = result
+
+        self.report()
+        return status
+
+    def report(self) -> None:
+        """
+        Print the status and wall time of every stage in the checkpoint.
+        """
+        print(f"{'stage':16} {'status':8} {'wall s':>9} {'elapsed s':>10}")
+        for stage, record in self.checkpoint.state["stages"].items():
+            # Elapsed time includes the time spent waiting between runs
+            elapsed = ""
+            if record.get("finished"):
+                elapsed = f"{(datetime.fromisoformat(record['finished']) - datetime.fromisoformat(record['started'])).total_seconds():.0f}"
+            print(f"{stage:16} {record.get('status', ''):8} {record.get('wall_s', 0):>9.1f} {elapsed:>10}")
+
+def refresh_pipeline(run_id: str, project_number: Optional[str] = None, index_endpoint: Optional[str] = None) -> str:
+    """
+    Run the generate, merge, export, create_index and deploy_index modes as one resumable pipeline.
+
+    Each stage starts once the previous one has finished, including the batch prediction job and
+    the index operations, which are polled rather than left for a later request. Progress is
+    checkpointed in `<CHECKPOINT_URI>/<run_id>.json`; calling again with the same `run_id` (for
+    example from Cloud Scheduler) resumes the run from its last finished stage. The index stages
+    only run when `project_number` is given, and a new Index Endpoint is created unless
+    `index_endpoint` is given. The index is deployed under `get_deployed_index_id(run_id)`, so
+    refreshing an existing Index Endpoint adds the new index next to the one already deployed.
+
+    Args:
+        run_id (str): Identifies the pipeline run and its checkpoint.
+        project_number (Optional[str]): Google Cloud project number, to create and deploy the index.
+        index_endpoint (Optional[str]): Resource name of an existing Index Endpoint to deploy to.
+
+    Returns:
+        str: "DONE", "PENDING" or "FAILED".
+    """
+    checkpoint_uri = os.environ.get("CHECKPOINT_URI", "gs://" + os.environ["DATASET_BUCKET"] + "/checkpoints")
+    orchestrator = StageOrchestrator(
+        PipelineCheckpoint(f"{checkpoint_uri}/{run_id}.json"),
+        time_budget=float(os.environ.get("ORCHESTRATOR_TIME_BUDGET", "480")),
+        poll_initial=float(os.environ.get("ORCHESTRATOR_POLL_INITIAL", "30")),
+        poll_max=float(os.environ.get("ORCHESTRATOR_POLL_MAX", "300"))
+    )
+    incremental = os.environ.get("EMBEDDING_MODE", "full") == "incremental"
+    operation_done = lambda operation: operation.get("done", False)
+    operation_succeeded = lambda operation: "error" not in operation
+
+    def chunk(results: Dict[str, Any]) -> bool:
+        if os.environ.get("CHUNKER", "udf") == "python":
+            return chunk_job_posts()
+        return trans_job_posts()
+
+    def select_delta(results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        delta_rows = prepare_embedding_delta()
+        if delta_rows is None:
+            return None
+        return {"rows": delta_rows, "delta_table": get_delta_output_table() if delta_rows else None}
+
+    def embed(results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        uris = {}
+        if incremental:
+            delta_table = results["select_delta"]["delta_table"]
+            if delta_table is None:
+                return {"skipped": "embeddings are up to date"}
+            uris = {"input_uri": f"bq://{os.environ['DESTINATION_TABLE']}-delta", "output_uri": f"bq://{delta_table}"}
+        job = orchestrator.run_operation(
+            "embed",
+            lambda: batch_embeddings(**uris),
+            lambda job: job.get("state") in BATCH_PREDICTION_TERMINAL,
+            lambda job: job.get("state") in BATCH_PREDICTION_SUCCEEDED
+        )
+        return job and {"job": job["name"], "state": job["state"]}
+
+    def merge(results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        delta_table = results["select_delta"]["delta_table"]
+        if delta_table is None:
+            return {"skipped": "embeddings are up to date"}
+        return merge_embeddings(delta_table) and {"merged": delta_table}
+
+    def index(results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        operation = orchestrator.run_operation("create_index", lambda: create_index(project_number), operation_done, operation_succeeded)
+        return operation and {"index": operation["response"]["name"]}
+
+    def endpoint(results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if index_endpoint:
+            return {"index_endpoint": index_endpoint}
+        operation = orchestrator.run_operation("create_endpoint", lambda: create_index_endpoint(project_number), operation_done, operation_succeeded)
+        return operation and {"index_endpoint": operation["response"]["name"]}
+
+    def deploy(results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        deployed_index_id = get_deployed_index_id(run_id)
+        operation = orchestrator.run_operation(
+            "deploy_index",
+            lambda: submit_deploy_index(results["create_endpoint"]["index_endpoint"], results["create_index"]["index"], deployed_index_id),
+            operation_done,
+            operation_succeeded
+        )
+        return operation and {"deployed_index_id": deployed_index_id}
+
+    # Build the stage list, the order is the dependency order
+    stages = [("chunk", chunk)]
+    if incremental:
+        stages.append(("select_delta", select_delta))
+    stages.append(("embed", embed))
+    if incremental:
+        stages.append(("merge", merge))
+    stages += [
+        ("weight", lambda results: get_weighted_embeddings()),
+        ("export", lambda results: export_embeddings())
+    ]
+    if project_number:
+        stages += [("create_index", index), ("create_endpoint", endpoint), ("deploy_index", deploy)]
+
+    return orchestrator.run(stages)
 
 @functions_framework.http
 def trans(request: Request) -> str:
@@ -378,22 +1411,41 @@ def trans(request: Request) -> str:
 
     if "mode" in request_json:
         if request_json["mode"] == "generate_embeddings":
-            split_descriptions = trans_job_posts()
+            # CHUNKER=python chunks descriptions in this function instead of the BigQuery JavaScript UDF
+            if os.environ.get("CHUNKER", "udf") == "python":
+                split_descriptions = chunk_job_posts()
+            else:
+                split_descriptions = trans_job_posts()
             if split_descriptions:
-                batch_embeddings()
+                # EMBEDDING_MODE=incremental only embeds new or changed chunks
+                if os.environ.get("EMBEDDING_MODE", "full") == "incremental":
+                    incremental_embeddings()
+                else:
+                    batch_embeddings()
+
+        if "delta_table" in request_json and request_json["mode"] == "merge_embeddings":
+            merge_embeddings(request_json["delta_table"])
 
         if request_json["mode"] == "export_embeddings":
             weighted_embeddings = get_weighted_embeddings()
             if weighted_embeddings:
-                export_to_gcs()
+                export_embeddings()
 
         if "project_number" in request_json and request_json["mode"] == "create_index":
             project_number = request_json["project_number"]
-            create_index(project_number)
+            create_index(project_number, request_json.get("index_config"))
 
         if "index_id" in request_json and "project_number" in request_json and request_json["mode"] == "deploy_index":
             index_id = request_json["index_id"]
             project_number = request_json["project_number"]
             deploy_index(project_number, index_id)
 
+        # Run every stage in turn, resuming the checkpointed run with the same run_id
+        if request_json["mode"] == "refresh":
+            return refresh_pipeline(
+                request_json.get("run_id", datetime.now().strftime("%Y%m%d")),
+                project_number=request_json.get("project_number"),
+                index_endpoint=request_json.get("index_endpoint")
+            )
+
     return 'OK'
\ No newline at end of file
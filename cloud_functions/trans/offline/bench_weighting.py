@@ -0,0 +1,205 @@
+"""
+Benchmark the weighted embeddings engines: the JavaScript UDF, native SQL and vectorised Python.
+
+Usage:
+    python offline/bench_weighting.py [--source TABLE] [--repeat N] [--keep]
+    python offline/bench_weighting.py --synthetic JOBS [--chunks-per-job N]
+
+Against BigQuery, the UDF and native SQL queries of `get_weighted_embeddings_query` are run on
+the real chunk embeddings table into `<weighted table>-bench-<engine>` tables, reporting wall
+time, slot time and bytes processed for each, and the largest difference between the two
+results. The Python engine is timed separately for reading the chunk embeddings and for
+`get_grouped_weighted_embeddings`. The bench tables are dropped unless `--keep` is given.
+
+With `--synthetic`, no cloud access is needed: `get_grouped_weighted_embeddings` is timed
+against a direct Python port of the UDF's per-dimension map/reduce on generated embeddings of
+the same shape as the real table.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules shared between the functions, vendored into them at deploy time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "shared"))
+
+import main
+
+WEIGHTED_TABLE = "ml-spez-ccai.processed.weighted_embeddings-2024"
+
+
+def run_query_engine(client: "main.bigquery.Client", engine: str, source: str) -> Dict[str, float]:
+    """
+    Run one weighted embeddings query and collect its job statistics.
+
+    Args:
+        client (bigquery.Client): The BigQuery client.
+        engine (str): "sql" or "udf".
+        source (str): The table of chunk embeddings.
+
+    Returns:
+        Dict[str, float]: Wall seconds, slot seconds and GiB processed.
+    """
+    query_job = client.query(main.get_weighted_embeddings_query(engine, source, f"{WEIGHTED_TABLE}-bench-{engine}"))
+    query_job.result()
+    return {
+        "wall_s": (query_job.ended - query_job.started).total_seconds(),
+        "slot_s": (query_job.slot_millis or 0) / 1000,
+        "gib": (query_job.total_bytes_processed or 0) / 2 ** 30,
+    }
+
+
+def compare_tables(client: "main.bigquery.Client") -> Dict[str, float]:
+    """
+    Compare the UDF and native SQL results.
+
+    Args:
+        client (bigquery.Client): The BigQuery client.
+
+    Returns:
+        Dict[str, float]: Number of jobs in each table and the largest absolute difference per dimension.
+    """
+    query = f'''
+    WITH udf AS (
+        SELECT id, dimension, value FROM `{WEIGHTED_TABLE}-bench-udf`, UNNEST(embedding) AS value WITH OFFSET AS dimension
+    ),
+    native AS (
+        SELECT id, dimension, value FROM `{WEIGHTED_TABLE}-bench-sql`, UNNEST(embedding) AS value WITH OFFSET AS dimension
+    )
+    SELECT
+        (SELECT COUNT(DISTINCT id) FROM udf) AS udf_jobs,
+        (SELECT COUNT(DISTINCT id) FROM native) AS sql_jobs,
+        (SELECT MAX(ABS(udf.value - native.value)) FROM udf JOIN native USING (id, dimension)) AS max_abs_diff
+    '''
+    row = list(client.query(query).result())[0]
+    return {"udf_jobs": row["udf_jobs"], "sql_jobs": row["sql_jobs"], "max_abs_diff": row["max_abs_diff"]}
+
+
+def run_python_engine(client: "main.bigquery.Client", source: str) -> Dict[str, float]:
+    """
+    Time the Python engine, split into reading the chunk embeddings and combining them.
+
+    Args:
+        client (bigquery.Client): The BigQuery client.
+        source (str): The table of chunk embeddings.
+
+    Returns:
+        Dict[str, float]: Read and compute seconds, and the number of chunks and jobs.
+    """
+    query = f'''
+    SELECT job_id, chunk_size, JSON_VALUE_ARRAY(predictions[0].embeddings.values) AS embedding
+    FROM `{source}`
+    WHERE content != "" AND predictions IS NOT null
+    '''
+    start = time.perf_counter()
+    job_ids, chunk_lens, chunk_embeddings = [], [], []
+    for row in client.query(query).result(page_size=10000):
+        job_ids.append(row["job_id"])
+        chunk_lens.append(row["chunk_size"])
+        chunk_embeddings.append(np.asarray(row["embedding"], dtype=np.float32))
+    matrix = np.vstack(chunk_embeddings)
+    read_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    weighted = main.get_grouped_weighted_embeddings(job_ids, matrix, chunk_lens)
+    compute_s = time.perf_counter() - start
+
+    return {"read_s": read_s, "compute_s": compute_s, "chunks": len(job_ids), "jobs": len(weighted)}
+
+
+def udf_port(chunk_embeddings: List[List[float]], chunk_lens: List[int]) -> List[float]:
+    """
+    Direct Python port of the JavaScript UDF, for the synthetic comparison.
+
+    Args:
+        chunk_embeddings (List[List[float]]): The chunk embeddings of one job.
+        chunk_lens (List[int]): The chunk sizes of one job.
+
+    Returns:
+        List[float]: The weighted average embedding.
+    """
+    weights_sum = sum(chunk_lens)
+    return [
+        sum(arr[i] * chunk_lens[k] / weights_sum for k, arr in enumerate(chunk_embeddings))
+        for i in range(len(chunk_embeddings[0]))
+    ]
+
+
+def run_synthetic(jobs: int, chunks_per_job: float, repeat: int) -> None:
+    """
+    Compare `get_grouped_weighted_embeddings` with the UDF port on generated embeddings.
+
+    Args:
+        jobs (int): Number of jobs.
+        chunks_per_job (float): Average number of chunks per job.
+        repeat (int): Number of timed runs of the vectorised path.
+    """
+    rng = np.random.default_rng(0)
+    counts = 1 + rng.poisson(chunks_per_job - 1, jobs)
+    job_ids = np.repeat(np.arange(jobs).astype(str), counts)
+    embeddings = rng.standard_normal((len(job_ids), 768)).astype(np.float32)
+    chunk_lens = rng.integers(100, 10000, len(job_ids))
+    print(f"{jobs} jobs, {len(job_ids)} chunks")
+
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        weighted = main.get_grouped_weighted_embeddings(job_ids.tolist(), embeddings, chunk_lens.tolist())
+        runs.append(time.perf_counter() - start)
+    print(f"vectorised: median {statistics.median(runs):.3f} s")
+
+    # The port is too slow to run on every job, time a sample and extrapolate
+    sample = min(jobs, 200)
+    offsets = np.r_[0, np.cumsum(counts)]
+    embedding_lists = embeddings.tolist()
+    start = time.perf_counter()
+    max_diff = 0.0
+    for job in range(sample):
+        rows = range(offsets[job], offsets[job + 1])
+        result = udf_port([embedding_lists[i] for i in rows], [int(chunk_lens[i]) for i in rows])
+        max_diff = max(max_diff, float(np.abs(np.asarray(result) - weighted[str(job)]).max()))
+    elapsed = (time.perf_counter() - start) * jobs / sample
+    print(f"UDF port:   {elapsed:.3f} s (extrapolated from {sample} jobs), max abs diff {max_diff:.2e}")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="ml-spez-ccai.processed.embeddings-2024", help="Chunk embeddings table")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per engine")
+    parser.add_argument("--keep", action="store_true", help="Keep the bench tables")
+    parser.add_argument("--synthetic", type=int, metavar="JOBS", help="Benchmark locally on generated embeddings")
+    parser.add_argument("--chunks-per-job", type=float, default=1.4, help="Average chunks per job for --synthetic")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        run_synthetic(args.synthetic, args.chunks_per_job, args.repeat)
+        return
+
+    client = main.bigquery.Client()
+    print(f"{'engine':8} {'wall s':>8} {'slot s':>8} {'GiB':>8}")
+    for engine in ("udf", "sql"):
+        results = [run_query_engine(client, engine, args.source) for _ in range(args.repeat)]
+        print(
+            f"{engine:8} {statistics.median(r['wall_s'] for r in results):>8.1f} "
+            f"{statistics.median(r['slot_s'] for r in results):>8.1f} {results[0]['gib']:>8.2f}"
+        )
+    print(compare_tables(client))
+
+    python = run_python_engine(client, args.source)
+    print(
+        f"python: read {python['read_s']:.1f} s, compute {python['compute_s']:.2f} s "
+        f"({python['chunks']} chunks, {python['jobs']} jobs)"
+    )
+
+    if not args.keep:
+        for engine in ("udf", "sql"):
+            client.delete_table(f"{WEIGHTED_TABLE}-bench-{engine}", not_found_ok=True)
+
+
+if __name__ == "__main__":
+    main_cli()
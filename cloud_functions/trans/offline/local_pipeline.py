@@ -0,0 +1,471 @@
+"""
+Run the `generate_embeddings` and `export_embeddings` stages of the trans function in-process.
+
+Usage:
+    python offline/local_pipeline.py JOB_POSTINGS [--output PATH] [--embedder hash|vertex]
+        [--chunk-size N] [--boundary compat_udf|sentence|newline|whitespace] [--overlap N]
+        [--batch-size N] [--chunks-output PATH] [--limit N]
+
+JOB_POSTINGS is a .csv, .parquet or newline-delimited .json file with `job_id` and
+`description` columns, such as an export of the job postings table. Rows are streamed through
+the same stages as the BigQuery pipeline, without materialising any table:
+
+    read -> chunk (`iter_chunks`, like `trans_job_posts`) -> embed -> weight (like the
+    `weighted_embeddings` UDF) -> write
+
+The weighted embeddings are written in the format of `export_to_gcs` (one `{"id", "embedding"}`
+JSON object per line) to a local file, a `gs://` URI or a `bq://project.dataset.table`. The
+`hash` embedder is a local stand-in for textembedding-gecko that needs no cloud access. The
+wall time spent in every stage is printed at the end.
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules shared between the functions, vendored into them at deploy time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "shared"))
+
+import main
+
+TOKEN_REGEX = re.compile(r"\w+")
+
+
+class StageTimer:
+    """
+    Accumulate the wall time and item count of every pipeline stage.
+
+    Stages are interleaved by the streaming pipeline, so each stage only times its own work.
+    """
+
+    def __init__(self) -> None:
+        self.timings: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, count: int = 1) -> Iterator[None]:
+        """
+        Time a block of work as part of a stage.
+
+        Args:
+            name (str): The name of the stage.
+            count (int): The number of items processed by the block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def report(self) -> str:
+        """
+        Describe the time spent in every stage.
+
+        Returns:
+            str: One line per stage with its item count, total time and throughput, then the wall time.
+        """
+        lines = [f"{'stage':12} {'items':>10} {'seconds':>10} {'items/s':>12}"]
+        for name, elapsed in self.timings.items():
+            count = self.counts[name]
+            lines.append(f"{name:12} {count:>10} {elapsed:>10.3f} {count / elapsed if elapsed else 0:>12.1f}")
+        lines.append(f"{'wall':12} {'':>10} {time.perf_counter() - self._start:>10.3f}")
+        return "\n".join(lines)
+
+
+def read_rows(path: str, columns: List[str], batch_rows: int = 10000) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the rows of a CSV, Parquet or newline-delimited JSON file.
+
+    Args:
+        path (str): The input file.
+        columns (List[str]): The columns to read.
+        batch_rows (int): Number of rows decoded at a time from Parquet files.
+
+    Yields:
+        Dict[str, Any]: One dictionary per row.
+    """
+    if path.endswith(".parquet"):
+        # Only needed for Parquet inputs
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=columns):
+            yield from batch.to_pylist()
+    elif path.endswith((".json", ".jsonl", ".ndjson")):
+        with open(path, "r", encoding="utf8") as file:
+            for line in file:
+                if line.strip():
+                    row = json.loads(line)
+                    yield {column: row.get(column) for column in columns}
+    else:
+        # Job descriptions are longer than the default field size limit
+        csv.field_size_limit(sys.maxsize)
+        with open(path, "r", encoding="utf8", newline="") as file:
+            for row in csv.DictReader(file):
+                yield {column: row.get(column) for column in columns}
+
+
+class EmbeddingBackend(ABC):
+    """
+    Interface of the embedding backends used by the local pipeline.
+    """
+
+    dimensions = 768
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a batch of texts.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in input order.
+        """
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Local stand-in for textembedding-gecko: L2-normalised signed feature hashing of lowercase tokens.
+
+    Texts sharing vocabulary get similar vectors, which is enough to exercise chunking, weighting,
+    export and index tooling end to end without cloud access or spend.
+    """
+
+    def __init__(self, dimensions: int = 768) -> None:
+        self.dimensions = dimensions
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        embeddings = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in TOKEN_REGEX.findall(text.lower()):
+                digest = zlib.crc32(token.encode("utf8"))
+                embeddings[row, digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+        return embeddings.tolist()
+
+
+class VertexEmbeddingBackend(EmbeddingBackend):
+    """
+    Embedding backend calling textembedding-gecko online, `batch_size` texts per request.
+    """
+
+    def __init__(self, model: str = "textembedding-gecko", batch_size: int = 5) -> None:
+        from vertexai.preview.language_models import TextEmbeddingModel
+
+        self.model = TextEmbeddingModel.from_pretrained(model)
+        self.batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        for i in range(0, len(texts), self.batch_size):
+            embeddings.extend(embedding.values for embedding in self.model.get_embeddings(texts[i:i + self.batch_size]))
+        return embeddings
+
+
+class RecordSink(ABC):
+    """
+    Interface of the storage backends receiving the pipeline output, one JSON-serialisable record at a time.
+    """
+
+    @abstractmethod
+    def write(self, record: Dict[str, Any]) -> None:
+        """
+        Store one record.
+
+        Args:
+            record (Dict[str, Any]): The record.
+        """
+
+    def close(self) -> None:
+        """
+        Flush buffered records and release resources.
+        """
+
+
+class NdjsonSink(RecordSink):
+    """
+    Write records as newline-delimited JSON to a local file, or to a `gs://` URI uploaded on close.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.uri = path if path.startswith("gs://") else None
+        self.path = tempfile.mkstemp(suffix=".json")[1] if self.uri else path
+        self._file = open(self.path, "w", encoding="utf8")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record) + "\n")
+
+    def close(self) -> None:
+        self._file.close()
+        if self.uri:
+            bucket_name, _, blob_name = self.uri[len("gs://"):].partition("/")
+            main.storage.Client().bucket(bucket_name).blob(blob_name).upload_from_filename(self.path)
+            os.remove(self.path)
+
+
+class BigQuerySink(RecordSink):
+    """
+    Load records into a BigQuery table in batches of `batch_rows`, replacing the table on the first batch.
+    """
+
+    def __init__(self, table: str, batch_rows: int = 5000) -> None:
+        self.table = table
+        self.batch_rows = batch_rows
+        self._client = main.bigquery.Client()
+        self._rows: List[Dict[str, Any]] = []
+        self._write_disposition = main.bigquery.WriteDisposition.WRITE_TRUNCATE
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._rows.append(record)
+        if len(self._rows) >= self.batch_rows:
+            self._flush()
+
+    def close(self) -> None:
+        if self._rows:
+            self._flush()
+
+    def _flush(self) -> None:
+        job_config = main.bigquery.LoadJobConfig(autodetect=True, write_disposition=self._write_disposition)
+        self._client.load_table_from_json(self._rows, self.table, job_config=job_config).result()
+        self._rows = []
+        self._write_disposition = main.bigquery.WriteDisposition.WRITE_APPEND
+
+
+class MemorySink(RecordSink):
+    """
+    Keep records in a list, for benchmarks and tests.
+    """
+
+    def __init__(self) -> None:
+        self.records: List[Dict[str, Any]] = []
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.records.append(record)
+
+
+def get_sink(uri: str) -> RecordSink:
+    """
+    Get the storage backend for an output URI.
+
+    Args:
+        uri (str): `bq://project.dataset.table`, `gs://bucket/path` or a local path.
+
+    Returns:
+        RecordSink: The storage backend.
+    """
+    if uri.startswith("bq://"):
+        return BigQuerySink(uri[len("bq://"):])
+    return NdjsonSink(uri)
+
+
+def timed_rows(rows: Iterator[Dict[str, Any]], timer: StageTimer) -> Iterator[Dict[str, Any]]:
+    """
+    Time the reading of input rows.
+
+    Args:
+        rows (Iterator[Dict[str, Any]]): The input rows.
+        timer (StageTimer): The stage timer.
+
+    Yields:
+        Dict[str, Any]: The input rows.
+    """
+    while True:
+        with timer.stage("read", 0):
+            row = next(rows, None)
+        if row is None:
+            return
+        timer.counts["read"] += 1
+        yield row
+
+
+def chunk_rows(rows: Iterator[Dict[str, Any]], chunk_size: int, boundary: str, overlap: int, timer: StageTimer) -> Iterator[Dict[str, Any]]:
+    """
+    Split job descriptions into chunks, like `trans_job_posts`.
+
+    Args:
+        rows (Iterator[Dict[str, Any]]): Job postings with `job_id` and `description`.
+        chunk_size (int): The maximum chunk size.
+        boundary (str): The chunk boundary type, see `iter_chunks`.
+        overlap (int): The chunk overlap, see `iter_chunks`.
+        timer (StageTimer): The stage timer.
+
+    Yields:
+        Dict[str, Any]: Chunks with `job_id`, `content`, `chunk_size` and `is_split`, the columns of the chunks table.
+    """
+    for row in rows:
+        description = row["description"]
+        if not description:
+            continue
+        with timer.stage("chunk"):
+            is_split = main.chunk_length(description, boundary) > chunk_size
+            chunks = list(main.iter_chunks(description, chunk_size, boundary, overlap))
+        for chunk in chunks:
+            yield {
+                "job_id": str(row["job_id"]),
+                "content": chunk["chunk_content"],
+                "chunk_size": chunk["chunk_size"],
+                "is_split": is_split
+            }
+
+
+def embed_chunks(chunks: Iterator[Dict[str, Any]], backend: EmbeddingBackend, batch_size: int, timer: StageTimer) -> Iterator[Dict[str, Any]]:
+    """
+    Embed chunks in batches, keeping their order. Empty chunks are dropped, as in `get_weighted_embeddings`.
+
+    Args:
+        chunks (Iterator[Dict[str, Any]]): The chunks.
+        backend (EmbeddingBackend): The embedding backend.
+        batch_size (int): Number of chunks per `embed` call.
+        timer (StageTimer): The stage timer.
+
+    Yields:
+        Dict[str, Any]: The chunks with an added `embedding`.
+    """
+    batch: List[Dict[str, Any]] = []
+
+    def flush() -> List[Dict[str, Any]]:
+        with timer.stage("embed", len(batch)):
+            embeddings = backend.embed([chunk["content"] for chunk in batch])
+        for chunk, embedding in zip(batch, embeddings):
+            chunk["embedding"] = embedding
+        return batch
+
+    for chunk in chunks:
+        if chunk["content"] == "":
+            continue
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield from flush()
+            batch = []
+    if batch:
+        yield from flush()
+
+
+def weight_chunks(chunks: Iterator[Dict[str, Any]], timer: StageTimer) -> Iterator[Dict[str, Any]]:
+    """
+    Combine the chunk embeddings of every job, like the `weighted_embeddings` UDF.
+
+    A job that was not split keeps its only embedding; the embeddings of a split job are
+    averaged, weighted by chunk size. Chunks of a job arrive consecutively, so each job is
+    emitted as soon as its last chunk has been seen.
+
+    Args:
+        chunks (Iterator[Dict[str, Any]]): Embedded chunks, grouped by job.
+        timer (StageTimer): The stage timer.
+
+    Yields:
+        Dict[str, Any]: `{"id", "embedding"}` records, the rows of the weighted embeddings table.
+    """
+    job_id: Optional[str] = None
+    embeddings: List[List[float]] = []
+    weights: List[int] = []
+    is_split = True
+
+    def combine() -> Dict[str, Any]:
+        with timer.stage("weight"):
+            if not is_split:
+                embedding = embeddings[0]
+            else:
+                matrix = np.asarray(embeddings, dtype=np.float64)
+                lens = np.asarray(weights, dtype=np.float64)
+                embedding = (lens @ matrix / lens.sum()).tolist()
+        return {"id": job_id, "embedding": embedding}
+
+    for chunk in chunks:
+        if chunk["job_id"] != job_id:
+            if job_id is not None:
+                yield combine()
+            job_id, embeddings, weights, is_split = chunk["job_id"], [], [], True
+        embeddings.append(chunk["embedding"])
+        weights.append(chunk["chunk_size"])
+        is_split = is_split and chunk["is_split"]
+    if job_id is not None:
+        yield combine()
+
+
+def run_local_pipeline(rows: Iterator[Dict[str, Any]], backend: EmbeddingBackend, sink: RecordSink, chunk_size: int = 10000,
+                       boundary: str = "compat_udf", overlap: int = 0, batch_size: int = 250,
+                       chunks_sink: Optional[RecordSink] = None) -> StageTimer:
+    """
+    Stream job postings through the chunk, embed and weight stages into a storage backend.
+
+    Args:
+        rows (Iterator[Dict[str, Any]]): Job postings with `job_id` and `description`.
+        backend (EmbeddingBackend): The embedding backend.
+        sink (RecordSink): The storage backend receiving the weighted embeddings.
+        chunk_size (int): The maximum chunk size.
+        boundary (str): The chunk boundary type, see `iter_chunks`.
+        overlap (int): The chunk overlap, see `iter_chunks`.
+        batch_size (int): Number of chunks per embedding batch.
+        chunks_sink (Optional[RecordSink]): Optional storage backend receiving every embedded chunk,
+            the rows of the embeddings table.
+
+    Returns:
+        StageTimer: The time spent in every stage.
+    """
+    timer = StageTimer()
+    chunks = chunk_rows(timed_rows(iter(rows), timer), chunk_size, boundary, overlap, timer)
+    embedded = embed_chunks(chunks, backend, batch_size, timer)
+
+    if chunks_sink is not None:
+        def tee(embedded_chunks: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+            for chunk in embedded_chunks:
+                with timer.stage("write_chunks"):
+                    chunks_sink.write(chunk)
+                yield chunk
+        embedded = tee(embedded)
+
+    for record in weight_chunks(embedded, timer):
+        with timer.stage("write"):
+            sink.write(record)
+
+    with timer.stage("write", 0):
+        sink.close()
+        if chunks_sink is not None:
+            chunks_sink.close()
+
+    return timer
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Job postings (.csv, .parquet or .json)")
+    parser.add_argument("--output", default="embeddings-2024.json", help="Local path, gs:// URI or bq:// table")
+    parser.add_argument("--embedder", choices=["hash", "vertex"], default="hash", help="Embedding backend")
+    parser.add_argument("--chunk-size", type=int, default=int(os.environ.get("CHUNK_SIZE", "10000")))
+    parser.add_argument("--boundary", default=os.environ.get("CHUNK_BOUNDARY", "compat_udf"))
+    parser.add_argument("--overlap", type=int, default=int(os.environ.get("CHUNK_OVERLAP", "0")))
+    parser.add_argument("--batch-size", type=int, default=250, help="Chunks per embedding batch")
+    parser.add_argument("--chunks-output", help="Also write every embedded chunk to this path, gs:// URI or bq:// table")
+    parser.add_argument("--limit", type=int, help="Only process the first N postings")
+    args = parser.parse_args()
+
+    rows = read_rows(args.input, ["job_id", "description"])
+    if args.limit:
+        rows = (row for i, row in zip(range(args.limit), rows))
+
+    backend = HashingEmbeddingBackend() if args.embedder == "hash" else VertexEmbeddingBackend()
+    timer = run_local_pipeline(
+        rows, backend, get_sink(args.output), args.chunk_size, args.boundary, args.overlap, args.batch_size,
+        get_sink(args.chunks_output) if args.chunks_output else None
+    )
+    print(timer.report())
+
+
+if __name__ == "__main__":
+    main_cli()
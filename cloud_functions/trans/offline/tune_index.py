@@ -0,0 +1,412 @@
+"""
+Tune the tree-AH parameters of `create_index` against exact neighbours of the exported embeddings.
+
+Usage:
+    python offline/tune_index.py SOURCE [--queries N] [--k K] [--target-recall R] [--output PATH]
+    python offline/tune_index.py --synthetic ROWS
+
+SOURCE is a local copy of the sharded export (a directory holding `manifest.json`, see
+`export_embedding_shards`) or a newline-delimited JSON file of {"id", "embedding"} records, such
+as the `export_to_gcs` export or the output of `local_pipeline.py`. `--synthetic` generates
+clustered unit vectors instead, so the tool runs without any export.
+
+A sample of the embeddings is held out as queries and their exact top-k neighbours by dot
+product, the index's default distance, are computed on the rest. The tree is simulated by
+k-means partitions of `leafNodeEmbeddingCount` embeddings on average; a query scores every
+partition centroid and searches the best `leafNodesToSearchPercent` of them. Each setting is
+reported with its recall@k and its cost: embeddings scored per query, as a fraction of a brute
+force search, and local milliseconds per query. The cheapest setting reaching `--target-recall`
+is then searched again with 4-bit product quantization standing in for asymmetric hashing,
+keeping `approximateNeighborsCount` candidates for exact reordering, to pick the smallest count
+that recovers the exact-scoring recall. Partitioning and quantization only approximate the
+service, so treat the recall as a guide and confirm it on the deployed index.
+
+The recommended config is written to `--output`, to be passed to `create_index` through the
+INDEX_CONFIG environment variable or the `index_config` field of a create_index request.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules shared between the functions, vendored into them at deploy time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "shared"))
+
+import main
+
+LEAF_NODE_EMBEDDING_COUNTS = [250, 500, 1000, 2000, 5000]
+LEAF_NODES_TO_SEARCH_PERCENTS = [1, 2, 5, 10, 20, 30]
+APPROXIMATE_NEIGHBORS_FACTORS = [1, 2, 5, 10, 20]
+
+
+def read_embeddings(source: str) -> np.ndarray:
+    """
+    Read the exported embeddings.
+
+    Args:
+        source (str): A directory holding the sharded export, or an NDJSON file.
+
+    Returns:
+        np.ndarray: One float32 row per job.
+    """
+    if os.path.isdir(source):
+        _, matrices = main.load_embedding_shards(source)
+        return np.vstack(matrices).astype(np.float32)
+
+    with open(source, "r") as file:
+        return np.asarray([json.loads(line)["embedding"] for line in file if line.strip()], dtype=np.float32)
+
+
+def synthetic_embeddings(rows: int, dimensions: int = 768, clusters: int = 1000, seed: int = 0) -> np.ndarray:
+    """
+    Generate clustered unit vectors with the shape of the real export.
+
+    Args:
+        rows (int): Number of embeddings.
+        dimensions (int): Embedding dimensions.
+        clusters (int): Number of topics the embeddings are drawn around.
+        seed (int): Random seed.
+
+    Returns:
+        np.ndarray: The embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, rows)] + 1.5 * rng.standard_normal((rows, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Find the columns of the k highest scores of each row, best first.
+
+    Args:
+        scores (np.ndarray): A (rows, columns) score matrix.
+        k (int): Number of columns to keep.
+
+    Returns:
+        np.ndarray: A (rows, min(k, columns)) matrix of column indices.
+    """
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def exact_neighbors(corpus: np.ndarray, queries: np.ndarray, k: int, block_rows: int = 65536) -> np.ndarray:
+    """
+    Compute the exact top-k neighbours of each query by dot product.
+
+    Args:
+        corpus (np.ndarray): The indexed embeddings.
+        queries (np.ndarray): The query embeddings.
+        k (int): Number of neighbours.
+        block_rows (int): Corpus rows scored at a time, to bound memory.
+
+    Returns:
+        np.ndarray: A (queries, k) matrix of corpus row indices, nearest first.
+    """
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(corpus), block_rows):
+        # Merge the top-k of this block with the top-k so far
+        scores = np.hstack([best_scores, queries @ corpus[start:start + block_rows].T])
+        rows = np.hstack([best_rows, np.broadcast_to(np.arange(start, min(start + block_rows, len(corpus))), (len(queries), scores.shape[1] - best_rows.shape[1]))])
+        top = top_k(scores, k)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+        best_scores = np.take_along_axis(scores, top, axis=1)
+    return best_rows
+
+
+def train_partitions(corpus: np.ndarray, leaves: int, iterations: int = 10, sample_rows: int = 100000, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Partition the corpus into leaves with k-means.
+
+    Args:
+        corpus (np.ndarray): The indexed embeddings.
+        leaves (int): Number of leaves.
+        iterations (int): Lloyd iterations on the training sample.
+        sample_rows (int): Rows of the corpus the centroids are trained on.
+        seed (int): Random seed.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The leaf centroids, the corpus rows ordered by
+            leaf, and the offset of each leaf in that order, with a final offset for the end.
+    """
+    rng = np.random.default_rng(seed)
+    sample = corpus[rng.choice(len(corpus), min(len(corpus), max(sample_rows, 20 * leaves)), replace=False)]
+    centroids = sample[rng.choice(len(sample), leaves, replace=False)].copy()
+
+    def assign(vectors: np.ndarray) -> np.ndarray:
+        # Nearest centroid by L2 distance, without computing the norms of the vectors
+        labels = np.empty(len(vectors), dtype=np.int64)
+        half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+        for start in range(0, len(vectors), 16384):
+            labels[start:start + 16384] = np.argmax(vectors[start:start + 16384] @ centroids.T - half_norms, axis=1)
+        return labels
+
+    for _ in range(iterations):
+        labels = assign(sample)
+        counts = np.bincount(labels, minlength=leaves)
+        # Sum the rows of each leaf in one pass over the sample sorted by leaf; empty leaves keep their centroid
+        filled = counts > 0
+        sums = np.add.reduceat(sample[np.argsort(labels, kind="stable")], np.r_[0, np.cumsum(counts)[:-1]][filled])
+        centroids[filled] = sums / counts[filled, None]
+
+    labels = assign(corpus)
+    order = np.argsort(labels, kind="stable")
+    offsets = np.r_[0, np.cumsum(np.bincount(labels, minlength=leaves))]
+    return centroids, order, offsets
+
+
+def train_quantizer(corpus: np.ndarray, block_dimensions: int = 2, centers: int = 16, iterations: int = 10, sample_rows: int = 4096, seed: int = 0) -> np.ndarray:
+    """
+    Train a product quantizer, 16 centers (4 bits) per block of 2 dimensions like tree-AH's hashing.
+
+    Args:
+        corpus (np.ndarray): The indexed embeddings.
+        block_dimensions (int): Dimensions per block.
+        centers (int): Centers per block.
+        iterations (int): Lloyd iterations on the training sample.
+        sample_rows (int): Rows of the corpus the codebooks are trained on.
+        seed (int): Random seed.
+
+    Returns:
+        np.ndarray: A (blocks, centers, block_dimensions) codebook.
+    """
+    rng = np.random.default_rng(seed)
+    sample = corpus[rng.choice(len(corpus), min(len(corpus), sample_rows), replace=False)]
+    blocks = sample.reshape(len(sample), -1, block_dimensions)
+    codebooks = blocks[rng.choice(len(blocks), centers, replace=False)].transpose(1, 0, 2).copy()
+    for _ in range(iterations):
+        codes = encode(sample, codebooks)
+        for center in range(centers):
+            # Mean of the sample sub-vectors assigned to each center, per block
+            mask = codes == center
+            counts = mask.sum(axis=0)
+            sums = np.einsum("rb,rbd->bd", mask.astype(np.float32), blocks)
+            filled = counts > 0
+            codebooks[filled, center] = sums[filled] / counts[filled, None]
+    return codebooks
+
+
+def encode(vectors: np.ndarray, codebooks: np.ndarray, block_rows: int = 2048) -> np.ndarray:
+    """
+    Encode vectors as the nearest codebook center of each block.
+
+    Args:
+        vectors (np.ndarray): The vectors.
+        codebooks (np.ndarray): The codebook from `train_quantizer`.
+        block_rows (int): Rows encoded at a time, to bound memory.
+
+    Returns:
+        np.ndarray: A (rows, blocks) uint8 matrix of center indices.
+    """
+    codes = np.empty((len(vectors), codebooks.shape[0]), dtype=np.uint8)
+    for start in range(0, len(vectors), block_rows):
+        blocks = vectors[start:start + block_rows].reshape(-1, codebooks.shape[0], 1, codebooks.shape[2])
+        codes[start:start + block_rows] = np.argmin(((blocks - codebooks) ** 2).sum(axis=-1), axis=-1)
+    return codes
+
+
+def search(corpus: np.ndarray, queries: np.ndarray, partitions: Tuple[np.ndarray, np.ndarray, np.ndarray], leaves_to_search: int, k: int,
+           quantizer: Optional[Tuple[np.ndarray, np.ndarray]] = None, approximate_neighbors: int = 0) -> Tuple[np.ndarray, float, float]:
+    """
+    Search the simulated tree for each query.
+
+    Args:
+        corpus (np.ndarray): The indexed embeddings.
+        queries (np.ndarray): The query embeddings.
+        partitions (Tuple[np.ndarray, np.ndarray, np.ndarray]): The output of `train_partitions`.
+        leaves_to_search (int): Number of leaves searched per query.
+        k (int): Number of neighbours.
+        quantizer (Optional[Tuple[np.ndarray, np.ndarray]]): The codebook and the corpus codes. When given,
+            candidates are scored on their codes and the best `approximate_neighbors` are reordered
+            by their exact score; otherwise every candidate is scored exactly.
+        approximate_neighbors (int): Candidates kept for exact reordering.
+
+    Returns:
+        Tuple[np.ndarray, float, float]: The (queries, k) neighbours, the mean number of embeddings
+            scored per query and the mean milliseconds per query.
+    """
+    centroids, order, offsets = partitions
+    results = np.full((len(queries), k), -1, dtype=np.int64)
+    scored = 0
+    start = time.perf_counter()
+    for i, query in enumerate(queries):
+        leaves = top_k((centroids @ query)[None, :], leaves_to_search)[0]
+        candidates = np.concatenate([order[offsets[leaf]:offsets[leaf + 1]] for leaf in leaves])
+        scored += len(centroids) + len(candidates)
+        if quantizer is not None:
+            # Score the codes with a per-query lookup table, then reorder the best exactly
+            codebooks, codes = quantizer
+            table = np.einsum("bcd,bd->bc", codebooks, query.reshape(codebooks.shape[0], -1))
+            approximate = table[np.arange(codebooks.shape[0]), codes[candidates]].sum(axis=1)
+            candidates = candidates[top_k(approximate[None, :], approximate_neighbors)[0]]
+        best = candidates[top_k((corpus[candidates] @ query)[None, :], k)[0]]
+        results[i, :len(best)] = best
+    return results, scored / len(queries), (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall(results: np.ndarray, truth: np.ndarray) -> float:
+    """
+    Compute the mean recall@k of search results against the exact neighbours.
+
+    Args:
+        results (np.ndarray): The (queries, k) neighbours found.
+        truth (np.ndarray): The (queries, k) exact neighbours.
+
+    Returns:
+        float: The fraction of exact neighbours found.
+    """
+    return float(np.mean([len(np.intersect1d(found, exact)) / truth.shape[1] for found, exact in zip(results, truth)]))
+
+
+def sweep_tree(corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int, leaf_counts: List[int], percents: List[int]) -> List[Dict[str, float]]:
+    """
+    Measure recall and cost of each tree setting with exact scoring.
+
+    Args:
+        corpus (np.ndarray): The indexed embeddings.
+        queries (np.ndarray): The query embeddings.
+        truth (np.ndarray): Their exact neighbours.
+        k (int): Number of neighbours.
+        leaf_counts (List[int]): `leafNodeEmbeddingCount` values.
+        percents (List[int]): `leafNodesToSearchPercent` values.
+
+    Returns:
+        List[Dict[str, float]]: One result per setting.
+    """
+    print(f"{'leaf size':>9} {'search %':>8} {'leaves':>7} {'recall@' + str(k):>9} {'scored':>8} {'cost':>6} {'ms/query':>9}")
+    results = []
+    for leaf_count in leaf_counts:
+        leaves = math.ceil(len(corpus) / leaf_count)
+        if leaves < 2:
+            continue
+        partitions = train_partitions(corpus, leaves)
+        for percent in percents:
+            leaves_to_search = max(1, math.ceil(leaves * percent / 100))
+            found, scored, ms = search(corpus, queries, partitions, leaves_to_search, k)
+            result = {
+                "leafNodeEmbeddingCount": leaf_count,
+                "leafNodesToSearchPercent": percent,
+                "recall": recall(found, truth),
+                "scored": scored,
+                "cost": scored / len(corpus),
+                "ms": ms
+            }
+            print(
+                f"{leaf_count:>9} {percent:>8} {leaves_to_search:>3}/{leaves:<3} {result['recall']:>9.3f} "
+                f"{scored:>8.0f} {result['cost']:>6.3f} {ms:>9.2f}"
+            )
+            results.append(result)
+    return results
+
+
+def sweep_reordering(corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int, setting: Dict[str, float]) -> List[Dict[str, float]]:
+    """
+    Measure recall of one tree setting with quantized scoring and exact reordering.
+
+    Args:
+        corpus (np.ndarray): The indexed embeddings.
+        queries (np.ndarray): The query embeddings.
+        truth (np.ndarray): Their exact neighbours.
+        k (int): Number of neighbours.
+        setting (Dict[str, float]): The tree setting, from `sweep_tree`.
+
+    Returns:
+        List[Dict[str, float]]: One result per `approximateNeighborsCount`.
+    """
+    leaves = math.ceil(len(corpus) / setting["leafNodeEmbeddingCount"])
+    partitions = train_partitions(corpus, leaves)
+    leaves_to_search = max(1, math.ceil(leaves * setting["leafNodesToSearchPercent"] / 100))
+    codebooks = train_quantizer(corpus)
+    quantizer = (codebooks, encode(corpus, codebooks))
+
+    print(f"{'approx. neighbors':>17} {'recall@' + str(k):>9} {'ms/query':>9}")
+    results = []
+    for factor in APPROXIMATE_NEIGHBORS_FACTORS:
+        found, _, ms = search(corpus, queries, partitions, leaves_to_search, k, quantizer, factor * k)
+        result = {"approximateNeighborsCount": factor * k, "recall": recall(found, truth), "ms": ms}
+        print(f"{factor * k:>17} {result['recall']:>9.3f} {ms:>9.2f}")
+        results.append(result)
+    return results
+
+
+def recommend(tree_results: List[Dict[str, float]], target_recall: float) -> Dict[str, float]:
+    """
+    Pick the cheapest tree setting reaching the target recall, or the most accurate one.
+
+    Args:
+        tree_results (List[Dict[str, float]]): The output of `sweep_tree`.
+        target_recall (float): The recall@k to reach.
+
+    Returns:
+        Dict[str, float]: The recommended setting.
+    """
+    reaching = [result for result in tree_results if result["recall"] >= target_recall]
+    if reaching:
+        return min(reaching, key=lambda result: result["scored"])
+    print(f"No setting reaches a recall of {target_recall}, recommending the most accurate")
+    return max(tree_results, key=lambda result: (result["recall"], -result["scored"]))
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", nargs="?", help="Sharded export directory or NDJSON embeddings file")
+    parser.add_argument("--synthetic", type=int, metavar="ROWS", help="Tune on generated embeddings instead")
+    parser.add_argument("--queries", type=int, default=500, help="Embeddings held out as queries")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours per query, as requested by the webhook")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="Recall@k the recommendation must reach")
+    parser.add_argument("--reorder-tolerance", type=float, default=0.01, help="Recall that quantized scoring may lose")
+    parser.add_argument("--leaf-counts", type=int, nargs="+", default=LEAF_NODE_EMBEDDING_COUNTS, help="leafNodeEmbeddingCount values")
+    parser.add_argument("--percents", type=int, nargs="+", default=LEAF_NODES_TO_SEARCH_PERCENTS, help="leafNodesToSearchPercent values")
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the approximateNeighborsCount sweep")
+    parser.add_argument("--output", default="index_config.json", help="Where to write the recommended config")
+    args = parser.parse_args()
+    if not args.source and not args.synthetic:
+        parser.error("give SOURCE or --synthetic")
+
+    # Hold out the queries, the webhook's queries are not in the index either
+    vectors = synthetic_embeddings(args.synthetic) if args.synthetic else read_embeddings(args.source)
+    rng = np.random.default_rng(0)
+    held_out = rng.permutation(len(vectors))
+    queries, corpus = vectors[held_out[:args.queries]], vectors[held_out[args.queries:]]
+    print(f"{len(corpus)} embeddings, {len(queries)} queries, {corpus.shape[1]} dimensions")
+
+    start = time.perf_counter()
+    truth = exact_neighbors(corpus, queries, args.k)
+    print(f"exact neighbours in {time.perf_counter() - start:.1f} s\n")
+
+    setting = recommend(sweep_tree(corpus, queries, truth, args.k, args.leaf_counts, args.percents), args.target_recall)
+    config = {
+        "dimensions": int(corpus.shape[1]),
+        "approximateNeighborsCount": args.k,
+        "algorithm_config": {
+            "treeAhConfig": {
+                "leafNodeEmbeddingCount": setting["leafNodeEmbeddingCount"],
+                "leafNodesToSearchPercent": setting["leafNodesToSearchPercent"]
+            }
+        }
+    }
+
+    if not args.no_quantize:
+        print()
+        reordering = sweep_reordering(corpus, queries, truth, args.k, setting)
+        enough = [result for result in reordering if result["recall"] >= setting["recall"] - args.reorder_tolerance]
+        config["approximateNeighborsCount"] = (enough[0] if enough else reordering[-1])["approximateNeighborsCount"]
+
+    with open(args.output, "w") as file:
+        json.dump(config, file, indent=2)
+    print(f"\nrecall@{args.k} {setting['recall']:.3f} at {setting['cost']:.3f} of a brute force search, config written to {args.output}:")
+    print(f"INDEX_CONFIG: '{json.dumps(config)}'")
+
+
+if __name__ == "__main__":
+    main_cli()
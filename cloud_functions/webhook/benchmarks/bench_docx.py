@@ -0,0 +1,127 @@
+"""
+Compare building documents with python-docx against rendering them from `DocxTemplate`.
+
+Usage:
+    python benchmarks/bench_docx.py [--repeat N] [--description-chars N]
+
+Both renderers produce the job document written by `save_job` entirely in memory. For each
+one the script reports the median and p95 render time and the peak memory allocated while
+rendering, measured with tracemalloc.
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules shared between the functions, vendored into them at deploy time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "shared"))
+
+from docx import Document
+
+import main
+
+
+def build_job_docx(job_details: Dict[str, str]) -> bytes:
+    """
+    Build the job document the way `save_job` did before templates, with python-docx.
+
+    Args:
+        job_details (Dict[str, str]): A dictionary containing job details.
+
+    Returns:
+        bytes: The content of the .docx file.
+    """
+    doc = Document()
+    section = doc.sections[0]
+    section.header.paragraphs[0].text = "Welcome to Intelia ML Specialization Demo"
+    section.footer.paragraphs[0].text = f"Generated at {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}."
+
+    doc.add_heading(job_details["title"], 0)
+    doc.add_heading('Job Details', level=4)
+    for label, key in (("Work Type: ", "formatted_work_type"), ("Location: ", "location"), ("Minimum Salary: ", "min_salary"),
+                       ("Maximum Salary: ", "max_salary"), ("Pay Period: ", "pay_period")):
+        if job_details[key]:
+            paragraph = doc.add_paragraph()
+            paragraph.add_run(label).bold = True
+            paragraph.add_run(str(job_details[key]))
+    doc.add_paragraph(f"{job_details['views']} Views {job_details['applies']} Applies")
+    doc.add_heading('Job Description', level=4)
+    doc.add_paragraph(job_details["description"])
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def measure(render: Callable[[], bytes], repeat: int) -> Dict[str, float]:
+    """
+    Time a renderer and measure its peak memory.
+
+    Args:
+        render (Callable[[], bytes]): The renderer to measure.
+        repeat (int): Number of timed runs.
+
+    Returns:
+        Dict[str, float]: Median and p95 time in ms, peak memory in KiB and document size in bytes.
+    """
+    # Warm up, so one-off costs such as building the template are not measured
+    size = len(render())
+
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render()
+        runs.append((time.perf_counter() - start) * 1000)
+    runs.sort()
+
+    tracemalloc.start()
+    render()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "median_ms": statistics.median(runs),
+        "p95_ms": runs[min(len(runs) - 1, int(len(runs) * 0.95))],
+        "peak_kib": peak / 1024,
+        "size": size,
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="Timed runs per renderer")
+    parser.add_argument("--description-chars", type=int, default=4000, help="Length of the job description")
+    args = parser.parse_args()
+
+    sentence = "Build and maintain machine learning pipelines on Google Cloud.\n"
+    job_details = {
+        "title": "Machine Learning Engineer",
+        "formatted_work_type": "Full-time",
+        "location": "Sydney, NSW",
+        "min_salary": 120000,
+        "max_salary": 160000,
+        "pay_period": "YEARLY",
+        "views": 42,
+        "applies": 7,
+        "description": (sentence * (args.description_chars // len(sentence) + 1))[:args.description_chars],
+    }
+
+    renderers = {
+        "python-docx": lambda: build_job_docx(job_details),
+        "template": lambda: main.render_job(job_details),
+    }
+
+    print(f"{'renderer':12} {'median ms':>10} {'p95 ms':>10} {'peak KiB':>10} {'bytes':>8}")
+    for name, render in renderers.items():
+        result = measure(render, args.repeat)
+        print(f"{name:12} {result['median_ms']:>10.2f} {result['p95_ms']:>10.2f} {result['peak_kib']:>10.1f} {result['size']:>8}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,117 @@
+"""
+Compare the spaCy and regex sentence engines used by `get_sentences` on real resumes.
+
+Usage:
+    python benchmarks/bench_sentences.py RESUME [RESUME ...] [--repeat N]
+
+Resumes can be .pdf, .docx or plain text files. For every engine the script reports the
+one-off pipeline load time, the per-document latency and the number of sentences found, plus
+how many of the spaCy sentence boundaries the regex engine reproduces.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules shared between the functions, vendored into them at deploy time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "shared"))
+
+import main
+
+
+def get_txt_pdf(path: str) -> Optional[str]:
+    """
+    Extract text content from a PDF file.
+
+    Args:
+        path (str): The file path of the PDF document.
+
+    Returns:
+        Optional[str]: The extracted text content, or None if an error occurs.
+    """
+    with open(path, "rb") as file:
+        return main.get_txt_pdf_bytes(file.read())
+
+
+def load_text(path: str) -> str:
+    """
+    Extract the text of a resume file.
+
+    Args:
+        path (str): The path of a .pdf, .docx or text file.
+
+    Returns:
+        str: The extracted text.
+    """
+    if path.endswith(".pdf"):
+        return get_txt_pdf(path) or ""
+    if path.endswith(".docx"):
+        return main.get_txt_docx(path) or ""
+    with open(path, "r", encoding="utf8", errors="ignore") as file:
+        return file.read()
+
+
+def time_engine(engine: str, texts: List[str], repeat: int) -> Dict[str, object]:
+    """
+    Time one sentence engine over all texts.
+
+    Args:
+        engine (str): The sentence engine, "spacy" or "regex".
+        texts (List[str]): The resume texts.
+        repeat (int): Number of timed runs per text.
+
+    Returns:
+        Dict[str, object]: Load time, per-document latencies and sentence outputs.
+    """
+    start = time.perf_counter()
+    if engine == "spacy":
+        main.get_nlp()
+    load_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    outputs = []
+    for text in texts:
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = main.get_sentences(text, engine=engine)
+            runs.append((time.perf_counter() - start) * 1000)
+        latencies.append(statistics.median(runs))
+        outputs.append(output or "")
+
+    return {"load_ms": load_ms, "latencies": latencies, "outputs": outputs}
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("resumes", nargs="+", help="Resume files (.pdf, .docx or text)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per resume")
+    args = parser.parse_args()
+
+    texts = [load_text(path) for path in args.resumes]
+    results = {engine: time_engine(engine, texts, args.repeat) for engine in ("spacy", "regex")}
+
+    print(f"{'resume':40} {'chars':>8} {'spacy ms':>10} {'regex ms':>10} {'spacy sents':>12} {'regex sents':>12} {'agree':>7}")
+    for i, path in enumerate(args.resumes):
+        spacy_sents = results["spacy"]["outputs"][i].split("\n")
+        regex_sents = results["regex"]["outputs"][i].split("\n")
+        agreement = len(set(spacy_sents) & set(regex_sents)) / max(len(spacy_sents), 1)
+        print(
+            f"{os.path.basename(path)[:40]:40} {len(texts[i]):>8} "
+            f"{results['spacy']['latencies'][i]:>10.2f} {results['regex']['latencies'][i]:>10.2f} "
+            f"{len(spacy_sents):>12} {len(regex_sents):>12} {agreement:>7.0%}"
+        )
+
+    for engine, result in results.items():
+        print(
+            f"{engine}: load {result['load_ms']:.1f} ms, "
+            f"median {statistics.median(result['latencies']):.2f} ms/resume, "
+            f"max {max(result['latencies']):.2f} ms/resume"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,258 @@
+"""
+Micro-benchmarks of the webhook's pure-Python hot functions, with stored baselines.
+
+Usage:
+    python benchmarks/bench_suite.py [--filter TEXT] [--min-time SECONDS]
+    python benchmarks/bench_suite.py --save-baseline
+    python benchmarks/bench_suite.py --check [--tolerance 0.25]
+
+Cases run on generated fixtures: short, long and pathological resumes (no sentence breaks,
+one unbroken token, dense bullets and non-ASCII text) and 768-d chunk vectors. For every case
+the script reports throughput, p50/p95/p99 latency and the peak memory and number of memory
+blocks allocated by one call, measured with tracemalloc.
+
+`--save-baseline` writes the results to benchmarks/baseline.json (kept out of git, baselines
+are machine-specific). `--check` compares the p50 latency and peak memory of every case with
+the baseline and exits with status 1 if any of them is more than `--tolerance` worse.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules shared between the functions, vendored into them at deploy time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "shared"))
+
+# Keep sampled traces out of the output, spans are still timed as in production
+os.environ.setdefault("TRACE_SAMPLE_RATE", "0")
+
+import main
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+EMBEDDING_DIMENSIONS = 768
+
+# Absolute increases below these are measurement noise and never count as regressions
+NOISE_FLOOR = {"p50_ms": 0.05, "peak_kib": 16.0}
+
+WORDS = (
+    "python sql bigquery vertex pipelines machine learning engineer data models deployed "
+    "production cloud functions dialogflow stakeholders delivered analytics dashboards team "
+    "led migrated kubernetes terraform experiments feature store monitoring latency"
+).split()
+
+
+def make_resume(kind: str, seed: int = 0) -> str:
+    """
+    Generate a resume-like text fixture.
+
+    Args:
+        kind (str): "short" (about 2k characters), "long" (about 60k characters) or
+            "pathological" (about 60k characters without sentence breaks, one unbroken token,
+            dense bullets and non-ASCII text).
+        seed (int): The random seed, so that fixtures are identical across runs.
+
+    Returns:
+        str: The resume text.
+    """
+    rng = random.Random(seed)
+
+    def sentence() -> str:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 20))]
+        return words[0].capitalize() + " " + " ".join(words[1:]) + "."
+
+    if kind == "short":
+        return "\n".join(sentence() for _ in range(25))
+    if kind == "long":
+        sections = []
+        for _ in range(60):
+            sections.append("EXPERIENCE\n" + "\n".join("• " + sentence() for _ in range(8)))
+        return "\n\n".join(sections)
+    if kind == "pathological":
+        unbroken = "x" * 20000
+        bullets = " ".join("•  ñandú  café  " + rng.choice(WORDS) for _ in range(2000))
+        run_on = " ".join(rng.choice(WORDS) for _ in range(3000))
+        return "\n".join([bullets, unbroken, run_on, "\t\r\n" * 500])
+    raise ValueError(f"Unknown resume kind: {kind}")
+
+
+def make_job(description: str) -> Dict[str, object]:
+    """
+    Build the job details fixture used by `render_job`.
+
+    Args:
+        description (str): The job description.
+
+    Returns:
+        Dict[str, object]: The job details.
+    """
+    return {
+        "job_id": "3884428798",
+        "title": "Machine Learning Engineer",
+        "formatted_work_type": "Full-time",
+        "location": "Sydney, NSW",
+        "min_salary": 120000,
+        "max_salary": 160000,
+        "pay_period": "YEARLY",
+        "views": 42,
+        "applies": 7,
+        "match_distance": 0.83,
+        "description": description,
+    }
+
+
+def build_cases() -> Dict[str, Callable[[], object]]:
+    """
+    Build the benchmark cases.
+
+    Returns:
+        Dict[str, Callable[[], object]]: A dictionary mapping case names to zero-argument callables.
+    """
+    resumes = {kind: make_resume(kind) for kind in ("short", "long", "pathological")}
+    rng = np.random.default_rng(0)
+    vectors = {
+        count: (rng.standard_normal((count, EMBEDDING_DIMENSIONS)).tolist(), rng.integers(100, 10000, count).tolist())
+        for count in (4, 64)
+    }
+    documents = {kind: main.render_cl(text) for kind, text in resumes.items()}
+    job = make_job(resumes["long"][:5000])
+    job_details = [dict(make_job(""), job_id=str(i), match_distance=0.9 - i / 100) for i in range(10)]
+
+    cases = {}
+    for kind, text in resumes.items():
+        cases[f"split_input[{kind}]"] = lambda text=text: main.split_input(text, 10000)
+        cases[f"iter_chunks[sentence,{kind}]"] = lambda text=text: list(main.iter_chunks(text, 10000, "sentence", 200))
+        cases[f"get_sentences[regex,{kind}]"] = lambda text=text: main.get_sentences(text, engine="regex")
+        cases[f"get_sentences[spacy,{kind}]"] = lambda text=text: main.get_sentences(text, engine="spacy")
+        cases[f"get_txt_docx[{kind}]"] = lambda data=documents[kind]: main.get_txt_docx(io.BytesIO(data))
+    for count, (embeddings, lengths) in vectors.items():
+        cases[f"get_weighted_embeddings[{count}x{EMBEDDING_DIMENSIONS}]"] = (
+            lambda embeddings=embeddings, lengths=lengths: main.get_weighted_embeddings(embeddings, lengths)
+        )
+    cases["render_job"] = lambda: main.render_job(job)
+    cases["build_match_response"] = lambda: json.dumps(
+        {"fulfillment_response": {"messages": [{"payload": {"richContent": [main.get_match_options(job_details)]}}]}}
+    )
+    return cases
+
+
+def measure(func: Callable[[], object], min_time: float, min_runs: int = 5) -> Dict[str, float]:
+    """
+    Measure one case.
+
+    Args:
+        func (Callable[[], object]): The case to measure.
+        min_time (float): Minimum total time of the timed runs, in seconds.
+        min_runs (int): Minimum number of timed runs.
+
+    Returns:
+        Dict[str, float]: Throughput, p50/p95/p99 latency, peak memory and allocated blocks.
+    """
+    # Warm up caches and lazily built resources
+    func()
+
+    runs: List[float] = []
+    deadline = time.perf_counter() + min_time
+    while len(runs) < min_runs or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - start) * 1000)
+    runs.sort()
+
+    def percentile(q: float) -> float:
+        return runs[min(len(runs) - 1, int(len(runs) * q / 100))]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    func()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    return {
+        "runs": len(runs),
+        "ops_per_s": round(1000 * len(runs) / sum(runs), 1),
+        "p50_ms": round(percentile(50), 3),
+        "p95_ms": round(percentile(95), 3),
+        "p99_ms": round(percentile(99), 3),
+        "peak_kib": round(peak / 1024, 1),
+        "blocks": blocks,
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[Tuple[str, str, float, float]]:
+    """
+    Find the cases that regressed against the baseline.
+
+    Args:
+        results (Dict[str, Dict[str, float]]): The current results.
+        baseline (Dict[str, Dict[str, float]]): The stored baseline.
+        tolerance (float): Allowed relative increase, e.g. 0.25 for 25%.
+
+    Returns:
+        List[Tuple[str, str, float, float]]: (case, metric, baseline value, current value) for every regression.
+    """
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        for metric, floor in NOISE_FLOOR.items():
+            increase = result[metric] - baseline[case][metric]
+            if increase > floor and result[metric] > baseline[case][metric] * (1 + tolerance):
+                regressions.append((case, metric, baseline[case][metric], result[metric]))
+    return regressions
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="Only run cases whose name contains this text")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Minimum timed seconds per case")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Write the results to {BASELINE_PATH}")
+    parser.add_argument("--check", action="store_true", help="Fail if a case regressed against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    cases = {name: func for name, func in build_cases().items() if args.filter in name}
+
+    results = {}
+    print(f"{'case':44} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KiB':>9} {'blocks':>8}")
+    for name, func in cases.items():
+        result = results[name] = measure(func, args.min_time)
+        print(
+            f"{name:44} {result['ops_per_s']:>10} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+            f"{result['p99_ms']:>9.3f} {result['peak_kib']:>9.1f} {result['blocks']:>8}"
+        )
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, "r") as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(BASELINE_PATH, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Baseline written to {BASELINE_PATH}")
+
+    if args.check:
+        if not os.path.exists(BASELINE_PATH):
+            sys.exit(f"No baseline at {BASELINE_PATH}, run with --save-baseline first")
+        with open(BASELINE_PATH, "r") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for case, metric, before, after in regressions:
+            print(f"REGRESSION {case} {metric}: {before} -> {after}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,52 @@
+"""
+Calibrate the local token estimator against the Vertex AI countTokens endpoint.
+
+Usage:
+    python benchmarks/calibrate_token_count.py RESUME [RESUME ...]
+
+Resumes can be .pdf, .docx or plain text files. Every text is extracted like the webhook does
+and, like `count_tokens` in the webhook, counted as extracted: locally with
+`estimate_token_count` and remotely with `get_token_count`. The script reports the relative error of the estimate and the smallest
+TOKEN_ESTIMATE_MARGIN that would have sent every mis-estimated text to the remote count.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules shared between the functions, vendored into them at deploy time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "shared"))
+
+import main
+from bench_sentences import load_text
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("resumes", nargs="+", help="Resume files (.pdf, .docx or text)")
+    args = parser.parse_args()
+
+    errors = []
+    print(f"{'resume':40} {'estimate':>9} {'remote':>9} {'error':>8}")
+    for path in args.resumes:
+        content = load_text(path)
+        estimate = main.estimate_token_count(content)
+        remote = main.get_token_count(content, main.EMBEDDING_MODEL)
+        if not remote:
+            print(f"{os.path.basename(path)[:40]:40} {estimate:>9} {'n/a':>9}")
+            continue
+        error = (estimate - remote) / remote
+        errors.append(error)
+        print(f"{os.path.basename(path)[:40]:40} {estimate:>9} {remote:>9} {error:>+8.1%}")
+
+    if errors:
+        under = [-error for error in errors if error < 0]
+        print(f"mean error {sum(errors) / len(errors):+.1%}, min {min(errors):+.1%}, max {max(errors):+.1%}")
+        # An estimate is trusted only when it is further than the margin from the limit,
+        # so the margin has to cover the worst relative error seen
+        print(f"worst underestimate {max(under, default=0.0):.1%}")
+        print(f"suggested TOKEN_ESTIMATE_MARGIN >= {max(abs(error) for error in errors):.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,28 +1,1003 @@
 import functions_framework
 import os
+import io
 import re
 import uuid
 import json
 import operator
-import textract
+import time
+import threading
+import math
+import sqlite3
+import hashlib
+import bisect
+import random
+import functools
+from abc import ABC, abstractmethod
+import contextlib
+import contextvars
+import zipfile
+import fcntl
+from decimal import Decimal
+from xml.sax.saxutils import escape as xml_escape
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import en_core_web_sm
 import requests
 from flask import Request, jsonify
-from datetime import datetime
+from datetime import date, datetime
 from google.cloud import bigquery
+from google.cloud import storage
 from googleapiclient.discovery import build
 import google.auth
 from google.oauth2.credentials import Credentials
 import google.auth.transport.requests
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaIoBaseUpload
 from google.cloud import aiplatform
+from google.api_core.exceptions import NotFound
 import vertexai
 from vertexai.preview.language_models import TextEmbeddingModel
 from vertexai.preview.language_models import TextGenerationModel
 from docx import Document
-from typing import List, Union, Dict, Optional, Tuple
+from pypdf import PdfReader
+from typing import List, Union, Dict, Optional, Tuple, Callable, Any, Iterable, Iterator
+# Vendored from cloud_functions/shared by cloudbuild.yaml
+from chunking import CHUNK_BOUNDARIES, COMPAT_BOUNDARIES, chunk_length, find_chunk_end, iter_chunks
+from token_provider import TokenProvider
+
+class ResourceRegistry:
+    """
+    Lazily build heavy clients and models once per instance and reuse them across requests.
+
+    Each resource is built on first use by its factory, under a per-resource lock so that
+    concurrent requests never build the same client twice. The time taken by every
+    initialisation is recorded and can be read back with `timings()`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._resource_locks: Dict[str, threading.Lock] = {}
+        self._resources: Dict[str, Any] = {}
+        self._timings: Dict[str, float] = {}
+
+    def get(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Return the resource registered under `name`, building it with `factory` on first use.
+
+        Args:
+            name (str): The registry key of the resource.
+            factory (Callable[[], Any]): Zero-argument callable that builds the resource.
+
+        Returns:
+            Any: The cached resource.
+        """
+        # Fast path, no locking once the resource exists
+        resource = self._resources.get(name)
+        if resource is not None:
+            return resource
+
+        with self._lock:
+            resource_lock = self._resource_locks.setdefault(name, threading.Lock())
+
+        with resource_lock:
+            # Another request may have built it while we were waiting
+            resource = self._resources.get(name)
+            if resource is not None:
+                return resource
+
+            start = time.perf_counter()
+            resource = factory()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._timings[name] = elapsed_ms
+            self._resources[name] = resource
+            print(f"Initialised {name} in {elapsed_ms:.1f} ms")
+
+        return resource
+
+    def timings(self) -> Dict[str, float]:
+        """
+        Get the initialisation time of every resource built so far.
+
+        Returns:
+            Dict[str, float]: A dictionary mapping resource names to initialisation time in milliseconds.
+        """
+        return dict(self._timings)
+
+    def reset(self, name: Optional[str] = None) -> None:
+        """
+        Drop one cached resource, or all of them, so that the next `get` rebuilds it.
+
+        Args:
+            name (Optional[str]): The resource to drop, or None to drop every resource.
+        """
+        with self._lock:
+            if name is None:
+                self._resources.clear()
+                self._timings.clear()
+            else:
+                self._resources.pop(name, None)
+                self._timings.pop(name, None)
+
+# Process-wide registry shared by all requests served by this instance
+registry = ResourceRegistry()
+
+# MIME type of the Word documents uploaded to Google Drive
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Name of the text embedding model used for resumes and job postings
+EMBEDDING_MODEL = "textembedding-gecko"
+
+# Maximum number of input tokens the embedding model accepts per text
+EMBEDDING_TOKEN_LIMIT = 3072
+
+# Upper bounds, in milliseconds, of the latency histogram buckets; a last bucket holds the rest
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram with count, error count, mean, maximum and approximate percentiles.
+    """
+
+    def __init__(self, bounds: List[float] = LATENCY_BUCKETS_MS) -> None:
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float, error: bool = False) -> None:
+        """
+        Record one observation.
+
+        Args:
+            elapsed_ms (float): The observed latency in milliseconds.
+            error (bool): Whether the observed operation failed.
+        """
+        self.counts[bisect.bisect_left(self.bounds, elapsed_ms)] += 1
+        self.count += 1
+        self.errors += int(error)
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate a percentile as the upper bound of the bucket holding it.
+
+        Args:
+            q (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The estimated latency in milliseconds, capped at the maximum observed.
+        """
+        rank = math.ceil(self.count * q / 100)
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Summarise the histogram for logging.
+
+        Returns:
+            Dict[str, Any]: Count, errors, mean, p50, p95, p99, maximum and the non-empty buckets.
+        """
+        labels = [f"le_{bound}" for bound in self.bounds] + ["inf"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 1),
+            "p95_ms": round(self.percentile(95), 1),
+            "p99_ms": round(self.percentile(99), 1),
+            "max_ms": round(self.max_ms, 1),
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count}
+        }
+
+class Span:
+    """
+    One timed operation of a trace. A span without a parent is the root of its trace and
+    collects every span finished under it.
+    """
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.parent = parent
+        self.root = parent.root if parent else self
+        self.id = uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start = time.perf_counter()
+        self.elapsed_ms = 0.0
+        if parent is None:
+            self.finished: List["Span"] = []
+            self.sampled = False
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Attach an attribute to the span.
+
+        Args:
+            key (str): The attribute name.
+            value (Any): The attribute value, which must be JSON-serialisable.
+        """
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Describe the span relative to the start of its trace.
+
+        Returns:
+            Dict[str, Any]: The span name, IDs, start offset, duration, attributes and error.
+        """
+        return {
+            "name": self.name,
+            "span_id": self.id,
+            "parent_id": self.parent.id if self.parent else None,
+            "start_ms": round((self.start - self.root.start) * 1000, 1),
+            "duration_ms": round(self.elapsed_ms, 1),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+class Tracer:
+    """
+    Lightweight in-process tracer that times nested spans and keeps a latency histogram per span name.
+
+    The current span is held in a context variable, so nested spans find their parent without
+    it being passed around; functions handed to other threads keep their parent through `wrap`.
+    When a root span ends, its whole trace is printed as one JSON line for a `sample_rate`
+    fraction of traces, and always for traces that fail or take longer than `slow_ms`. The
+    histograms are printed as one JSON line at most every `histogram_interval` seconds.
+    """
+
+    def __init__(self, sample_rate: float = 0.1, slow_ms: Optional[float] = None, histogram_interval: float = 60) -> None:
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.histogram_interval = histogram_interval
+        self._current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._last_export = time.time()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """
+        Time a block of code as a span of the current trace, starting a new trace if there is none.
+
+        Args:
+            name (str): The span name, which is also the name of its latency histogram.
+            **attributes: Initial attributes of the span.
+
+        Yields:
+            Span: The span, to which the block can attach attributes.
+        """
+        span = Span(name, self._current.get(), attributes)
+        if span.parent is None:
+            span.sampled = random.random() < self.sample_rate
+        token = self._current.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._current.reset(token)
+            span.elapsed_ms = (time.perf_counter() - span.start) * 1000
+            self._finish(span)
+
+    def record(self, name: str, start: float, **attributes: Any) -> None:
+        """
+        Record an operation timed by hand as a finished span of the current trace.
+
+        Args:
+            name (str): The span name.
+            start (float): The `time.perf_counter()` value at which the operation started.
+            **attributes: Attributes of the span.
+        """
+        span = Span(name, self._current.get(), attributes)
+        span.start = start
+        span.elapsed_ms = (time.perf_counter() - start) * 1000
+        self._finish(span)
+
+    def annotate(self, **attributes: Any) -> None:
+        """
+        Attach attributes to the current span, if any.
+
+        Args:
+            **attributes: The attributes to attach.
+        """
+        span = self._current.get()
+        if span is not None:
+            span.attributes.update(attributes)
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Bind a function to the current span so that spans it opens in another thread join this trace.
+
+        Args:
+            func (Callable[..., Any]): The function to run in another thread.
+
+        Returns:
+            Callable[..., Any]: The bound function.
+        """
+        parent = self._current.get()
+
+        def bound(*args: Any, **kwargs: Any) -> Any:
+            token = self._current.set(parent)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._current.reset(token)
+
+        return bound
+
+    def histograms(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get a summary of every latency histogram recorded so far.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: A dictionary mapping span names to histogram summaries.
+        """
+        with self._lock:
+            return {name: histogram.snapshot() for name, histogram in sorted(self._histograms.items())}
+
+    def _finish(self, span: Span) -> None:
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = LatencyHistogram()
+            histogram.record(span.elapsed_ms, error=span.error is not None)
+            span.root.finished.append(span)
+            export_histograms = span.parent is None and time.time() - self._last_export >= self.histogram_interval
+            if export_histograms:
+                self._last_export = time.time()
+
+        if span.parent is None:
+            slow = self.slow_ms is not None and span.elapsed_ms >= self.slow_ms
+            if span.sampled or slow or any(finished.error for finished in span.finished):
+                print(json.dumps({
+                    "trace_id": span.id,
+                    "trace": span.name,
+                    "total_ms": round(span.elapsed_ms, 1),
+                    "spans": [finished.to_dict() for finished in span.finished]
+                }, default=str))
+            if export_histograms:
+                print(json.dumps({"latency_histograms": self.histograms()}))
+
+def get_tracer() -> Tracer:
+    """
+    Get the process-wide tracer, configured by TRACE_SAMPLE_RATE, TRACE_SLOW_MS and TRACE_HISTOGRAM_INTERVAL.
+
+    Returns:
+        Tracer: The tracer.
+    """
+    def build() -> Tracer:
+        slow_ms = os.environ.get("TRACE_SLOW_MS")
+        return Tracer(
+            sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", "0.1")),
+            slow_ms=float(slow_ms) if slow_ms else None,
+            histogram_interval=float(os.environ.get("TRACE_HISTOGRAM_INTERVAL", "60"))
+        )
+
+    return registry.get("tracer", build)
+
+def traced(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Decorate a function so that every call is timed as a span.
+
+    Args:
+        name (str): The span name.
+
+    Returns:
+        Callable[[Callable[..., Any]], Callable[..., Any]]: The decorator.
+    """
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with get_tracer().span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def trace_webhook(func: Callable[[Request], Any]) -> Callable[[Request], Any]:
+    """
+    Decorate the webhook so that every request is a trace named after its fulfillment tag.
+
+    Args:
+        func (Callable[[Request], Any]): The webhook function.
+
+    Returns:
+        Callable[[Request], Any]: The traced webhook function.
+    """
+    @functools.wraps(func)
+    def wrapper(request: Request) -> Any:
+        request_json = request.get_json(silent=True) or {}
+        tag = request_json.get("fulfillmentInfo", {}).get("tag", "untagged")
+        with get_tracer().span(f"webhook.{tag}") as span:
+            response = func(request)
+            span.set("status", getattr(response, "status_code", None))
+            return response
+    return wrapper
+
+class StagePipeline:
+    """
+    Run the stages of one request, one after another or concurrently, and time each of them.
+
+    Concurrent stages run on a process-wide thread pool of PIPELINE_MAX_WORKERS threads. The
+    per-stage breakdown is written to the logs as one JSON line by `log()`.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.timings: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def run(self, stage: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run one stage and record its wall time.
+
+        Args:
+            stage (str): The name of the stage.
+            func (Callable[..., Any]): The function implementing the stage.
+            *args: Positional arguments passed to `func`.
+            **kwargs: Keyword arguments passed to `func`.
+
+        Returns:
+            Any: The result of `func`.
+        """
+        start = time.perf_counter()
+        try:
+            with get_tracer().span(f"{self.name}.{stage}"):
+                return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.timings[stage] = (time.perf_counter() - start) * 1000
+
+    def run_concurrently(self, stages: Dict[str, Tuple[Callable[..., Any], Tuple[Any, ...]]]) -> Dict[str, Any]:
+        """
+        Run independent stages at the same time and wait for all of them.
+
+        Args:
+            stages (Dict[str, Tuple[Callable[..., Any], Tuple[Any, ...]]]): A dictionary mapping stage
+                names to (function, positional arguments) pairs.
+
+        Returns:
+            Dict[str, Any]: A dictionary mapping stage names to their results.
+        """
+        executor = get_stage_executor()
+        futures = {
+            stage: executor.submit(get_tracer().wrap(self.run), stage, func, *args)
+            for stage, (func, args) in stages.items()
+        }
+        return {stage: future.result() for stage, future in futures.items()}
+
+    def log(self) -> None:
+        """
+        Print the per-stage timing breakdown as a structured log line.
+        """
+        print(json.dumps({
+            "pipeline": self.name,
+            "total_ms": round((time.perf_counter() - self._start) * 1000, 1),
+            "stages_ms": {stage: round(elapsed, 1) for stage, elapsed in self.timings.items()}
+        }))
+
+def get_stage_executor() -> ThreadPoolExecutor:
+    """
+    Get the process-wide thread pool used to run pipeline stages concurrently.
+
+    Returns:
+        ThreadPoolExecutor: The stage thread pool.
+    """
+    return registry.get(
+        "stage_executor",
+        lambda: ThreadPoolExecutor(max_workers=int(os.environ.get("PIPELINE_MAX_WORKERS", "8")), thread_name_prefix="stage")
+    )
+
+def to_json_safe(value: Any) -> Any:
+    """
+    Convert a value to types that JSON can represent, such as the dates and numerics of BigQuery rows.
+
+    Args:
+        value (Any): The value, possibly nested in dictionaries, lists and tuples.
+
+    Returns:
+        Any: The value with dates as ISO 8601 strings, decimals and numpy scalars as numbers and
+            tuples and numpy arrays as lists.
+    """
+    if isinstance(value, dict):
+        return {str(key): to_json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_safe(item) for item in value]
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return value
+
+class SessionArtifactStore(ABC):
+    """
+    Session-scoped store for intermediate results, such as extracted resume text, the resume
+    vector, the match list and exported job text, so that later turns of the same session do not
+    fetch them again from Drive or BigQuery.
+
+    Artifacts are grouped by session ID and a whole session expires `ttl` seconds after it was
+    last written. Artifacts are stored as converted by `to_json_safe`, so every backend returns
+    the same types. Subclasses must implement the abstract `_load`, `_save` and `_delete`, and
+    override `_session_lock` when several processes share the backend.
+    """
+
+    def __init__(self, ttl: float = 3600) -> None:
+        self.ttl = ttl
+        # Re-entrant because an expired session is deleted while the lock is held
+        self._lock = threading.RLock()
+
+    def get(self, session_id: str, name: str) -> Optional[Any]:
+        """
+        Get one artifact of a session.
+
+        Args:
+            session_id (str): The session ID.
+            name (str): The artifact name.
+
+        Returns:
+            Optional[Any]: The artifact, or None if it is missing or the session has expired.
+        """
+        with self._lock, self._session_lock():
+            session = self._load(session_id)
+            if session is None:
+                return None
+            if time.time() - session["updated"] > self.ttl:
+                self._delete(session_id)
+                return None
+            return session["artifacts"].get(name)
+
+    def put(self, session_id: str, name: str, value: Any) -> Any:
+        """
+        Store one artifact of a session and extend the session's lifetime.
+
+        Args:
+            session_id (str): The session ID.
+            name (str): The artifact name.
+            value (Any): The artifact.
+
+        Returns:
+            Any: The artifact as stored, converted by `to_json_safe`.
+        """
+        value = to_json_safe(value)
+        with self._lock, self._session_lock():
+            session = self._load(session_id)
+            if session is None or time.time() - session["updated"] > self.ttl:
+                session = {"artifacts": {}}
+            session["artifacts"][name] = value
+            session["updated"] = time.time()
+            self._save(session_id, session)
+        return value
+
+    def get_or_create(self, session_id: str, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Get one artifact of a session, computing and storing it with `factory` when missing.
+
+        Empty results (None, empty strings or collections) are returned but not stored. Stored
+        results are returned as stored, so a later call returns the same types.
+
+        Args:
+            session_id (str): The session ID.
+            name (str): The artifact name.
+            factory (Callable[[], Any]): Zero-argument callable that computes the artifact.
+
+        Returns:
+            Any: The artifact.
+        """
+        value = self.get(session_id, name)
+        if value is None:
+            value = factory()
+            if value:
+                value = self.put(session_id, name, value)
+        return value
+
+    def delete_session(self, session_id: str) -> None:
+        """
+        Drop every artifact of a session.
+
+        Args:
+            session_id (str): The session ID.
+        """
+        with self._lock, self._session_lock():
+            self._delete(session_id)
+
+    def _session_lock(self) -> contextlib.AbstractContextManager:
+        # Held around every read-modify-write, on top of the lock of this process
+        return contextlib.nullcontext()
+
+    @abstractmethod
+    def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Read a session, or None if it does not exist.
+        """
+
+    @abstractmethod
+    def _save(self, session_id: str, session: Dict[str, Any]) -> None:
+        """
+        Write a session, replacing any previous version.
+        """
+
+    @abstractmethod
+    def _delete(self, session_id: str) -> None:
+        """
+        Remove a session if it exists.
+        """
+
+class MemoryArtifactStore(SessionArtifactStore):
+    """
+    Session artifact store held in the memory of the instance.
+    """
+
+    def __init__(self, ttl: float = 3600) -> None:
+        super().__init__(ttl)
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+
+    def _delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._sessions.get(session_id)
+
+    def _save(self, session_id: str, session: Dict[str, Any]) -> None:
+        self._sessions[session_id] = session
+        # Sweep expired sessions so abandoned conversations do not accumulate
+        now = time.time()
+        for expired_id in [key for key, value in self._sessions.items() if now - value["updated"] > self.ttl]:
+            del self._sessions[expired_id]
+
+class LocalArtifactStore(SessionArtifactStore):
+    """
+    Session artifact store persisted as one JSON file per session in a local directory.
+
+    It stands in for a shared key-value service such as Redis: every process pointed at the
+    same directory sees the same sessions. Read-modify-writes hold an exclusive `flock` on a
+    lock file in the directory, and session files are replaced atomically by renaming a
+    temporary file, so concurrent processes neither lose updates nor read partial files.
+    """
+
+    def __init__(self, directory: str, ttl: float = 3600) -> None:
+        super().__init__(ttl)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _session_lock(self) -> Iterator[None]:
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _delete(self, session_id: str) -> None:
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(session_id.encode("utf8")).hexdigest() + ".json")
+
+    def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(session_id), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save(self, session_id: str, session: Dict[str, Any]) -> None:
+        path = self._path(session_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(session, file)
+        os.replace(tmp_path, path)
+
+def get_artifact_store() -> SessionArtifactStore:
+    """
+    Get the session artifact store selected by the ARTIFACT_STORE environment variable.
+
+    "memory" (the default) keeps artifacts in the instance. "local" persists them as JSON files
+    in ARTIFACT_STORE_DIR. Sessions expire ARTIFACT_TTL seconds after their last write.
+
+    Returns:
+        SessionArtifactStore: The session artifact store.
+    """
+    def build_store() -> SessionArtifactStore:
+        ttl = float(os.environ.get("ARTIFACT_TTL", "3600"))
+        if os.environ.get("ARTIFACT_STORE", "memory") == "local":
+            return LocalArtifactStore(os.environ.get("ARTIFACT_STORE_DIR", "/tmp/session-artifacts"), ttl)
+        return MemoryArtifactStore(ttl)
+
+    return registry.get("artifact_store", build_store)
+
+def get_embedding_model() -> TextEmbeddingModel:
+    """
+    Get the cached text embedding model.
+
+    Returns:
+        TextEmbeddingModel: The "textembedding-gecko" model handle.
+    """
+    return registry.get("embedding_model", lambda: TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL))
+
+def get_index_endpoint() -> aiplatform.MatchingEngineIndexEndpoint:
+    """
+    Get the cached Matching Engine index endpoint, initialising AI Platform on first use.
+
+    Returns:
+        aiplatform.MatchingEngineIndexEndpoint: The index endpoint used for job matching.
+    """
+    def build_endpoint() -> aiplatform.MatchingEngineIndexEndpoint:
+        aiplatform.init(project="ml-spez-ccai", location="us-central1")
+        return aiplatform.MatchingEngineIndexEndpoint(index_endpoint_name='8350381794633187328')
+
+    return registry.get("index_endpoint", build_endpoint)
+
+def get_bigquery_client() -> bigquery.Client:
+    """
+    Get the cached BigQuery client.
+
+    Returns:
+        bigquery.Client: The BigQuery client.
+    """
+    return registry.get("bigquery_client", bigquery.Client)
+
+def get_drive_service() -> Any:
+    """
+    Get a cached Google Drive API service for the calling thread.
+
+    The underlying httplib2 transport is not thread-safe, so one service is kept per
+    worker thread while the credentials are shared by all of them.
+
+    Returns:
+        Any: The Google Drive v3 API service.
+    """
+    credentials = get_credentials()
+    return registry.get(
+        f"drive_service_{threading.get_ident()}",
+        lambda: build('drive', 'v3', credentials=credentials, cache_discovery=False)
+    )
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache that evicts the least recently used entry beyond `capacity` entries.
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up an entry and mark it as recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Optional[Any]: The cached value, or None on a miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Store an entry, evicting the least recently used ones if the cache is full.
+
+        Args:
+            key (str): The cache key.
+            value (Any): The value to store.
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the cache counters.
+
+        Returns:
+            Dict[str, int]: Hits, misses and the number of entries held.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of text embeddings with an in-memory LRU tier and an optional persistent tier.
+
+    Entries are keyed by a SHA-256 hash of the model name and the whitespace-normalised text, so the
+    same content embedded again, from any session, is served without a Vertex AI round trip. The
+    persistent tier is either a Cloud Storage prefix ("gs://bucket/prefix"), shared by every
+    instance, or a local directory. A local directory is bounded to `max_store_bytes`, evicting the
+    least recently used entries, since `/tmp` on Cloud Functions is held in instance memory.
+    """
+
+    def __init__(self, capacity: int = 1024, store_uri: Optional[str] = None, max_store_bytes: int = 64 * 2 ** 20) -> None:
+        self._lock = threading.Lock()
+        self._memory = LRUCache(capacity)
+        self.store_uri = store_uri
+        self.max_store_bytes = max_store_bytes
+        # Size of the local tier, scanned on the first write
+        self._store_bytes: Optional[int] = None
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """
+        Build the cache key for a text embedded by a given model.
+
+        Args:
+            model (str): The name of the embedding model.
+            text (str): The embedded text.
+
+        Returns:
+            str: The hexadecimal SHA-256 digest of the model name and normalised text.
+        """
+        normalised_text = " ".join(text.split())
+        return hashlib.sha256(f"{model}\n{normalised_text}".encode("utf8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """
+        Look up an embedding, first in memory and then in the persistent tier.
+
+        Args:
+            key (str): The cache key built by `make_key`.
+
+        Returns:
+            Optional[List[float]]: The cached embedding, or None on a miss.
+        """
+        vector = self._memory.get(key)
+        if vector is not None:
+            with self._lock:
+                self.hits += 1
+            return vector
+
+        vector = self._read_store(key)
+        if vector is not None:
+            self._memory.put(key, vector)
+            with self._lock:
+                self.store_hits += 1
+            return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, vector: List[float]) -> None:
+        """
+        Store an embedding in memory and in the persistent tier.
+
+        Args:
+            key (str): The cache key built by `make_key`.
+            vector (List[float]): The embedding to store.
+        """
+        self._memory.put(key, vector)
+        self._write_store(key, vector)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the cache counters.
+
+        Returns:
+            Dict[str, int]: Memory hits, persistent tier hits, misses and the number of entries held in memory.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "size": self._memory.stats()["size"]
+            }
+
+    def _read_store(self, key: str) -> Optional[List[float]]:
+        if not self.store_uri:
+            return None
+        try:
+            if self.store_uri.startswith("gs://"):
+                return json.loads(self._get_blob(key).download_as_bytes())
+            path = os.path.join(self.store_uri, key + ".json")
+            with open(path, "r") as file:
+                vector = json.load(file)
+            # Mark the entry as recently used for eviction
+            os.utime(path)
+            return vector
+        except (NotFound, FileNotFoundError):
+            return None
+        except Exception as e:
+            print('Error in reading embedding cache: ' + str(e))
+            return None
+
+    def _write_store(self, key: str, vector: List[float]) -> None:
+        if not self.store_uri:
+            return
+        try:
+            payload = json.dumps(vector)
+            if self.store_uri.startswith("gs://"):
+                self._get_blob(key).upload_from_string(payload, content_type="application/json")
+                return
+            os.makedirs(self.store_uri, exist_ok=True)
+            path = os.path.join(self.store_uri, key + ".json")
+            # Write to a temporary file first so concurrent readers never see a partial entry
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as file:
+                file.write(payload)
+            os.replace(tmp_path, path)
+            self._evict_store(len(payload))
+        except Exception as e:
+            print('Error in writing embedding cache: ' + str(e))
+
+    def _evict_store(self, added_bytes: int) -> None:
+        with self._lock:
+            if self._store_bytes is None:
+                self._store_bytes = sum(entry.stat().st_size for entry in os.scandir(self.store_uri) if entry.name.endswith(".json"))
+            else:
+                self._store_bytes += added_bytes
+            if self._store_bytes <= self.max_store_bytes:
+                return
+
+            # Remove the least recently used entries down to 90% of the cap
+            entries = sorted(
+                (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                for entry in os.scandir(self.store_uri) if entry.name.endswith(".json")
+            )
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= 0.9 * self.max_store_bytes:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                total -= size
+            self._store_bytes = total
+
+    def _get_blob(self, key: str) -> storage.Blob:
+        bucket_name, _, prefix = self.store_uri[len("gs://"):].partition("/")
+        client = registry.get("storage_client", storage.Client)
+        blob_name = f"{prefix.rstrip('/')}/{key}.json" if prefix else f"{key}.json"
+        return client.bucket(bucket_name).blob(blob_name)
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Get the process-wide embedding cache configured from environment variables.
+
+    EMBEDDING_CACHE_SIZE sets the number of vectors held in memory and EMBEDDING_CACHE_URI,
+    when set, enables the persistent tier (a "gs://bucket/prefix" URI or a local directory, bounded
+    to EMBEDDING_CACHE_STORE_BYTES).
+
+    Returns:
+        EmbeddingCache: The embedding cache.
+    """
+    return registry.get("embedding_cache", lambda: EmbeddingCache(
+        capacity=int(os.environ.get("EMBEDDING_CACHE_SIZE", "1024")),
+        store_uri=os.environ.get("EMBEDDING_CACHE_URI") or None,
+        max_store_bytes=int(os.environ.get("EMBEDDING_CACHE_STORE_BYTES", str(64 * 2 ** 20)))
+    ))
 
 def get_weighted_embeddings(chunk_embeddings: List[List[float]], chunk_lens: List[float]) -> List[float]:
     """
@@ -36,16 +1011,84 @@ def get_weighted_embeddings(chunk_embeddings: List[List[float]], chunk_lens: Lis
     Returns:
         List[float]: Weighted average embeddings based on chunk lengths.
     """
-    # Calculate the sum of weights (chunk lengths)
-    weights_sum = sum(chunk_lens)
+    # Stack the chunk embeddings into a contiguous (chunks x dimensions) float32 matrix
+    embeddings = np.ascontiguousarray(chunk_embeddings, dtype=np.float32)
+    weights = np.asarray(chunk_lens, dtype=np.float32)
 
-    # Calculate the weighted average for each element in the embeddings
-    result = [
-        sum(arr[i] * chunk_lens[k] / weights_sum for k, arr in enumerate(chunk_embeddings))
-        for i in range(len(chunk_embeddings[0]))
-    ]
+    # Weighted average as a single matrix-vector product
+    result = (weights @ embeddings) / weights.sum()
+
+    return result.tolist()
+
+class WeightedEmbeddingAccumulator:
+    """
+    Streaming weighted average of chunk embeddings.
+
+    Each chunk embedding is folded into a running weighted sum as soon as it arrives, so memory
+    stays constant regardless of the number of chunks. The result matches `get_weighted_embeddings`
+    over the same chunks.
+    """
+
+    def __init__(self, dimensions: int = 768) -> None:
+        # Accumulate in float64 so long documents do not lose precision
+        self._weighted_sum = np.zeros(dimensions, dtype=np.float64)
+        self._weights_sum = 0.0
+
+    def add(self, embedding: List[float], weight: float) -> None:
+        """
+        Fold one chunk embedding into the running weighted sum.
+
+        Args:
+            embedding (List[float]): The chunk embedding.
+            weight (float): The chunk length used as its weight.
+        """
+        self._weighted_sum += np.asarray(embedding, dtype=np.float32) * weight
+        self._weights_sum += weight
+
+    def result(self) -> List[float]:
+        """
+        Get the weighted average of the chunks added so far.
+
+        Returns:
+            List[float]: Weighted average embeddings, or an empty list if no chunk has been added.
+        """
+        if self._weights_sum == 0:
+            return []
+        return (self._weighted_sum / self._weights_sum).astype(np.float32).tolist()
+
+def get_grouped_weighted_embeddings(group_ids: List[str], chunk_embeddings: np.ndarray, chunk_lens: List[float]) -> Dict[str, np.ndarray]:
+    """
+    Calculate the weighted average embedding of every group of chunks in one pass.
+
+    This is the batch form of `get_weighted_embeddings`, used offline to recompute the weighted
+    embeddings of every job in the `embeddings-2024` table from its exported chunk rows.
+
+    Args:
+        group_ids (List[str]): The group (job) ID of every chunk row.
+        chunk_embeddings (np.ndarray): A (chunks x dimensions) array of chunk embeddings.
+        chunk_lens (List[float]): The length of every chunk, used as its weight.
+
+    Returns:
+        Dict[str, np.ndarray]: A dictionary mapping group IDs to float32 weighted average embeddings.
+    """
+    embeddings = np.ascontiguousarray(chunk_embeddings, dtype=np.float32)
+    weights = np.asarray(chunk_lens, dtype=np.float64)
+
+    # Map every chunk to a dense group index
+    unique_ids, group_index = np.unique(np.asarray(group_ids), return_inverse=True)
 
-    return result
+    # Sort the chunks by group so every group is a contiguous run of rows
+    order = np.argsort(group_index, kind="stable")
+    sorted_index = group_index[order]
+    starts = np.flatnonzero(np.r_[True, sorted_index[1:] != sorted_index[:-1]])
+
+    # Sum the weighted chunks and the weights of every run
+    weighted_sums = np.add.reduceat(embeddings[order] * weights[order, None], starts, axis=0)
+    weights_sums = np.bincount(group_index, weights=weights, minlength=len(unique_ids))
+
+    results = (weighted_sums / weights_sums[:, None]).astype(np.float32)
+
+    return {group_id: results[i] for i, group_id in enumerate(unique_ids.tolist())}
 
 def split_input(input_string: str, max_chunk_size: int) -> List[Dict[str, Union[str, int]]]:
     """
@@ -59,68 +1102,68 @@ def split_input(input_string: str, max_chunk_size: int) -> List[Dict[str, Union[
         List[Dict[str, Union[str, int]]]: List of chunks, where each chunk is represented as a dictionary
             with keys 'chunk_content' (str) and 'chunk_size' (int).
     """
-    chunks = []
+    return list(iter_chunks(input_string, max_chunk_size, "compat_split_input"))
 
-    if len(input_string) > max_chunk_size:
-        while len(input_string) > 0:
-            # Find the last period (.) within the maximum chunk size
-            last_period_index = input_string.rfind('.', 0, max_chunk_size)
+# Bump whenever the cover letter prompt or generation parameters change, to invalidate cached letters
+COVER_LETTER_PROMPT_VERSION = "1"
 
-            if last_period_index <= 0 or last_period_index > max_chunk_size:
-                # If no period is found within the chunk size, split at the chunk size
-                last_period_index = max_chunk_size
+# Parameters for the cover letter text generation model
+COVER_LETTER_PARAMETERS = {
+    "max_output_tokens": 8192,
+    "temperature": 0.0,
+    "top_p": 0.95,
+    "top_k": 40
+}
 
-            # Extract the chunk
-            chunk = input_string[:last_period_index + 1]
-
-            # Remove the extracted chunk from the input
-            input_string = input_string[last_period_index + 1:]
+def get_text_generation_model() -> TextGenerationModel:
+    """
+    Get the cached text generation model, initialising Vertex AI on first use.
 
-            # Trim leading and trailing whitespace
-            chunk = chunk.strip()
+    Returns:
+        TextGenerationModel: The "text-bison-32k" model handle.
+    """
+    def load_model() -> TextGenerationModel:
+        vertexai.init(project="ml-spez-ccai", location="us-central1")
+        return TextGenerationModel.from_pretrained("text-bison-32k")
 
-            # Push the chunk to the result array
-            chunks.append({
-                "chunk_content": chunk,
-                "chunk_size": len(chunk)
-            })
+    return registry.get("text_generation_model", load_model)
 
-    else:
-        chunks = [{
-            "chunk_content": input_string,
-            "chunk_size": len(input_string)
-        }]
+def get_cover_letter_cache() -> LRUCache:
+    """
+    Get the process-wide cache of generated cover letters. COVER_LETTER_CACHE_SIZE sets the number of letters kept.
 
-    return chunks
+    Returns:
+        LRUCache: The cover letter cache.
+    """
+    return registry.get("cover_letter_cache", lambda: LRUCache(int(os.environ.get("COVER_LETTER_CACHE_SIZE", "128"))))
 
-def generate_cover_letter(resume_text: str, job_text: str) -> Optional[str]:
+def get_cover_letter_key(resume_text: str, job_text: str) -> str:
     """
-    Generate a cover letter for a job opening based on a candidate's resume.
+    Build the cover letter cache key from the content of both documents and the prompt version.
 
     Args:
         resume_text (str): The text of the candidate's resume.
         job_text (str): The text of the job opening.
 
     Returns:
-        Optional[str]: The generated cover letter text or None if an error occurs.
+        str: The cache key.
     """
-    try:
-        # Initialize Vertex AI
-        vertexai.init(project="ml-spez-ccai", location="us-central1")
+    resume_hash = hashlib.sha256(resume_text.encode("utf8")).hexdigest()
+    job_hash = hashlib.sha256(job_text.encode("utf8")).hexdigest()
+    return f"{resume_hash}:{job_hash}:{COVER_LETTER_PROMPT_VERSION}"
 
-        # Parameters for text generation model
-        parameters = {
-            "max_output_tokens": 8192,
-            "temperature": 0.0,
-            "top_p": 0.95,
-            "top_k": 40
-        }
+def get_cover_letter_prompt(resume_text: str, job_text: str) -> str:
+    """
+    Create the prompt for cover letter generation.
 
-        # Load the text generation model
-        model = TextGenerationModel.from_pretrained("text-bison-32k")
+    Args:
+        resume_text (str): The text of the candidate's resume.
+        job_text (str): The text of the job opening.
 
-        # Create the prompt for text generation
-        prompt = f"""Given a candidate's resume with text:
+    Returns:
+        str: The prompt.
+    """
+    return f"""Given a candidate's resume with text:
         "{resume_text}"
         Given a job opening with text:
         "{job_text}"
@@ -128,8 +1171,36 @@ def generate_cover_letter(resume_text: str, job_text: str) -> Optional[str]:
         Use relevant information from the candidate's resume to generate the letter,
         do not add fictional information."""
 
+@traced("vertex.generate_cover_letter")
+def generate_cover_letter(resume_text: str, job_text: str) -> Optional[str]:
+    """
+    Generate a cover letter for a job opening based on a candidate's resume.
+
+    Letters are cached by the content of both documents and the prompt version, so generating
+    the same letter again does not call the model.
+
+    Args:
+        resume_text (str): The text of the candidate's resume.
+        job_text (str): The text of the job opening.
+
+    Returns:
+        Optional[str]: The generated cover letter text or None if an error occurs.
+    """
+    try:
+        # Serve letters that have already been generated from the cache
+        cache = get_cover_letter_cache()
+        cache_key = get_cover_letter_key(resume_text, job_text)
+        cover_letter = cache.get(cache_key)
+        if cover_letter is not None:
+            return cover_letter
+
+        # Load the text generation model
+        model = get_text_generation_model()
+
         # Generate the cover letter using the text generation model
-        response = model.predict(prompt, **parameters)
+        response = model.predict(get_cover_letter_prompt(resume_text, job_text), **COVER_LETTER_PARAMETERS)
+
+        cache.put(cache_key, response.text)
 
         return response.text
 
@@ -140,6 +1211,45 @@ def generate_cover_letter(resume_text: str, job_text: str) -> Optional[str]:
             print('Error: ' + str(e))
         return None
 
+def generate_cover_letter_stream(resume_text: str, job_text: str) -> Iterator[str]:
+    """
+    Generate a cover letter and yield its text as the model produces it.
+
+    A cached letter is yielded in one piece. A newly generated letter is cached once the
+    stream completes. The time to the first piece is recorded with the generation span; callers
+    that need the whole letter, such as `save_cl`, still wait for the last piece.
+
+    Args:
+        resume_text (str): The text of the candidate's resume.
+        job_text (str): The text of the job opening.
+
+    Yields:
+        str: Consecutive pieces of the cover letter text.
+    """
+    cache = get_cover_letter_cache()
+    cache_key = get_cover_letter_key(resume_text, job_text)
+    cover_letter = cache.get(cache_key)
+    if cover_letter is not None:
+        yield cover_letter
+        return
+
+    # Load the text generation model
+    model = get_text_generation_model()
+
+    # Timed by hand, a span must not stay open across yields to a consumer in another context
+    start = time.perf_counter()
+    first_piece_ms = None
+    pieces = []
+    for response in model.predict_streaming(get_cover_letter_prompt(resume_text, job_text), **COVER_LETTER_PARAMETERS):
+        if first_piece_ms is None:
+            first_piece_ms = round((time.perf_counter() - start) * 1000, 1)
+        pieces.append(response.text)
+        yield response.text
+    get_tracer().record("vertex.generate_cover_letter_stream", start, first_piece_ms=first_piece_ms, pieces=len(pieces))
+
+    cache.put(cache_key, "".join(pieces))
+
+@traced("drive.delete_folders")
 def delete_folders(folder_id: str) -> Optional[bool]:
     """
     Delete a folder from Google Drive based on its folder ID.
@@ -151,11 +1261,8 @@ def delete_folders(folder_id: str) -> Optional[bool]:
         Optional[bool]: True if the folder is deleted successfully, None if an error occurs.
     """
     try:
-        # Get credentials
-        credentials = get_credentials()
-
-        # Build Google Drive API service
-        service = build('drive', 'v3', credentials=credentials)
+        # Get the cached Google Drive API service
+        service = get_drive_service()
 
         # Delete the folder using the Drive API
         service.files().delete(fileId=folder_id).execute()
@@ -165,24 +1272,24 @@ def delete_folders(folder_id: str) -> Optional[bool]:
         print(f"An error occurred: {error}")
         return None
 
-def upload_file(file_name: str, folder_id: str, local_path: str) -> Optional[bool]:
+@traced("drive.upload_bytes")
+def upload_bytes(file_name: str, folder_id: str, data: bytes, mimetype: str = DOCX_MIMETYPE) -> Optional[Dict[str, str]]:
     """
-    Upload a file to Google Drive within a specified folder.
+    Upload an in-memory file to Google Drive within a specified folder.
 
     Args:
         file_name (str): The name of the file to be uploaded.
         folder_id (str): The ID of the folder in which to upload the file.
-        local_path (str): The local path of the file to be uploaded.
+        data (bytes): The content of the file.
+        mimetype (str): The MIME type of the file.
 
     Returns:
-        Optional[bool]: True if the file is uploaded successfully, None if an error occurs.
+        Optional[Dict[str, str]]: The details of the uploaded file (id, name, md5Checksum, size),
+            or None if an error occurs.
     """
     try:
-        # Get credentials
-        credentials = get_credentials()
-
-        # Build Google Drive API service
-        service = build('drive', 'v3', credentials=credentials)
+        # Get the cached Google Drive API service
+        service = get_drive_service()
 
         # Set metadata for the file
         file_metadata = {
@@ -190,65 +1297,224 @@ def upload_file(file_name: str, folder_id: str, local_path: str) -> Optional[boo
             'parents': [folder_id]
         }
 
-        # Create a media file upload instance
-        media = MediaFileUpload(local_path, mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+        # Upload straight from memory, without a temporary file
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mimetype)
+        file = service.files().create(body=file_metadata, media_body=media, fields='id, name, md5Checksum, size').execute()
 
-        # Upload the file using the Drive API
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        # The folder listing now misses the new file
+        get_folder_cache().invalidate(folder_id)
 
-        return True
+        return file
     except HttpError as error:
         print(f"An error occurred: {error}")
         return None
 
-def save_cl(text: str, file_name: str, folder_id: str) -> Optional[bool]:
+# Characters python-docx refuses in document text, stripped before rendering
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def docx_run(text: Optional[str], bold: bool = False) -> str:
     """
-    Save a cover letter text to a Word document, and upload it to Google Drive.
+    Render a WordprocessingML run, turning newlines into line breaks like python-docx does.
 
     Args:
-        text (str): The cover letter text to be saved.
-        file_name (str): The desired name of the Word document (without extension).
-        folder_id (str): The ID of the folder in which to upload the document.
+        text (Optional[str]): The text of the run.
+        bold (bool): Whether the run is bold.
 
     Returns:
-        Optional[bool]: True if the document is saved and uploaded successfully, None if an error occurs.
+        str: The run XML, or an empty string if there is no text.
     """
-    try:
-        # Append ".docx" to the file name
-        file_name = file_name + ".docx"
+    if not text:
+        return ""
+    text = INVALID_XML_CHARS.sub("", str(text).replace("\r\n", "\n").replace("\r", "\n"))
+    content = "<w:br/>".join(
+        "<w:tab/>".join(f'<w:t xml:space="preserve">{xml_escape(part)}</w:t>' for part in line.split("\t"))
+        for line in text.split("\n")
+    )
+    properties = "<w:rPr><w:b/></w:rPr>" if bold else ""
+    return f"<w:r>{properties}{content}</w:r>"
+
+def docx_paragraph(runs: List[str], style: Optional[str] = None) -> str:
+    """
+    Render a WordprocessingML paragraph.
 
-        # Get the current timestamp
-        current_timestamp = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    Args:
+        runs (List[str]): The run XML fragments, as built by `docx_run`.
+        style (Optional[str]): The paragraph style ID, e.g. "Title" or "Heading4".
 
-        # Create a new Word document
-        doc = Document()
+    Returns:
+        str: The paragraph XML.
+    """
+    properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    return f"<w:p>{properties}{''.join(runs)}</w:p>"
+
+class DocxTemplate:
+    """
+    Pre-built Word document rendered in memory by filling in only its variable parts.
+
+    The template, with the demo header and a footer holding a timestamp placeholder, is built once
+    with python-docx and kept as the list of its package parts. Rendering inserts the body
+    paragraphs into `word/document.xml`, sets the footer timestamp and zips the parts back,
+    without re-creating the document model or touching the filesystem.
+    """
 
-        # Configure the header and footer
+    TIMESTAMP_MARKER = "{{TIMESTAMP}}"
+
+    def __init__(self, header_text: str = "Welcome to Intelia ML Specialization Demo") -> None:
+        doc = Document()
         section = doc.sections[0]
-        header = section.header
-        footer = section.footer
-        h_paragraph = header.paragraphs[0]
-        f_paragraph = footer.paragraphs[0]
-        h_paragraph.text = "Welcome to Intelia ML Specialization Demo"
-        f_paragraph.text = f"Generated at {current_timestamp}."
+        section.header.paragraphs[0].text = header_text
+        section.footer.paragraphs[0].text = f"Generated at {self.TIMESTAMP_MARKER}."
+
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        with zipfile.ZipFile(buffer) as package:
+            self._parts = [(info, package.read(info.filename)) for info in package.infolist()]
+
+        # Split the main document around the insertion point of the body paragraphs
+        document_xml = dict((info.filename, data) for info, data in self._parts)["word/document.xml"].decode("utf8")
+        insert_at = document_xml.index("<w:body>") + len("<w:body>")
+        self._document_head = document_xml[:insert_at]
+        self._document_tail = document_xml[insert_at:]
+
+    def render(self, paragraphs: List[str], timestamp: str) -> bytes:
+        """
+        Render the document with the given body paragraphs.
+
+        Args:
+            paragraphs (List[str]): The paragraph XML fragments, as built by `docx_paragraph`.
+            timestamp (str): The generation timestamp shown in the footer.
+
+        Returns:
+            bytes: The content of the .docx file.
+        """
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as package:
+            for info, data in self._parts:
+                if info.filename == "word/document.xml":
+                    data = (self._document_head + "".join(paragraphs) + self._document_tail).encode("utf8")
+                elif self.TIMESTAMP_MARKER.encode("utf8") in data:
+                    data = data.replace(self.TIMESTAMP_MARKER.encode("utf8"), xml_escape(timestamp).encode("utf8"))
+                package.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED)
+        return output.getvalue()
+
+def get_docx_template() -> DocxTemplate:
+    """
+    Get the cached document template used by `save_job` and `save_cl`.
 
-        # Add the cover letter text to the document
-        doc.add_paragraph(text)
+    Returns:
+        DocxTemplate: The document template.
+    """
+    return registry.get("docx_template", DocxTemplate)
+
+@traced("docx.render_cl")
+def render_cl(text: Union[str, Iterable[str]]) -> bytes:
+    """
+    Render a cover letter as a Word document.
+
+    Args:
+        text (Union[str, Iterable[str]]): The cover letter text, whole or in pieces.
+
+    Returns:
+        bytes: The content of the .docx file.
+    """
+    # Get the current timestamp
+    current_timestamp = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+
+    # One run per streamed piece; the pieces are buffered, the document is zipped after the last one
+    runs = [docx_run(piece) for piece in ([text] if isinstance(text, str) else text)]
+
+    return get_docx_template().render([docx_paragraph(runs)], current_timestamp)
+
+def save_cl(text: Union[str, Iterable[str]], file_name: str, folder_id: str) -> Optional[Dict[str, str]]:
+    """
+    Save a cover letter text to a Word document, and upload it to Google Drive.
 
-        # Save the document to a temporary location
-        file_name_sanitized = file_name.replace("/","-")
-        doc_path = "/tmp/" + file_name_sanitized
-        doc.save(doc_path)
+    The text can also be given as an iterable of pieces, such as the output of
+    `generate_cover_letter_stream`. This is buffered streaming: each piece is converted to a
+    document run as it arrives, but the document is only zipped and uploaded after the last
+    piece, so nothing reaches Drive before the whole letter has been generated.
 
-        # Upload the document to Google Drive
-        upload_success = upload_file(file_name, folder_id, doc_path)
+    Args:
+        text (Union[str, Iterable[str]]): The cover letter text to be saved, whole or in pieces.
+        file_name (str): The desired name of the Word document (without extension).
+        folder_id (str): The ID of the folder in which to upload the document.
 
-        return upload_success
+    Returns:
+        Optional[Dict[str, str]]: The details of the uploaded document, or None if an error occurs.
+    """
+    try:
+        # Render the document in memory and upload it
+        return upload_bytes(file_name + ".docx", folder_id, render_cl(text))
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
 
-def save_job(job_details: Dict[str, str], file_name: str, folder_id: str) -> Optional[bool]:
+def get_job_text(job_details: Dict[str, str]) -> str:
+    """
+    Build the text of an exported job document, as extracted from the file written by `save_job`.
+
+    Args:
+        job_details (Dict[str, str]): A dictionary containing job details.
+
+    Returns:
+        str: The paragraphs of the job document joined with newline separators.
+    """
+    paragraphs = [job_details["title"] or "", "Job Details"]
+    paragraphs.append(f"Work Type: {job_details['formatted_work_type'] or ''}")
+    paragraphs.append(f"Location: {job_details['location'] or ''}")
+    if job_details["min_salary"]:
+        paragraphs.append(f"Minimum Salary: {job_details['min_salary']}")
+    if job_details["max_salary"]:
+        paragraphs.append(f"Maximum Salary: {job_details['max_salary']}")
+    if job_details["pay_period"]:
+        paragraphs.append(f"Pay Period: {job_details['pay_period']}")
+    paragraphs.append(f"{str(job_details.get('views', 0))} Views {str(job_details.get('applies', 0))} Applies")
+    paragraphs.append("Job Description")
+    paragraphs.append(job_details["description"] or "")
+
+    return '\n'.join(paragraphs)
+
+@traced("docx.render_job")
+def render_job(job_details: Dict[str, str]) -> bytes:
+    """
+    Render job details as a Word document.
+
+    Args:
+        job_details (Dict[str, str]): A dictionary containing job details.
+
+    Returns:
+        bytes: The content of the .docx file.
+    """
+    # Get the current timestamp
+    current_timestamp = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+
+    # Job title as heading, then the job details section
+    paragraphs = [
+        docx_paragraph([docx_run(job_details["title"])], style="Title"),
+        docx_paragraph([docx_run("Job Details")], style="Heading4"),
+        docx_paragraph([docx_run("Work Type: ", bold=True), docx_run(job_details["formatted_work_type"])]),
+        docx_paragraph([docx_run("Location: ", bold=True), docx_run(job_details["location"])])
+    ]
+
+    if job_details["min_salary"]:
+        paragraphs.append(docx_paragraph([docx_run("Minimum Salary: ", bold=True), docx_run(str(job_details["min_salary"]))]))
+
+    if job_details["max_salary"]:
+        paragraphs.append(docx_paragraph([docx_run("Maximum Salary: ", bold=True), docx_run(str(job_details["max_salary"]))]))
+
+    if job_details["pay_period"]:
+        paragraphs.append(docx_paragraph([docx_run("Pay Period: ", bold=True), docx_run(job_details["pay_period"])]))
+
+    stats_text = f"{str(job_details.get('views', 0))} Views {str(job_details.get('applies', 0))} Applies"
+    paragraphs.append(docx_paragraph([docx_run(stats_text)]))
+
+    # Job description section
+    paragraphs.append(docx_paragraph([docx_run("Job Description")], style="Heading4"))
+    paragraphs.append(docx_paragraph([docx_run(job_details["description"])]))
+
+    return get_docx_template().render(paragraphs, current_timestamp)
+
+def save_job(job_details: Dict[str, str], file_name: str, folder_id: str) -> Optional[Dict[str, str]]:
     """
     Save job details to a Word document and upload it to Google Drive.
 
@@ -258,83 +1524,154 @@ def save_job(job_details: Dict[str, str], file_name: str, folder_id: str) -> Opt
         folder_id (str): The ID of the folder in which to upload the document.
 
     Returns:
-        Optional[bool]: True if the document is saved and uploaded successfully, None if an error occurs.
+        Optional[Dict[str, str]]: The details of the uploaded document, or None if an error occurs.
     """
     try:
-        # Append ".docx" to the file name
-        file_name = file_name + ".docx"
+        # Render the document in memory and upload it
+        return upload_bytes(file_name + ".docx", folder_id, render_job(job_details))
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
 
-        # Get the current timestamp
-        current_timestamp = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+# Columns returned by get_job and the subset of them returned by get_job_details
+JOB_COLUMNS = [
+    "job_id", "title", "formatted_work_type", "description", "max_salary", "min_salary",
+    "pay_period", "views", "applies", "location", "job_posting_url"
+]
+JOB_DETAIL_COLUMNS = ["job_id", "title", "formatted_work_type", "max_salary", "min_salary", "pay_period", "location"]
 
-        # Create a new Word document
-        doc = Document()
+class JobSnapshotStore:
+    """
+    Read-only job metadata snapshot keyed by job_id.
 
-        # Configure the header and footer
-        section = doc.sections[0]
-        header = section.header
-        footer = section.footer
-        h_paragraph = header.paragraphs[0]
-        f_paragraph = footer.paragraphs[0]
-        h_paragraph.text = "Welcome to Intelia ML Specialization Demo"
-        f_paragraph.text = f"Generated at {current_timestamp}."
-
-        # Add job title as heading
-        doc.add_heading(job_details["title"], 0)
-
-        # Add job details section heading
-        doc.add_heading('Job Details', level=4)
-
-        # Add job details to the document
-        type_para = doc.add_paragraph()
-        type_para.add_run('Work Type: ').bold = True
-        type_para.add_run(job_details["formatted_work_type"])
-
-        location_para = doc.add_paragraph()
-        location_para.add_run('Location: ').bold = True
-        location_para.add_run(job_details["location"])
-
-        if job_details["min_salary"]:
-            min_salary_para = doc.add_paragraph()
-            min_salary_para.add_run('Minimum Salary: ').bold = True
-            min_salary_para.add_run(str(job_details["min_salary"]))
-
-        if job_details["max_salary"]:
-            max_salary_para = doc.add_paragraph()
-            max_salary_para.add_run('Maximum Salary: ').bold = True
-            max_salary_para.add_run(str(job_details["max_salary"]))
-
-        if job_details["pay_period"]:
-            pay_period_para = doc.add_paragraph()
-            pay_period_para.add_run('Pay Period: ').bold = True
-            pay_period_para.add_run(job_details["pay_period"])
-
-        stats_para = doc.add_paragraph()
-        stats_text = f"{str(job_details.get('views', 0))} Views {str(job_details.get('applies', 0))} Applies"
-        stats_para.add_run(stats_text)
-
-        # Add job description section heading
-        doc.add_heading('Job Description', level=4)
-
-        # Add job description to the document
-        doc.add_paragraph(job_details["description"])
-
-        # Save the document to a temporary location
-        file_name_sanitized = file_name.replace("/","-")
-        doc_path = "/tmp/" + file_name_sanitized
-        doc.save(doc_path)
-
-        # Upload the document to Google Drive
-        upload_success = upload_file(file_name, folder_id, doc_path)
-
-        return upload_success
+    The snapshot is the SQLite file written by the `trans` function next to the embeddings export.
+    It is opened once per instance and serves point lookups locally; jobs missing from it are
+    fetched from BigQuery by the callers.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        # The file never changes once downloaded, so it is opened immutable to skip file locking
+        self._connection = sqlite3.connect(f"file:{path}?immutable=1", uri=True, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+
+    @classmethod
+    def from_uri(cls, uri: str, cache_dir: str = "/tmp/job-snapshot") -> "JobSnapshotStore":
+        """
+        Open a snapshot from a local path or a "gs://" URI, downloading it once per instance.
+
+        Args:
+            uri (str): The location of the snapshot file.
+            cache_dir (str): The directory the snapshot is downloaded to.
+
+        Returns:
+            JobSnapshotStore: The opened snapshot.
+        """
+        if uri.startswith("gs://"):
+            bucket_name, _, blob_name = uri[len("gs://"):].partition("/")
+            os.makedirs(cache_dir, exist_ok=True)
+            local_path = os.path.join(cache_dir, os.path.basename(blob_name))
+            if not os.path.exists(local_path):
+                client = registry.get("storage_client", storage.Client)
+                client.bucket(bucket_name).blob(blob_name).download_to_filename(local_path + ".tmp")
+                os.replace(local_path + ".tmp", local_path)
+            uri = local_path
+        return cls(uri)
+
+    def get_many(self, job_ids: List[str], columns: List[str] = JOB_COLUMNS) -> Dict[str, Dict[str, str]]:
+        """
+        Look up several jobs by ID.
+
+        Args:
+            job_ids (List[str]): The IDs of the jobs to retrieve.
+            columns (List[str]): The columns to return.
+
+        Returns:
+            Dict[str, Dict[str, str]]: A dictionary mapping the IDs found in the snapshot to job details.
+        """
+        if not job_ids:
+            return {}
+        query = f"SELECT {', '.join(columns)} FROM jobs WHERE job_id IN ({', '.join('?' * len(job_ids))})"
+        with self._lock:
+            rows = self._connection.execute(query, [str(job_id) for job_id in job_ids]).fetchall()
+        return {row["job_id"]: dict(row) for row in rows}
+
+    def get(self, job_id: str, columns: List[str] = JOB_COLUMNS) -> Optional[Dict[str, str]]:
+        """
+        Look up one job by ID.
+
+        Args:
+            job_id (str): The ID of the job to retrieve.
+            columns (List[str]): The columns to return.
+
+        Returns:
+            Optional[Dict[str, str]]: The job details, or None if the job is not in the snapshot.
+        """
+        return self.get_many([job_id], columns).get(str(job_id))
+
+# Monotonic time before which a snapshot that failed to open is not retried
+job_snapshot_retry = {"at": 0.0}
+
+def get_job_snapshot() -> Optional[JobSnapshotStore]:
+    """
+    Get the cached job metadata snapshot named by the JOBS_SNAPSHOT_URI environment variable.
+
+    A snapshot that cannot be opened, for example before the first export, is not retried for
+    JOBS_SNAPSHOT_RETRY seconds, so lookups go straight to BigQuery in the meantime.
+
+    Returns:
+        Optional[JobSnapshotStore]: The snapshot, or None if it is not configured or cannot be opened.
+    """
+    snapshot_uri = os.environ.get("JOBS_SNAPSHOT_URI")
+    if not snapshot_uri or time.monotonic() < job_snapshot_retry["at"]:
+        return None
+    try:
+        return registry.get("job_snapshot", lambda: JobSnapshotStore.from_uri(snapshot_uri))
     except Exception as e:
-        print(f"An error occurred: {e}")
+        print('Unable to open job snapshot: ' + str(e))
+        job_snapshot_retry["at"] = time.monotonic() + float(os.environ.get("JOBS_SNAPSHOT_RETRY", "300"))
         return None
 
+@traced("bigquery.query_jobs")
+def query_jobs(job_ids: List[str], columns: List[str]) -> List[Dict[str, str]]:
+    """
+    Retrieve jobs from BigQuery by ID with a parameterised query.
+
+    Args:
+        job_ids (List[str]): The IDs of the jobs to retrieve.
+        columns (List[str]): The columns to return.
+
+    Returns:
+        List[Dict[str, str]]: The job details found in BigQuery.
+    """
+    # Retrieve BigQuery table ID from environment variable
+    jobs_table_id = os.environ.get("JOBS_TABLE_ID")
+
+    # Get the cached BigQuery client
+    client = get_bigquery_client()
+
+    # Construct the SQL query using UNNEST to filter by job IDs
+    query = f'''
+    SELECT
+    {", ".join(columns)}
+    FROM
+    `{jobs_table_id}`
+    WHERE
+    job_id IN UNNEST(@job_ids)
+    '''
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("job_ids", "STRING", [str(job_id) for job_id in job_ids])]
+    )
+
+    # Execute the query and wait for the job to complete
+    results = client.query(query, job_config=job_config).result()
+
+    return [dict(result) for result in results]
+
 def get_job(job_id: str) -> Optional[Dict[str, str]]:
     """
-    Retrieve job details from BigQuery based on the provided job ID.
+    Retrieve job details based on the provided job ID, from the job snapshot or BigQuery.
 
     Args:
         job_id (str): The ID of the job to retrieve.
@@ -343,40 +1680,15 @@ def get_job(job_id: str) -> Optional[Dict[str, str]]:
         Optional[Dict[str, str]]: A dictionary containing job details or None if an error occurs.
     """
     try:
-        # Retrieve BigQuery table ID from environment variable
-        jobs_table_id = os.environ.get("JOBS_TABLE_ID")
-
-        # Create a BigQuery client
-        client = bigquery.Client()
-
-        # Construct the SQL query
-        query = f'''
-        SELECT
-        job_id,
-        title,
-        formatted_work_type,
-        description,
-        max_salary,
-        min_salary,
-        pay_period,
-        views,
-        applies,
-        location,
-        job_posting_url
-        FROM
-        `{jobs_table_id}`
-        WHERE
-        job_id = "{job_id}"
-        '''
-
-        # Execute the query
-        query_job = client.query(query)
-        result_data = []
+        # Serve the job from the local snapshot when it has it
+        snapshot = get_job_snapshot()
+        if snapshot:
+            job = snapshot.get(job_id)
+            if job:
+                return job
 
-        # Process the query results
-        results = query_job.result()  # Waits for the job to complete.
-        for result in results:
-            result_data.append(dict(result))
+        # Fall back to BigQuery
+        result_data = query_jobs([job_id], JOB_COLUMNS)
 
         # Return the first result (if any)
         return result_data[0] if result_data else None
@@ -391,7 +1703,7 @@ def get_job(job_id: str) -> Optional[Dict[str, str]]:
 
 def get_job_details(matches: Dict[str, float]) -> Optional[List[Dict[str, str]]]:
     """
-    Retrieve job details from BigQuery based on a dictionary of job matches.
+    Retrieve job details based on a dictionary of job matches, from the job snapshot or BigQuery.
 
     Args:
         matches (Dict[str, float]): A dictionary mapping job IDs to match distances.
@@ -404,37 +1716,17 @@ def get_job_details(matches: Dict[str, float]) -> Optional[List[Dict[str, str]]]
         # Extract job IDs from the matches dictionary
         job_ids = list(matches.keys())
 
-        # Retrieve BigQuery table ID from environment variable
-        jobs_table_id = os.environ.get("JOBS_TABLE_ID")
-
-        # Create a BigQuery client
-        client = bigquery.Client()
-
-        # Construct the SQL query using UNNEST to filter by job IDs
-        query = f'''
-        SELECT
-        job_id,
-        title,
-        formatted_work_type,
-        max_salary,
-        min_salary,
-        pay_period,
-        location
-        FROM
-        `{jobs_table_id}`
-        WHERE
-        job_id IN UNNEST({job_ids})
-        '''
-
-        # Execute the query
-        query_job = client.query(query)
-        result_data = []
+        # Serve what the local snapshot has and query BigQuery only for the rest
+        snapshot = get_job_snapshot()
+        jobs = snapshot.get_many(job_ids, JOB_DETAIL_COLUMNS) if snapshot else {}
+        missing_ids = [job_id for job_id in job_ids if job_id not in jobs]
+        if missing_ids:
+            for job in query_jobs(missing_ids, JOB_DETAIL_COLUMNS):
+                jobs[job["job_id"]] = job
 
-        # Process the query results
-        results = query_job.result()  # Waits for the job to complete.
-        for result in results:
-            result_dict = dict(result)
+        result_data = []
 
+        for result_dict in jobs.values():
             # Calculate and add match percentage to the result dictionary
             match_distance = round(float(matches[result_dict["job_id"]]), 3)
             result_dict["match_distance"] = match_distance
@@ -454,6 +1746,313 @@ def get_job_details(matches: Dict[str, float]) -> Optional[List[Dict[str, str]]]
         return None
 
 
+def get_match_options(job_details: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """
+    Build the rich content listing matched jobs, an accordion and an export chip per job.
+
+    Args:
+        job_details (List[Dict[str, str]]): The matched job details, as returned by `get_job_details`.
+
+    Returns:
+        List[Dict[str, Any]]: The rich content elements.
+    """
+    options = []
+    for job in job_details:
+        match_distance = job['match_distance']
+        option_text = f"Export: {job['title']} id:{job['job_id']}"
+        text = f"Profile Match Distance: {match_distance}"
+        if job['formatted_work_type']:
+            text = text + f", Work Type: {job['formatted_work_type']}"
+        if job['min_salary']:
+            text = text + f", Minimum Salary: {job['min_salary']}"
+        if job['max_salary']:
+            text = text + f", Maximum Salary: {job['max_salary']}"
+        if job['pay_period']:
+            text = text + f", Pay Period: {job['pay_period']}"
+
+        options.append(
+            {
+                "type": "accordion",
+                "title": job["title"],
+                "subtitle": job["location"],
+                "text": text
+            })
+        options.append({
+                "type": "chips",
+                "options": [
+                    {
+                    "text": option_text
+                    }
+                ]
+            })
+    return options
+
+class SearchBackend(ABC):
+    """
+    Interface of the vector search backends used by `get_matches`.
+    """
+
+    @abstractmethod
+    def find_neighbors(self, vector: List[float], num_neighbors: int) -> List[Tuple[str, float]]:
+        """
+        Find the nearest neighbours of a query vector.
+
+        Args:
+            vector (List[float]): The query vector.
+            num_neighbors (int): The number of neighbours to return.
+
+        Returns:
+            List[Tuple[str, float]]: (job ID, distance) pairs, most similar first.
+        """
+
+class MatchingEngineBackend(SearchBackend):
+    """
+    Search backend served by a deployed Vertex AI Matching Engine index.
+    """
+
+    def __init__(self, deployed_index_id: str = "deployed_index_1712625187579") -> None:
+        self.deployed_index_id = deployed_index_id
+
+    @traced("matching_engine.find_neighbors")
+    def find_neighbors(self, vector: List[float], num_neighbors: int) -> List[Tuple[str, float]]:
+        # Get the cached Matching Engine Index Endpoint
+        my_index_endpoint = get_index_endpoint()
+
+        # Find neighbors using the Matching Engine
+        response = my_index_endpoint.find_neighbors(
+            deployed_index_id=self.deployed_index_id,
+            queries=[vector],
+            num_neighbors=num_neighbors
+        )
+
+        return [(neighbor.id, neighbor.distance) for neighbor in response[0]]
+
+class LocalVectorBackend(SearchBackend):
+    """
+    In-process search backend over a float32 embedding matrix.
+
+    Scores are dot products, like the Matching Engine index, so distances are comparable with
+    MATCH_THRESHOLD. In "exact" mode every query is one BLAS matrix-vector product over the whole
+    matrix. In "ivf" mode the vectors are partitioned into `nlist` clusters by spherical k-means and
+    a query only scans the `nprobe` clusters whose centroids score highest.
+    """
+
+    def __init__(self, ids: List[str], matrix: np.ndarray, mode: str = "exact", nlist: Optional[int] = None, nprobe: int = 8) -> None:
+        self.ids = ids
+        self.matrix = matrix
+        self.mode = mode
+        self.nlist = nlist or max(1, int(math.sqrt(len(ids))))
+        self.nprobe = nprobe
+        self._centroids: Optional[np.ndarray] = None
+        self._list_order: Optional[np.ndarray] = None
+        self._list_offsets: Optional[np.ndarray] = None
+        if mode == "ivf":
+            self._build_ivf()
+
+    @classmethod
+    def from_json(cls, path: str, cache_dir: str = "/tmp/vector-index", **kwargs: Any) -> "LocalVectorBackend":
+        """
+        Load the newline-delimited JSON export of the weighted embeddings table.
+
+        The vectors are converted once into a float32 .npy file in `cache_dir`, which is then
+        memory-mapped, so later loads on the same instance skip JSON parsing entirely.
+
+        Args:
+            path (str): The path of the exported `embeddings-2024.json` file, local or "gs://".
+            cache_dir (str): The directory holding the converted matrix and IDs.
+            **kwargs: Extra arguments passed to the constructor (mode, nlist, nprobe).
+
+        Returns:
+            LocalVectorBackend: The loaded backend.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        matrix_path = os.path.join(cache_dir, "embeddings.npy")
+        ids_path = os.path.join(cache_dir, "ids.json")
+
+        # Rebuild when the conversion is missing or older than a local export
+        is_stale = not (os.path.exists(matrix_path) and os.path.exists(ids_path)) or (
+            not path.startswith("gs://") and os.path.getmtime(path) > os.path.getmtime(matrix_path)
+        )
+
+        if is_stale:
+            if path.startswith("gs://"):
+                bucket_name, _, blob_name = path[len("gs://"):].partition("/")
+                client = registry.get("storage_client", storage.Client)
+                local_path = os.path.join(cache_dir, os.path.basename(blob_name))
+                client.bucket(bucket_name).blob(blob_name).download_to_filename(local_path)
+                path = local_path
+
+            # First pass counts the rows and dimensions so the matrix can be written in place
+            with open(path, "r") as file:
+                rows = sum(1 for line in file if line.strip())
+                file.seek(0)
+                dimensions = len(json.loads(file.readline())["embedding"])
+
+            ids = []
+            matrix = np.lib.format.open_memmap(matrix_path + ".tmp", mode="w+", dtype=np.float32, shape=(rows, dimensions))
+            with open(path, "r") as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    matrix[len(ids)] = row["embedding"]
+                    ids.append(str(row["id"]))
+            matrix.flush()
+            del matrix
+
+            with open(ids_path, "w") as file:
+                json.dump(ids, file)
+            os.replace(matrix_path + ".tmp", matrix_path)
+
+        with open(ids_path, "r") as file:
+            ids = json.load(file)
+
+        return cls(ids, np.load(matrix_path, mmap_mode="r"), **kwargs)
+
+    @classmethod
+    def from_shards(cls, path: str, cache_dir: str = "/tmp/vector-index", **kwargs: Any) -> "LocalVectorBackend":
+        """
+        Load the sharded float32 export written by the trans function's `export_embedding_shards`.
+
+        A single shard is memory-mapped in place. Several shards are copied once, as raw float32,
+        into one .npy file in `cache_dir`, which is then memory-mapped; nothing is parsed.
+
+        Args:
+            path (str): The directory holding `manifest.json` and the shards, local or "gs://".
+            cache_dir (str): The directory holding downloaded shards and the combined matrix.
+            **kwargs: Extra arguments passed to the constructor (mode, nlist, nprobe).
+
+        Returns:
+            LocalVectorBackend: The loaded backend.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+
+        if path.startswith("gs://"):
+            bucket_name, _, prefix = path[len("gs://"):].rstrip("/").partition("/")
+            bucket = registry.get("storage_client", storage.Client).bucket(bucket_name)
+            manifest_text = bucket.blob(f"{prefix}/manifest.json").download_as_text()
+            local_dir = os.path.join(cache_dir, "shards")
+            local_manifest = os.path.join(local_dir, "manifest.json")
+
+            # Download again only when the export has changed; the manifest is written last
+            if not os.path.exists(local_manifest) or open(local_manifest, "r").read() != manifest_text:
+                os.makedirs(local_dir, exist_ok=True)
+                for shard in json.loads(manifest_text)["shards"]:
+                    bucket.blob(f"{prefix}/{shard['file']}").download_to_filename(os.path.join(local_dir, shard["file"]))
+                with open(local_manifest, "w") as file:
+                    file.write(manifest_text)
+            path = local_dir
+
+        manifest_path = os.path.join(path, "manifest.json")
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+
+        ids = [str(job_id) for shard in manifest["shards"] for job_id in shard["ids"]]
+        shard_paths = [os.path.join(path, shard["file"]) for shard in manifest["shards"]]
+
+        if len(shard_paths) == 1:
+            return cls(ids, np.load(shard_paths[0], mmap_mode="r"), **kwargs)
+
+        # Concatenate the shards once, rebuilding when the export is newer than the combined matrix
+        matrix_path = os.path.join(cache_dir, "shards.npy")
+        if not os.path.exists(matrix_path) or os.path.getmtime(manifest_path) > os.path.getmtime(matrix_path):
+            matrix = np.lib.format.open_memmap(matrix_path + ".tmp", mode="w+", dtype=np.float32, shape=(len(ids), manifest["dimensions"]))
+            row = 0
+            for shard_path in shard_paths:
+                shard = np.load(shard_path, mmap_mode="r")
+                matrix[row:row + len(shard)] = shard
+                row += len(shard)
+            matrix.flush()
+            del matrix
+            os.replace(matrix_path + ".tmp", matrix_path)
+
+        return cls(ids, np.load(matrix_path, mmap_mode="r"), **kwargs)
+
+    @traced("local_index.find_neighbors")
+    def find_neighbors(self, vector: List[float], num_neighbors: int) -> List[Tuple[str, float]]:
+        query = np.asarray(vector, dtype=np.float32)
+
+        if self.mode == "ivf":
+            # Only scan the lists of the closest centroids
+            probe = self._top_k(self._centroids @ query, self.nprobe)
+            # Sorted row indices keep the gather from the memory-mapped matrix sequential
+            candidates = np.sort(np.concatenate([
+                self._list_order[self._list_offsets[c]:self._list_offsets[c + 1]] for c in probe
+            ]))
+            scores = self.matrix[candidates] @ query
+        else:
+            candidates = None
+            scores = self.matrix @ query
+
+        top = self._top_k(scores, num_neighbors)
+        rows = candidates[top] if candidates is not None else top
+
+        return [(self.ids[row], float(scores[i])) for row, i in zip(rows, top)]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        # Partial selection of the k best scores, then a sort of just those k
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def _build_ivf(self, iterations: int = 10, block_size: int = 8192) -> None:
+        rows = len(self.ids)
+        self.nlist = min(self.nlist, rows)
+        self.nprobe = min(self.nprobe, self.nlist)
+        rng = np.random.default_rng(0)
+
+        # Train the centroids on a sample of the vectors
+        sample = np.asarray(self.matrix[np.sort(rng.choice(rows, size=min(rows, self.nlist * 64), replace=False))])
+        centroids = sample[rng.choice(len(sample), size=self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(self.nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        # Assign every vector to its closest centroid, block by block to bound memory
+        assignment = np.empty(rows, dtype=np.int64)
+        for start in range(0, rows, block_size):
+            assignment[start:start + block_size] = np.argmax(self.matrix[start:start + block_size] @ centroids.T, axis=1)
+
+        # Store the inverted lists as one permutation plus per-list offsets
+        self._centroids = centroids
+        self._list_order = np.argsort(assignment, kind="stable")
+        self._list_offsets = np.searchsorted(assignment[self._list_order], np.arange(self.nlist + 1))
+
+def get_search_backend() -> SearchBackend:
+    """
+    Get the cached search backend selected by the SEARCH_BACKEND environment variable.
+
+    "matching_engine" (the default) uses the deployed Matching Engine index. "local" loads the
+    embeddings export named by LOCAL_INDEX_PATH (the NDJSON file, or the `manifest.json` of the
+    sharded binary export) into memory and searches it in-process, in the mode given by
+    LOCAL_SEARCH_MODE ("exact" or "ivf").
+
+    Returns:
+        SearchBackend: The search backend.
+    """
+    def build_backend() -> SearchBackend:
+        if os.environ.get("SEARCH_BACKEND", "matching_engine") == "local":
+            path = os.environ["LOCAL_INDEX_PATH"]
+            options = {
+                "mode": os.environ.get("LOCAL_SEARCH_MODE", "exact"),
+                "nprobe": int(os.environ.get("LOCAL_SEARCH_NPROBE", "8"))
+            }
+            # A manifest points at the sharded binary export, anything else at the NDJSON export
+            if path.endswith("/manifest.json"):
+                return LocalVectorBackend.from_shards(path[:-len("/manifest.json")], **options)
+            return LocalVectorBackend.from_json(path, **options)
+        return MatchingEngineBackend()
+
+    return registry.get("search_backend", build_backend)
+
+@traced("search.get_matches")
 def get_matches(vector: List[float]) -> Dict[str, float]:
     """
     Get job matches based on a vector using a matching engine.
@@ -468,27 +2067,22 @@ def get_matches(vector: List[float]) -> Dict[str, float]:
         # Retrieve match threshold from environment variable
         match_threshold = float(os.environ.get("MATCH_THRESHOLD"))
 
-        # Initialize AI Platform Matching Engine
-        aiplatform.init(project="ml-spez-ccai", location="us-central1")
-
-        # Create a Matching Engine Index Endpoint
-        my_index_endpoint = aiplatform.MatchingEngineIndexEndpoint(index_endpoint_name='8350381794633187328')
+        # Find neighbors using the configured search backend
+        neighbors = get_search_backend().find_neighbors(vector, num_neighbors=10)
 
-        # Find neighbors using the Matching Engine
-        response = my_index_endpoint.find_neighbors(
-            deployed_index_id="deployed_index_1712625187579",
-            queries=[vector],
-            num_neighbors=10
-        )
         # Extract matches from the response
         matches = {}
 
-        if len(response[0]) > 0:
-            for neighbor in response[0]:
-                print("distance: ", neighbor.distance)
-                print("id: ", neighbor.id)
-                if neighbor.distance >= match_threshold:
-                    matches[neighbor.id] = neighbor.distance
+        for neighbor_id, distance in neighbors:
+            if distance >= match_threshold:
+                matches[neighbor_id] = distance
+
+        # Record the search outcome on the current span instead of printing every neighbor
+        get_tracer().annotate(
+            neighbors=len(neighbors),
+            matches=len(matches),
+            best_distance=max((distance for _, distance in neighbors), default=None)
+        )
         return matches
 
     except Exception as e:
@@ -498,36 +2092,130 @@ def get_matches(vector: List[float]) -> Dict[str, float]:
             print('Error in finding matches: ' + str(e))
         return {}
 
-def get_text_embedding(text: str) -> List[float]:
+def iter_text_embeddings(texts: List[str]) -> Iterator[Tuple[int, List[float]]]:
     """
-    Get text embedding using a Large Language Model.
+    Get text embeddings for several texts as they arrive, batching requests and running batches concurrently.
+
+    Texts already in the embedding cache are served from it first. The remaining texts are grouped
+    into batches of EMBEDDING_BATCH_SIZE instances per `get_embeddings` call, and the batches are
+    sent on a pool of at most EMBEDDING_MAX_WORKERS threads. The vectors of each batch are yielded
+    as soon as it completes, so they arrive out of input order.
 
     Args:
-        text (str): The input text for which embedding is to be obtained.
+        texts (List[str]): The input texts for which embeddings are to be obtained.
+
+    Yields:
+        Tuple[int, List[float]]: The index of an input text and its embedding.
+    """
+    # Serve previously embedded content from the cache
+    cache = get_embedding_cache()
+    keys = [EmbeddingCache.make_key(EMBEDDING_MODEL, text) for text in texts]
+    missing = []
+    for i, key in enumerate(keys):
+        vector = cache.get(key)
+        if vector is None:
+            missing.append(i)
+        else:
+            yield i, vector
+    if not missing:
+        return
+
+    # Get the cached Text Embedding Model
+    model = get_embedding_model()
+
+    # Retrieve batching limits from environment variables
+    batch_size = int(os.environ.get("EMBEDDING_BATCH_SIZE", "5"))
+    max_workers = int(os.environ.get("EMBEDDING_MAX_WORKERS", "4"))
+
+    # Group the indices of the texts that missed the cache into batches the model accepts in one call
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+
+    @traced("vertex.get_embeddings")
+    def embed_batch(batch: List[int]) -> List[Tuple[int, List[float]]]:
+        embeddings = model.get_embeddings([texts[i] for i in batch])
+        return [(i, embedding.values) for i, embedding in zip(batch, embeddings)]
+
+    if len(batches) <= 1:
+        batch_results = (embed_batch(batch) for batch in batches)
+    else:
+        # Fan out the remaining batches and take them in completion order
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(batches)))
+        futures = [executor.submit(get_tracer().wrap(embed_batch), batch) for batch in batches]
+        executor.shutdown(wait=False)
+        batch_results = (future.result() for future in as_completed(futures))
+
+    # Remember the new vectors as they arrive
+    for batch_result in batch_results:
+        for i, vector in batch_result:
+            cache.put(keys[i], vector)
+            yield i, vector
+
+def get_text_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Get text embeddings for several texts, in the same order as the input texts.
+
+    See `iter_text_embeddings` for the caching and batching.
+
+    Args:
+        texts (List[str]): The input texts for which embeddings are to be obtained.
 
     Returns:
-        List[float]: A list representing the text embedding.
+        List[List[float]]: A list of text embeddings, one per input text, or an empty list if an error occurs.
     """
     try:
-        # Initialize the Text Embedding Model
-        model = TextEmbeddingModel.from_pretrained("textembedding-gecko")
+        vectors = [None] * len(texts)
+        for i, vector in iter_text_embeddings(texts):
+            vectors[i] = vector
+        return vectors
+
+    except Exception as e:
+        if hasattr(e, 'message'):
+            print('Error in getting text embeddings: ' + e.message)
+        else:
+            print('Error in getting text embeddings: ' + str(e))
+        return []
 
-        # Get embeddings for the input text
-        embeddings = model.get_embeddings([text])
+def get_weighted_text_embedding(chunks: List[Dict[str, Union[str, int]]]) -> List[float]:
+    """
+    Get the weighted average embedding of the chunks of a long text.
+
+    Each chunk embedding is folded into a `WeightedEmbeddingAccumulator` as soon as its batch
+    returns, so the chunk vectors are never held together in memory.
 
-        # Extract the vector from the embeddings
-        for embedding in embeddings:
-            vector = embedding.values
+    Args:
+        chunks (List[Dict[str, Union[str, int]]]): The chunks from `split_input`, with their content and size.
 
-        return vector
+    Returns:
+        List[float]: Weighted average embeddings based on chunk lengths, or an empty list if an error occurs.
+    """
+    try:
+        accumulator = WeightedEmbeddingAccumulator()
+        for i, vector in iter_text_embeddings([chunk["chunk_content"] for chunk in chunks]):
+            accumulator.add(vector, chunks[i]["chunk_size"])
+        return accumulator.result()
 
     except Exception as e:
         if hasattr(e, 'message'):
-            print('Error in getting text embedding: ' + e.message)
+            print('Error in getting text embeddings: ' + e.message)
         else:
-            print('Error in getting text embedding: ' + str(e))
+            print('Error in getting text embeddings: ' + str(e))
         return []
 
+def get_text_embedding(text: str) -> List[float]:
+    """
+    Get text embedding using a Large Language Model.
+
+    Args:
+        text (str): The input text for which embedding is to be obtained.
+
+    Returns:
+        List[float]: A list representing the text embedding.
+    """
+    vectors = get_text_embeddings([text])
+
+    return vectors[0] if vectors else []
+
+@traced("vertex.count_tokens")
 def get_token_count(content: str, model: str) -> Optional[int]:
     """
     Get the token count for the given content using a specified language model.
@@ -588,30 +2276,78 @@ def get_token_count(content: str, model: str) -> Optional[int]:
         return None
 
 
-def get_default_token() -> Optional[str]:
+# Pieces counted by the local token estimator: runs of letters, runs of digits and single symbols
+TOKEN_PIECE_REGEX = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+
+def estimate_token_count(content: str) -> int:
     """
-    Get the default access token for Google Cloud Platform credentials.
+    Estimate the token count of a text locally, without calling the countTokens endpoint.
+
+    The estimate mimics a SentencePiece vocabulary: every symbol is one token, digit runs cost a
+    token per three digits, and words cost one token plus one per additional five letters. Its
+    error against the remote count has not been measured, so `count_tokens` only trusts it once
+    TOKEN_ESTIMATE_MARGIN is set from benchmarks/calibrate_token_count.py.
+
+    Args:
+        content (str): The input text for which token count is to be estimated.
 
     Returns:
-        Optional[str]: The access token if successful, None if an error occurs.
+        int: The estimated token count.
     """
-    try:
-        # Define the required credential scopes
-        CREDENTIAL_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+    tokens = 0
+    for piece in TOKEN_PIECE_REGEX.findall(content):
+        if piece.isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        elif piece.isalpha():
+            tokens += 1 + (len(piece) - 1) // 5
+        else:
+            tokens += 1
+    return tokens
+
+def count_tokens(content: str, model: str, limit: int = EMBEDDING_TOKEN_LIMIT) -> Optional[int]:
+    """
+    Count tokens with the countTokens endpoint, or locally when the estimate is far from the limit.
+
+    Until TOKEN_ESTIMATE_MARGIN is set, every count is remote: an underestimate would let a text
+    over the limit be embedded unchunked and silently truncated. Once the margin (a fraction of the
+    limit) has been measured with benchmarks/calibrate_token_count.py, the remote count is only
+    requested when the estimate falls within the margin on either side of the limit.
+
+    Args:
+        content (str): The input text for which token count is to be obtained.
+        model (str): The name of the language model (e.g., "textembedding-gecko").
+        limit (int): The token limit the caller compares the count against.
+
+    Returns:
+        Optional[int]: The token count, exact near the limit and estimated elsewhere, or None if
+            the remote count fails.
+    """
+    # Without a calibrated margin the estimate cannot be trusted on either side of the limit
+    margin = os.environ.get("TOKEN_ESTIMATE_MARGIN", "")
+    if margin:
+        estimate = estimate_token_count(content)
+        if abs(estimate - limit) > float(margin) * limit:
+            return estimate
 
-        # Get default credentials and project ID
-        credentials, project_id = google.auth.default(scopes=CREDENTIAL_SCOPES)
+    # Too close to call, ask the model; a failed count makes the caller chunk the text
+    return get_token_count(content, model)
 
-        # Create a request object
-        request = google.auth.transport.requests.Request()
+# Token providers shared by all requests: one for Vertex AI REST calls, one that can also access Drive
+cloud_platform_tokens = TokenProvider(["https://www.googleapis.com/auth/cloud-platform"])
+drive_tokens = TokenProvider(["https://www.googleapis.com/auth/cloud-platform", "https://www.googleapis.com/auth/drive"])
 
-        # Refresh the credentials to obtain a new access token
-        credentials.refresh(request)
+def get_default_token() -> Optional[str]:
+    """
+    Get the default access token for Google Cloud Platform credentials.
 
-        # Extract the access token
-        access_token = credentials.token
+    The token is cached and refreshed shortly before it expires, so most calls do not contact
+    the metadata server.
 
-        return access_token
+    Returns:
+        Optional[str]: The access token if successful, None if an error occurs.
+    """
+    try:
+        return cloud_platform_tokens.get_token()
 
     except Exception as e:
         if hasattr(e, 'message'):
@@ -620,12 +2356,48 @@ def get_default_token() -> Optional[str]:
             print('Error in getting default token: ' + str(e))
         return None
 
-def get_sentences(text: str) -> Optional[str]:
+# Regular expression used by the "regex" sentence engine: split after sentence-ending
+# punctuation followed by whitespace and an uppercase letter, digit, bullet or quote
+SENTENCE_BOUNDARY_REGEX = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(\[•\-])")
+
+def get_nlp():
+    """
+    Get the cached spaCy pipeline used for sentence segmentation.
+
+    Only the statistical sentence recogniser (senter) is kept; the tagger, parser, NER and the
+    other components of en_core_web_sm are excluded because only `doc.sents` is used.
+
+    Returns:
+        spacy.language.Language: The sentence segmentation pipeline.
+    """
+    def load_senter():
+        nlp = en_core_web_sm.load(exclude=["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "ner"])
+        nlp.enable_pipe("senter")
+        return nlp
+
+    return registry.get("spacy_senter", load_senter)
+
+def split_sentences_regex(text: str) -> List[str]:
+    """
+    Split text into sentences with a regular expression, without loading a language model.
+
+    Args:
+        text (str): The input text to be split into sentences.
+
+    Returns:
+        List[str]: The sentences found in the text.
+    """
+    return SENTENCE_BOUNDARY_REGEX.split(text)
+
+@traced("sentences.get_sentences")
+def get_sentences(text: str, engine: Optional[str] = None) -> Optional[str]:
     """
     Tokenize the input text into sentences using a natural language processing library.
 
     Args:
         text (str): The input text to be tokenized into sentences.
+        engine (Optional[str]): The sentence engine, "spacy" or "regex". Defaults to the
+            SENTENCE_ENGINE environment variable, or "spacy" if it is not set.
 
     Returns:
         Optional[str]: The tokenized sentences joined into a single string, or None if an error occurs.
@@ -634,17 +2406,21 @@ def get_sentences(text: str) -> Optional[str]:
         # Replace newline characters with spaces
         text = text.replace('\n', ' ').replace('\r', '')
 
-        # Load the English language model for spaCy
-        nlp = en_core_web_sm.load()
+        # Pick the sentence engine
+        engine = engine or os.environ.get("SENTENCE_ENGINE", "spacy")
 
-        # Process the text with spaCy's NLP pipeline
-        doc = nlp(text)
+        if engine == "regex":
+            sentences = split_sentences_regex(text)
+        else:
+            # Process the text with the cached spaCy sentence pipeline
+            with get_tracer().span("spacy.nlp", chars=len(text)):
+                doc = get_nlp()(text)
+            sentences = (str(sent) for sent in doc.sents)
 
         # Extract sentences from the processed document
         return_sentences = []
 
-        for sent in doc.sents:
-            string_sentence = str(sent)
+        for string_sentence in sentences:
             string_sentence = re.sub("\s\s+", " ", string_sentence)
 
             if string_sentence.strip() != "":
@@ -662,21 +2438,40 @@ def get_sentences(text: str) -> Optional[str]:
             print('Error in getting sentences: ' + str(e))
         return None
 
-def get_txt_pdf(path: str) -> Optional[str]:
+@traced("extract.pdf")
+def get_txt_pdf_bytes(data: bytes) -> Optional[str]:
     """
-    Extract text content from a PDF file using textract.
+    Extract text content from an in-memory PDF document, page by page, using pypdf.
+
+    Extraction stops after MAX_PDF_PAGES pages or MAX_EXTRACTED_CHARS characters, so oversized
+    documents cannot exhaust the instance's CPU or memory.
 
     Args:
-        path (str): The file path of the PDF document.
+        data (bytes): The content of the PDF document.
 
     Returns:
         Optional[str]: The extracted text content, or None if an error occurs.
     """
     try:
-        # Use textract to extract text from the PDF file
-        text = textract.process(path)
-        text = text.decode("utf8")
-        return text
+        # Retrieve extraction limits from environment variables
+        max_pages = int(os.environ.get("MAX_PDF_PAGES", "30"))
+        max_chars = int(os.environ.get("MAX_EXTRACTED_CHARS", "200000"))
+
+        # Parse the PDF in-process, pages are only decoded when iterated
+        reader = PdfReader(io.BytesIO(data))
+
+        pages = []
+        extracted_chars = 0
+        for page_number, page in enumerate(reader.pages):
+            if page_number >= max_pages or extracted_chars >= max_chars:
+                print(f"PDF truncated after {page_number} pages and {extracted_chars} characters.")
+                break
+            page_text = page.extract_text() or ""
+            pages.append(page_text)
+            extracted_chars += len(page_text)
+
+        # Join the pages into a single string with newline separators
+        return '\n'.join(pages)[:max_chars]
 
     except Exception as e:
         if hasattr(e, 'message'):
@@ -685,12 +2480,25 @@ def get_txt_pdf(path: str) -> Optional[str]:
             print('Error in extracting text from PDF: ' + str(e))
         return None
 
-def get_txt_docx(path: str) -> Optional[str]:
+@traced("extract.docx")
+def get_txt_docx_bytes(data: bytes) -> Optional[str]:
+    """
+    Extract text content from an in-memory DOCX document using the python-docx library.
+
+    Args:
+        data (bytes): The content of the DOCX document.
+
+    Returns:
+        Optional[str]: The extracted text content, or None if an error occurs.
+    """
+    return get_txt_docx(io.BytesIO(data))
+
+def get_txt_docx(path: Union[str, io.BytesIO]) -> Optional[str]:
     """
     Extract text content from a DOCX file using the python-docx library.
 
     Args:
-        path (str): The file path of the DOCX document.
+        path (Union[str, io.BytesIO]): The file path of the DOCX document, or a buffer holding it.
 
     Returns:
         Optional[str]: The extracted text content, or None if an error occurs.
@@ -712,83 +2520,281 @@ def get_txt_docx(path: str) -> Optional[str]:
             print('Error in extracting text from DOCX: ' + str(e))
         return None
 
-def download_file(folder_id: str, file_name: str) -> Optional[str]:
+def get_extraction_cache() -> LRUCache:
+    """
+    Get the process-wide cache of extracted document text, keyed by Drive md5Checksum.
+
+    EXTRACTION_CACHE_SIZE sets the number of documents kept.
+
+    Returns:
+        LRUCache: The extraction cache.
+    """
+    return registry.get("extraction_cache", lambda: LRUCache(int(os.environ.get("EXTRACTION_CACHE_SIZE", "256"))))
+
+class FolderListingCache:
+    """
+    Short-lived cache of Google Drive folder listings.
+
+    Session folders are only listed by this function's handlers, so a listing stays valid until
+    the webhook uploads into the folder (which invalidates it) or the TTL expires, which covers
+    files users add themselves through the shared link.
+    """
+
+    def __init__(self, ttl: float = 300) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, List[Dict[str, str]]]] = {}
+
+    def get(self, folder_id: str) -> Optional[List[Dict[str, str]]]:
+        """
+        Get the cached listing of a folder.
+
+        Args:
+            folder_id (str): The ID of the Google Drive folder.
+
+        Returns:
+            Optional[List[Dict[str, str]]]: The cached file details, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(folder_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(folder_id, None)
+                return None
+            return entry[1]
+
+    def put(self, folder_id: str, files: List[Dict[str, str]]) -> None:
+        """
+        Cache the listing of a folder.
+
+        Args:
+            folder_id (str): The ID of the Google Drive folder.
+            files (List[Dict[str, str]]): The file details of the folder.
+        """
+        with self._lock:
+            self._entries[folder_id] = (time.monotonic(), files)
+
+    def invalidate(self, folder_id: str) -> None:
+        """
+        Drop the cached listing of a folder.
+
+        Args:
+            folder_id (str): The ID of the Google Drive folder.
+        """
+        with self._lock:
+            self._entries.pop(folder_id, None)
+
+def get_folder_cache() -> FolderListingCache:
+    """
+    Get the process-wide folder listing cache, with the TTL set by FOLDER_CACHE_TTL in seconds.
+
+    Returns:
+        FolderListingCache: The folder listing cache.
+    """
+    return registry.get("folder_cache", lambda: FolderListingCache(float(os.environ.get("FOLDER_CACHE_TTL", "300"))))
+
+@traced("drive.find_file")
+def find_file(folder_id: str, file_name: str) -> Optional[Dict[str, str]]:
     """
-    Download a file from Google Drive given the folder ID and file name.
+    Find a file by name in a Google Drive folder with a name-filtered query.
+
+    The folder listing cache is not consulted: the file details key the session artifacts, and a
+    file re-uploaded through the shared link would be served stale until the listing expires.
+    When several files share the name, the most recently modified one is returned.
 
     Args:
         folder_id (str): The ID of the Google Drive folder containing the file.
-        file_name (str): The name of the file to be downloaded.
+        file_name (str): The name of the file.
 
     Returns:
-        Optional[str]: The local file path where the file is downloaded, or None if an error occurs.
+        Optional[Dict[str, str]]: The file details (id, name, md5Checksum, size), or None if the file is not found.
     """
-    try:
-        # Get credentials for Google Drive API
-        credentials = get_credentials()
+    # Get the cached Google Drive API service
+    service = get_drive_service()
 
-        # Build the Google Drive API service
-        service = build('drive', 'v3', credentials=credentials)
+    # Ask Drive for this file only instead of listing the whole folder
+    escaped_name = file_name.replace("\\", "\\\\").replace("'", "\\'")
+    response = service.files().list(
+        q=f"'{folder_id}' in parents and name = '{escaped_name}' and trashed=false",
+        fields='files(id, name, md5Checksum, size)',
+        orderBy='modifiedTime desc',
+        pageSize=1
+    ).execute()
 
-        # List files in the specified folder
-        response = service.files().list(
-            q=f"'{folder_id}' in parents and trashed=false",
-            fields='files(id, name)'
-        ).execute()
+    files = response.get('files', [])
 
-        # Find the file ID matching the specified file name
-        files = response.get('files', [])
-        file_id = None
-        for file in files:
-            if file["name"] == file_name:
-                file_id = file["id"]
+    return files[0] if files else None
 
-        if not file_id:
-            print(f"File '{file_name}' not found in folder with ID '{folder_id}'.")
-            return None
+@traced("drive.download_file_bytes")
+def download_file_bytes(file_id: str) -> Optional[bytes]:
+    """
+    Download a file from Google Drive into memory.
+
+    Args:
+        file_id (str): The ID of the file to be downloaded.
+
+    Returns:
+        Optional[bytes]: The content of the file, or None if an error occurs.
+    """
+    try:
+        # Get the cached Google Drive API service
+        service = get_drive_service()
 
-        # Download the file
+        # Download the file into an in-memory buffer
         request = service.files().get_media(fileId=file_id)
-        file_name_sanitized = file_name.replace("/","-")
-        file_path = os.path.join("/tmp/", file_name_sanitized)
-        with open(file_path, 'wb') as file:
-            downloader = MediaIoBaseDownload(file, request)
-            done = False
-            while done is False:
-                _, done = downloader.next_chunk()
+        buffer = io.BytesIO()
+        downloader = MediaIoBaseDownload(buffer, request)
+        done = False
+        while done is False:
+            _, done = downloader.next_chunk()
 
-        return file_path
+        return buffer.getvalue()
 
     except HttpError as error:
         print(f"An error occurred: {error}")
         return None
 
-def get_folder_contents(folder_id: str) -> Optional[List[Dict[str, str]]]:
+def get_file_text(folder_id: str, file_name: str, file: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """
+    Extract the text of a PDF or DOCX file stored in Google Drive.
+
+    The file is downloaded and parsed in memory. Extracted text is cached by the file's Drive
+    md5Checksum, so selecting the same document again neither downloads nor parses it.
+
+    Args:
+        folder_id (str): The ID of the Google Drive folder containing the file.
+        file_name (str): The name of the file.
+        file (Optional[Dict[str, str]]): The file details from `find_file`, if already known.
+
+    Returns:
+        Optional[str]: The extracted text content, or None if the file cannot be downloaded or read.
+    """
+    if file is None:
+        try:
+            file = find_file(folder_id, file_name)
+        except HttpError as error:
+            print(f"An error occurred: {error}")
+            return None
+
+    if not file:
+        print(f"File '{file_name}' not found in folder with ID '{folder_id}'.")
+        return None
+
+    # Serve documents that have already been extracted from the cache
+    cache = get_extraction_cache()
+    checksum = file.get("md5Checksum")
+    if checksum:
+        text = cache.get(checksum)
+        if text is not None:
+            return text
+
+    # Refuse documents too large to process within the webhook deadline
+    max_bytes = int(os.environ.get("MAX_DOCUMENT_BYTES", "10485760"))
+    if int(file.get("size") or 0) > max_bytes:
+        print(f"File '{file_name}' is larger than {max_bytes} bytes.")
+        return None
+
+    if file_name.endswith(".docx"):
+        extract = get_txt_docx_bytes
+    elif file_name.endswith(".pdf"):
+        extract = get_txt_pdf_bytes
+    else:
+        return None
+
+    data = download_file_bytes(file["id"])
+    text = extract(data) if data else None
+
+    if text and checksum:
+        cache.put(checksum, text)
+
+    return text
+
+def find_document(folder_id: str, file_name: str) -> Tuple[Optional[Dict[str, str]], str]:
+    """
+    Find a Drive document and build the key of its session artifacts.
+
+    The key is the Drive file ID and md5Checksum, so a document re-uploaded under the same name
+    gets new text, vectors and matches instead of those of its previous version.
+
+    Args:
+        folder_id (str): The ID of the Google Drive folder containing the file.
+        file_name (str): The name of the file.
+
+    Returns:
+        Tuple[Optional[Dict[str, str]], str]: The file details, or None if the file is not found,
+            and the artifact key, which falls back to the file name.
+    """
+    try:
+        file = find_file(folder_id, file_name)
+    except HttpError as error:
+        print(f"An error occurred: {error}")
+        file = None
+
+    if not file:
+        return None, file_name
+    return file, get_document_key(file)
+
+def get_document_key(file: Dict[str, str]) -> str:
+    """
+    Build the key of the session artifacts of a Drive document.
+
+    Args:
+        file (Dict[str, str]): The file details, as returned by `find_file` or `upload_bytes`.
+
+    Returns:
+        str: The Drive file ID and md5Checksum of the document.
+    """
+    return f"{file['id']}:{file.get('md5Checksum', '')}"
+
+def get_session_file_text(session_id: str, folder_id: str, file_name: str, artifact: str) -> Optional[str]:
+    """
+    Get the text of a Drive document from the session artifacts, extracting it when missing.
+
+    Args:
+        session_id (str): The session ID.
+        folder_id (str): The ID of the Google Drive folder containing the file.
+        file_name (str): The name of the file.
+        artifact (str): The artifact name, prefixed to the document key.
+
+    Returns:
+        Optional[str]: The extracted text content, or None if the file cannot be downloaded or read.
+    """
+    file, document_key = find_document(folder_id, file_name)
+    return get_artifact_store().get_or_create(session_id, f"{artifact}:{document_key}",
+        lambda: get_file_text(folder_id, file_name, file))
+
+@traced("drive.list_folder")
+def get_folder_contents(folder_id: str, refresh: bool = False) -> Optional[List[Dict[str, str]]]:
     """
     Get the contents of a Google Drive folder given its ID.
 
     Args:
         folder_id (str): The ID of the Google Drive folder.
+        refresh (bool): Whether to bypass the folder listing cache.
 
     Returns:
         Optional[List[Dict[str, str]]]: A list of dictionaries containing file details (id, name),
         or None if an error occurs.
     """
     try:
-        # Get credentials for Google Drive API
-        credentials = get_credentials()
+        # Serve the listing from the cache unless a fresh one is required
+        cache = get_folder_cache()
+        if not refresh:
+            files = cache.get(folder_id)
+            if files is not None:
+                return files
 
-        # Build the Google Drive API service
-        service = build('drive', 'v3', credentials=credentials)
+        # Get the cached Google Drive API service
+        service = get_drive_service()
 
         # List files in the specified folder
         response = service.files().list(
             q=f"'{folder_id}' in parents and trashed=false",
-            fields='files(id, name)'
+            fields='files(id, name, md5Checksum, size)'
         ).execute()
 
         # Extract file details from the response
         files = response.get('files', [])
+        cache.put(folder_id, files)
 
         return files
 
@@ -797,6 +2803,7 @@ def get_folder_contents(folder_id: str) -> Optional[List[Dict[str, str]]]:
         return None
 
 
+@traced("drive.create_folder")
 def create_folder(name: str, root: str) -> Optional[Tuple[str, str]]:
     """
     Create a new folder in Google Drive with the specified name and parent folder.
@@ -810,11 +2817,8 @@ def create_folder(name: str, root: str) -> Optional[Tuple[str, str]]:
         a public link to the folder, or None if an error occurs.
     """
     try:
-        # Get credentials for Google Drive API
-        credentials = get_credentials()
-
-        # Build the Google Drive API service
-        service = build('drive', 'v3', credentials=credentials)
+        # Get the cached Google Drive API service
+        service = get_drive_service()
 
         # Create metadata for the new folder
         file_metadata = {
@@ -847,6 +2851,114 @@ def create_folder(name: str, root: str) -> Optional[Tuple[str, str]]:
         print(f"An error occurred: {error}")
         return None
 
+# Sub-folders created in every session folder, in the order returned by create_session_folders
+SESSION_SUBFOLDERS = ["Resumes", "Cover Letters", "Matching Jobs"]
+
+@traced("drive.create_session_folders")
+def create_session_folders(session_id: str, root: str) -> Optional[List[Tuple[str, str]]]:
+    """
+    Create the Google Drive folder tree of a session in two batched round trips.
+
+    The first batch creates the session folder and reserves IDs for its sub-folders. The second
+    batch shares the session folder publicly and creates the sub-folders with the reserved IDs;
+    the sub-folders inherit the public permission from the session folder. If batching fails the
+    missing folders and permission are created one by one, reusing the session folder if the
+    first batch created it.
+
+    Args:
+        session_id (str): The session ID, used as the name of the session folder.
+        root (str): The ID of the parent folder where the session folder will be created.
+
+    Returns:
+        Optional[List[Tuple[str, str]]]: (folder ID, public link) pairs for the session folder followed
+        by the "Resumes", "Cover Letters" and "Matching Jobs" folders, or None if an error occurs.
+    """
+    responses = {}
+    errors = []
+    subfolder_ids = []
+
+    try:
+        # Get the cached Google Drive API service
+        service = get_drive_service()
+
+        def collect(request_id: str, response: Dict[str, Any], exception: Optional[HttpError]) -> None:
+            if exception is not None:
+                errors.append(exception)
+            else:
+                responses[request_id] = response
+
+        # First round trip: the session folder and the IDs of its sub-folders
+        batch = service.new_batch_http_request(callback=collect)
+        batch.add(service.files().create(body={
+            "name": session_id,
+            "parents": [root],
+            "mimeType": "application/vnd.google-apps.folder",
+        }, fields="id"), request_id="session")
+        batch.add(service.files().generateIds(count=len(SESSION_SUBFOLDERS), space="drive"), request_id="ids")
+        batch.execute()
+        if errors:
+            raise errors[0]
+
+        session_folder_id = responses["session"]["id"]
+        subfolder_ids = responses["ids"]["ids"]
+
+        # Second round trip: public sharing of the session folder and the sub-folders themselves
+        batch = service.new_batch_http_request(callback=collect)
+        batch.add(service.permissions().create(
+            fileId=session_folder_id,
+            body={'type': 'anyone', 'role': 'writer'},
+            fields='id'
+        ), request_id="permission")
+        for i, (name, folder_id) in enumerate(zip(SESSION_SUBFOLDERS, subfolder_ids)):
+            batch.add(service.files().create(body={
+                "id": folder_id,
+                "name": name,
+                "parents": [session_folder_id],
+                "mimeType": "application/vnd.google-apps.folder",
+            }, fields="id"), request_id=f"folder_{i}")
+        batch.execute()
+        if errors:
+            raise errors[0]
+
+        return [
+            (folder_id, f'https://drive.google.com/drive/folders/{folder_id}?usp=sharing')
+            for folder_id in [session_folder_id] + subfolder_ids
+        ]
+
+    except Exception as e:
+        print(f"Batched folder creation failed, creating the missing folders one by one: {e}")
+
+    # Reuse the session folder if the first batch created it, so that no shared folder is orphaned
+    session_folder_id = responses.get("session", {}).get("id")
+    if session_folder_id is None:
+        session_folder = create_folder(session_id, root)
+        if not session_folder:
+            return None
+    else:
+        session_folder = (session_folder_id, f'https://drive.google.com/drive/folders/{session_folder_id}?usp=sharing')
+        if "permission" not in responses:
+            try:
+                get_drive_service().permissions().create(
+                    fileId=session_folder_id,
+                    body={'type': 'anyone', 'role': 'writer'},
+                    fields='id'
+                ).execute()
+            except HttpError as error:
+                print(f"An error occurred: {error}")
+                return None
+
+    # Keep the sub-folders the second batch created and create the others
+    subfolders = []
+    for i, name in enumerate(SESSION_SUBFOLDERS):
+        if f"folder_{i}" in responses:
+            folder_id = subfolder_ids[i]
+            subfolders.append((folder_id, f'https://drive.google.com/drive/folders/{folder_id}?usp=sharing'))
+        else:
+            subfolders.append(create_folder(name, session_folder[0]))
+    if not all(subfolders):
+        return None
+    return [session_folder] + subfolders
+
 def get_credentials() -> Optional[Credentials]:
     """
     Retrieve Google API credentials for the specified scopes.
@@ -855,13 +2967,8 @@ def get_credentials() -> Optional[Credentials]:
         Optional[Credentials]: Google API credentials, or None if an error occurs.
     """
     try:
-        # Define the desired Google API scopes
-        CREDENTIAL_SCOPES = ["https://www.googleapis.com/auth/cloud-platform", "https://www.googleapis.com/auth/drive"]
-
-        # Use the google.auth.default function to get credentials
-        credentials, project_id = google.auth.default(scopes=CREDENTIAL_SCOPES)
-
-        return credentials
+        # Get the cached credentials, refreshed before they expire
+        return drive_tokens.get_credentials()
 
     except Exception as e:
         if hasattr(e, 'message'):
@@ -881,11 +2988,8 @@ def watch_changes(folder_id: str) -> None:
         None
     """
     try:
-        # Get credentials for Google Drive API
-        credentials = get_credentials()
-
-        # Build the Google Drive API service
-        service = build('drive', 'v3', credentials=credentials)
+        # Get the cached Google Drive API service
+        service = get_drive_service()
 
         # Create a watch request for the folder
         watch_request = {
@@ -905,6 +3009,7 @@ def watch_changes(folder_id: str) -> None:
             print('Error in setting up watch request: ' + str(e))
 
 @functions_framework.http
+@trace_webhook
 def webhook(request: Request) -> jsonify:
 	"""
 	Handle incoming webhook requests.
@@ -938,10 +3043,8 @@ def webhook(request: Request) -> jsonify:
 			tag = request_json["fulfillmentInfo"]["tag"]
 			if tag == "init_folders":
 				if "folders_created" not in session_parameters:
-					session_folder_id, session_folder_link = create_folder(session_id, root_folder_id)
-					resume_folder_id, resume_folder_link = create_folder("Resumes", session_folder_id)
-					cl_folder_id, cl_folder_link = create_folder("Cover Letters", session_folder_id)
-					matches_folder_id, matches_folder_link = create_folder("Matching Jobs", session_folder_id)
+					session_folders = create_session_folders(session_id, root_folder_id)
+					(session_folder_id, session_folder_link), (resume_folder_id, resume_folder_link), (cl_folder_id, cl_folder_link), (matches_folder_id, matches_folder_link) = session_folders
 					json_response = {
 						"sessionInfo": {
 							"parameters": {
@@ -960,10 +3063,8 @@ def webhook(request: Request) -> jsonify:
 					return jsonify(json_response)
 			if tag == "create_folder":
 				if "folders_created" not in session_parameters:
-					session_folder_id, session_folder_link = create_folder(session_id, root_folder_id)
-					resume_folder_id, resume_folder_link = create_folder("Resumes", session_folder_id)
-					cl_folder_id, cl_folder_link = create_folder("Cover Letters", session_folder_id)
-					matches_folder_id, matches_folder_link = create_folder("Matching Jobs", session_folder_id)
+					session_folders = create_session_folders(session_id, root_folder_id)
+					(session_folder_id, session_folder_link), (resume_folder_id, resume_folder_link), (cl_folder_id, cl_folder_link), (matches_folder_id, matches_folder_link) = session_folders
 					#watch_changes(folder_id)
 					html =  f'''
 					<p>Please use this folder to upload a copy of your resume.</p>
@@ -1045,7 +3146,8 @@ def webhook(request: Request) -> jsonify:
 				return jsonify(json_response)
 			if tag == "file_uploaded":
 				resume_folder_id = session_parameters["resume_folder_id"]
-				files = get_folder_contents(resume_folder_id)
+				# The user has just uploaded through the shared link, the cached listing cannot know about it
+				files = get_folder_contents(resume_folder_id, refresh=True)
 				if len(files) == 0:
 					text = "I was unable to find any files."
 					resume_folder_link = session_parameters["resume_folder_link"]
@@ -1122,61 +3224,38 @@ def webhook(request: Request) -> jsonify:
 			if tag == "file_confirmed":
 				for parameter in page_parameters:
 					if parameter["displayName"] == "files_displayed" and parameter["value"] == True:
+						pipeline = StagePipeline("file_confirmed")
+						artifacts = get_artifact_store()
 						file_name = request_json["text"][10:]
 						resume_folder_id = session_parameters["resume_folder_id"]
-						file_path = download_file(resume_folder_id, file_name)
-						if file_path and file_path.endswith(".docx"):
-							text = get_txt_docx(file_path)
-						if file_path and file_path.endswith(".pdf"):
-							text = get_txt_pdf(file_path)
+						# Artifacts are keyed on the Drive file ID and checksum, a resume re-uploaded under the same name starts afresh
+						resume_file, document_key = find_document(resume_folder_id, file_name)
+						text = artifacts.get_or_create(session_id, f"resume_text:{document_key}",
+							lambda: pipeline.run("download_extract", get_file_text, resume_folder_id, file_name, resume_file))
 						if text:
-							content = get_sentences(text)
-							token_count = get_token_count(content,"textembedding-gecko")
-							if token_count and token_count<3072:
-								vector = get_text_embedding(text)
-							else:
-								chunks = split_input(content,10000)
-								chunk_embeddings = []
-								chunk_lengths = []
-								for chunk in chunks:
-									vector = get_text_embedding(chunk["chunk_content"])
-									chunk_embeddings.append(vector)
-									chunk_lengths.append(chunk["chunk_size"])
-								vector = get_weighted_embeddings(chunk_embeddings,chunk_lengths)
-
-							matches = get_matches(vector)
+							vector = artifacts.get(session_id, f"resume_vector:{document_key}")
+							if vector is None:
+								# Whitespace does not count towards tokens, so the raw text can be counted while it is split into sentences
+								results = pipeline.run_concurrently({
+									"sentences": (get_sentences, (text,)),
+									"token_count": (count_tokens, (text, EMBEDDING_MODEL))
+								})
+								content = results["sentences"]
+								token_count = results["token_count"]
+								if token_count and token_count<EMBEDDING_TOKEN_LIMIT:
+									vector = pipeline.run("embedding", get_text_embedding, text)
+								else:
+									chunks = split_input(content,10000)
+									vector = pipeline.run("embedding", get_weighted_text_embedding, chunks)
+								if vector:
+									artifacts.put(session_id, f"resume_vector:{document_key}", vector)
+
+							matches = artifacts.get_or_create(session_id, f"matches:{document_key}",
+								lambda: pipeline.run("matching", get_matches, vector))
 							if len(matches)>0:
-								job_details = get_job_details(matches)
-								options = []
-								text = ''
-								for job in job_details:
-									match_distance = job['match_distance']
-									option_text = f"Export: {job['title']} id:{job['job_id']}"
-									text = f"Profile Match Distance: {match_distance}"
-									if job['formatted_work_type']:
-										text = text + f", Work Type: {job['formatted_work_type']}"
-									if job['min_salary']:
-										text = text + f", Minimum Salary: {job['min_salary']}"
-									if job['max_salary']:
-										text = text + f", Maximum Salary: {job['max_salary']}"
-									if job['pay_period']:
-										text = text + f", Pay Period: {job['pay_period']}"
-
-									options.append(
-										{
-											"type": "accordion",
-											"title": job["title"],
-											"subtitle": job["location"],
-											"text": text
-										})
-									options.append({
-											"type": "chips",
-											"options": [
-												{
-												"text": option_text
-												}
-											]
-										})
+								job_details = artifacts.get_or_create(session_id, f"job_details:{document_key}",
+									lambda: pipeline.run("job_details", get_job_details, matches))
+								options = get_match_options(job_details)
 								json_response = {
 									"page_info": {
 												"form_info": {
@@ -1221,15 +3300,20 @@ def webhook(request: Request) -> jsonify:
 										]
 									}
 								}
+						pipeline.log()
 
 				return jsonify(json_response)
 			if tag == "job_export":
 				job_id = request_json["text"].split("id:")[1]
 				job_name = request_json["text"][8:]
-				job_details = get_job(job_id)
+				artifacts = get_artifact_store()
+				job_details = artifacts.get_or_create(session_id, f"job:{job_id}", lambda: get_job(job_id))
 				matches_folder_id = session_parameters["matches_folder_id"]
 				matches_folder_link = session_parameters["matches_folder_link"]
 				upload_success = save_job(job_details,job_name,matches_folder_id)
+				if upload_success:
+					# Keep the text of the exported document for cover letters, under the key find_document builds for it
+					artifacts.put(session_id, f"job_text:{get_document_key(upload_success)}", get_job_text(job_details))
 				if upload_success:
 					html =  f'''
 					<p>The job details for {job_name} have been saved to Google Drive.</p>
@@ -1353,21 +3437,24 @@ def webhook(request: Request) -> jsonify:
 						job_name = parameter["value"]
 						job_name = job_name[10:]
 
-				resume_path = download_file(resume_folder_id, resume_name)
-				if resume_path and resume_path.endswith(".docx"):
-					resume_text = get_txt_docx(resume_path)
-				if resume_path and resume_path.endswith(".pdf"):
-					resume_text = get_txt_pdf(resume_path)
+				# The resume and the job document are independent, fetch them at the same time unless the session already has them
+				pipeline = StagePipeline("create_coverletter")
+				texts = pipeline.run_concurrently({
+					"resume": (get_session_file_text, (session_id, resume_folder_id, resume_name, "resume_text")),
+					"job": (get_session_file_text, (session_id, matches_folder_id, job_name, "job_text"))
+				})
+				resume_text = texts["resume"]
+				job_text = texts["job"]
 
-				job_path = download_file(matches_folder_id, job_name)
-				if job_path and job_path.endswith(".docx"):
-					job_text = get_txt_docx(job_path)
-				if job_path and job_path.endswith(".pdf"):
-					job_text = get_txt_pdf(job_path)
-
-				cl_text = generate_cover_letter(resume_text,job_text)
 				cl_file_name = job_name.split(".docx")[0]
-				upload_success = save_cl(cl_text,cl_file_name,cl_folder_id)
+				if os.environ.get("COVER_LETTER_STREAMING", "false") == "true":
+					# Buffered streaming: pieces are converted as the model produces them, the upload waits for the last one
+					cl_stream = generate_cover_letter_stream(resume_text, job_text)
+					upload_success = pipeline.run("generation_save", save_cl, cl_stream, cl_file_name, cl_folder_id)
+				else:
+					cl_text = pipeline.run("generation", generate_cover_letter, resume_text, job_text)
+					upload_success = pipeline.run("save", save_cl, cl_text, cl_file_name, cl_folder_id)
+				pipeline.log()
 				if upload_success:
 					html =  f'''
 					<p>The cover letter for {job_name} has been saved to Google Drive.</p>
@@ -1395,6 +3482,7 @@ def webhook(request: Request) -> jsonify:
 			if tag == "delete_folders":
 				session_folder_id = session_parameters["session_folder_id"]
 				folders_deleted = delete_folders(session_folder_id)
+				get_artifact_store().delete_session(session_id)
 				if folders_deleted:
 					json_response = {
 							'fulfillment_response': {
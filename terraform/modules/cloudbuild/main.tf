@@ -10,13 +10,13 @@ resource "google_cloudbuild_trigger" "cloud_functions" {
   location = var.build_region
 
   # Add a description for the trigger, indicating its purpose.
-  description = "Trigger to deploy the Cloud Function in the path ${var.included_files}"
+  description = "Trigger to deploy the Cloud Function in the path ${var.included_files[0]}"
 
   # Specify the filename for the Cloud Build configuration.
   filename = var.cloud_build_path
 
   # List of included files, typically the source code for the Cloud Function.
-  included_files = [var.included_files]
+  included_files = var.included_files
 
   # Configure the repository event that will trigger this build.
   repository_event_config {
@@ -23,8 +23,8 @@ variable "branch" {
   description = "The branch that is pushed to to trigger the build."
 }
 variable "included_files" {
-  type        = string
-  description = "The file path that triggers the build."
+  type        = list(string)
+  description = "The file paths that trigger the build."
 }
 variable "cloud_build_path" {
   type        = string
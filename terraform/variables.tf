@@ -39,7 +39,7 @@ variable "trigger_definitions" {
   type = list(object({
     trigger_name     = string
     branch           = string
-    included_files   = string
+    included_files   = list(string)
     cloud_build_path = string
     invert_regex     = bool
   }))